@@ -2,22 +2,30 @@ import streamlit as st
 import time
 import uuid
 
-from utils.query import get_answer
-from utils.postgres import (save_conversation, save_feedback,
-                            get_recent_conversations,
-                            get_feedback_stats)
+from utils.async_query import (get_answer_stream, iterate_async,
+                               save_conversation_async, submit_async)
+from utils.batch_writer import get_batch_writer
+from utils.postgres import (get_recent_conversations,
+                            get_feedback_stats, get_pool_stats)
+from utils.rollups import get_rollup_refresher
 
 def print_log(*message):
     print(*message, flush=True)
 
+def wait_for_pending_save():
+    # Feedback is only saved once its conversation is, for the dashboards
+    pending_save = st.session_state.pop('pending_save', None)
+    if pending_save is not None:
+        pending_save.result()
+
 def main():
     print_log("Starting the Course Assistant application")
     st.title("Course Assistant")
 
+    ## ====> Keep the dashboard rollups and monthly partitions up to date
+    rollup_refresher = get_rollup_refresher()
+
     # Session state initialization
-    if 'conversation_id' not in st.session_state:
-        st.session_state.conversation_id = str(uuid.uuid4())
-        print_log(f"New conversation started with ID: {st.session_state.conversation_id}")
     if 'count' not in st.session_state:
         st.session_state.count = 0
         print_log("Feedback count initialized to 0")
@@ -41,7 +49,7 @@ def main():
     # Search type selection
     search_type = st.radio(
         "Select search type:",
-        ["Text", "Vector"]
+        ["Text", "Vector", "Hybrid"]
     )
     print_log(f"User selected search type: {search_type}")
 
@@ -50,28 +58,43 @@ def main():
 
     if st.button("Submit"):
         print_log(f"User submitted question: {user_input}")
+        # One id per question: Postgres no longer enforces unique ids,
+        # and feedback is given on the latest answer
+        st.session_state.conversation_id = str(uuid.uuid4())
+        print_log(f"New conversation started with ID: {st.session_state.conversation_id}")
 
-        with st.spinner('Processing...'):
-            print_log(f"Getting answer from assistant using {model_choice} model and {search_type} search")
-            start_time = time.time()
-            answer_data = get_answer(user_input, course, model_choice, search_type)
-            end_time = time.time()
-            print_log(f"Answer received in {end_time - start_time:.2f} seconds")
-            st.success("Completed!")
-            st.write(answer_data['answer'])
-            
-            # Display monitoring information
-            st.write(f"Response time: {answer_data['response_time']:.2f} seconds")
-            st.write(f"Relevance: {answer_data['relevance']}")
-            st.write(f"Model used: {answer_data['model_used']}")
-            st.write(f"Total tokens: {answer_data['total_tokens']}")
-            if answer_data['openai_cost'] > 0:
-                st.write(f"OpenAI cost: ${answer_data['openai_cost']:.4f}")
-
-            # Save conversation to database
-            print_log("Saving conversation to database")
-            save_conversation(st.session_state.conversation_id, user_input, answer_data, course)
-            print_log("Conversation saved successfully")
+        print_log(f"Getting answer from assistant using {model_choice} model and {search_type} search")
+        start_time = time.time()
+        answer_data = {}
+        ## ====> Render the answer as it is generated
+        st.write_stream(iterate_async(
+            get_answer_stream(user_input, course, model_choice, search_type, answer_data)
+        ))
+        end_time = time.time()
+        print_log(f"Answer received in {end_time - start_time:.2f} seconds")
+        st.success("Completed!")
+
+        # Display monitoring information
+        st.write(f"Time to first token: {answer_data['time_to_first_token']:.2f} seconds")
+        st.write(f"Response time: {answer_data['response_time']:.2f} seconds")
+        st.write(f"Relevance: {answer_data['relevance']} (evaluated in the background)")
+        st.write(f"Model used: {answer_data['model_used']}")
+        if answer_data['cache_hit']:
+            st.write("Served from the answer cache")
+        st.write(f"Total tokens: {answer_data['total_tokens']}")
+        if answer_data['openai_cost'] > 0:
+            st.write(f"OpenAI cost: ${answer_data['openai_cost']:.4f}")
+
+        # Save conversation to database, overlapping with rendering
+        print_log("Saving conversation to database")
+        st.session_state.pending_save = submit_async(
+            save_conversation_async(
+                st.session_state.conversation_id, user_input, answer_data, course
+            )
+        )
+        st.session_state.pending_save.add_done_callback(
+            lambda _: print_log("Conversation saved successfully")
+        )
 
         st.write(f"Question submitted: {user_input}")
         st.session_state.submitted = True
@@ -83,7 +106,8 @@ def main():
             st.session_state.count += 1
             print_log(f"Positive feedback received. New count: {st.session_state.count}")
 
-            save_feedback(st.session_state.conversation_id, 1)
+            wait_for_pending_save()
+            get_batch_writer().save_feedback(st.session_state.conversation_id, 1)
             print_log("Positive feedback saved to database")
 
             st.rerun()
@@ -93,16 +117,20 @@ def main():
             st.session_state.count -= 1
             print_log(f"Negative feedback received. New count: {st.session_state.count}")
 
-            save_feedback(st.session_state.conversation_id, -1)
+            wait_for_pending_save()
+            get_batch_writer().save_feedback(st.session_state.conversation_id, -1)
             print_log("Negative feedback saved to database")
             
             st.rerun()
 
     st.write(f"Current count: {st.session_state.count}")
 
+    # Not waiting for the pending save here: the newest conversation may
+    # only be listed on the next run
     st.subheader("Recent Conversations")
     relevance_filter = st.selectbox(
-        "Filter by relevance:", ["All", "RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT"]
+        "Filter by relevance:",
+        ["All", "RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT", "PENDING", "NOT_EVALUATED"]
     )
     recent_conversations = get_recent_conversations(
         limit=5, relevance=relevance_filter if relevance_filter != "All" else None
@@ -120,6 +148,8 @@ def main():
     st.write(f"Thumbs up: {feedback_stats['thumbs_up']}")
     st.write(f"Thumbs down: {feedback_stats['thumbs_down']}")
 
+    print_log(f"Postgres pool stats: {get_pool_stats()}")
+    print_log(f"Rollup refresher stats: {rollup_refresher.stats}")
     print_log("Streamlit app loop completed")
 
 if __name__ == "__main__":
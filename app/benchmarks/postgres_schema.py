@@ -0,0 +1,303 @@
+"""
+This module benchmarks the queries of the app and of the Grafana
+dashboard on the unpartitioned schema of earlier versions, with primary
+keys only, and on the monthly partitioned schema of `init_db`, with its
+timestamp, relevance and feedback indexes.
+
+Both schemas are built side by side in the app database, as the
+`bench_unpartitioned` and `bench_partitioned` schemas, and filled
+server-side with the same synthetic conversations spread evenly over
+`days` days up to now, 70% of them with feedback. Every query runs under
+`EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`; the median execution time,
+the shared buffers touched and the number of tables, i.e. partitions,
+scanned are reported. The schemas are dropped at the end unless --keep
+is given.
+
+Usage:
+    python benchmarks/postgres_schema.py --n_rows 10000000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils.postgres import (CREATE_STATEMENTS, INDEX_STATEMENTS, UTC,
+                            create_partitions, get_conn_info,
+                            get_db_connection)
+
+SCHEMAS = ["bench_unpartitioned", "bench_partitioned"]
+
+UNPARTITIONED_STATEMENTS = [
+    """
+    CREATE TABLE conversations (
+        id TEXT PRIMARY KEY,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        course TEXT NOT NULL,
+        model_used TEXT NOT NULL,
+        response_time FLOAT NOT NULL,
+        time_to_first_token FLOAT,
+        relevance TEXT NOT NULL,
+        relevance_explanation TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        total_tokens INTEGER NOT NULL,
+        eval_prompt_tokens INTEGER NOT NULL,
+        eval_completion_tokens INTEGER NOT NULL,
+        eval_total_tokens INTEGER NOT NULL,
+        openai_cost FLOAT NOT NULL,
+        cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE feedback (
+        id SERIAL PRIMARY KEY,
+        conversation_id TEXT REFERENCES conversations(id),
+        feedback INTEGER NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+    """,
+]
+
+## Rows in time order, like the app inserts them; %(start)s and %(step)s
+## space them evenly
+INSERT_CONVERSATIONS = """
+    INSERT INTO conversations (
+        id, question, answer, course, model_used, response_time, time_to_first_token,
+        relevance, relevance_explanation, prompt_tokens, completion_tokens, total_tokens,
+        eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost,
+        cache_hit, timestamp
+    )
+    SELECT
+        'conv-' || i,
+        'Question ' || (i %% 1000),
+        'Answer ' || (i %% 1000),
+        (ARRAY['machine-learning-zoomcamp', 'data-engineering-zoomcamp', 'mlops-zoomcamp'])[1 + i %% 3],
+        (ARRAY['ollama/phi3', 'openai/gpt-3.5-turbo', 'openai/gpt-4o', 'openai/gpt-4o-mini'])[1 + i %% 4],
+        0.5 + (i %% 50) / 10.0,
+        0.1 + (i %% 10) / 10.0,
+        (ARRAY['RELEVANT', 'RELEVANT', 'PARTLY_RELEVANT', 'NON_RELEVANT'])[1 + (i / 7) %% 4],
+        'Explanation',
+        100 + i %% 400,
+        50 + i %% 200,
+        150 + i %% 600,
+        80 + i %% 100,
+        20 + i %% 50,
+        100 + i %% 150,
+        (i %% 100) / 10000.0,
+        i %% 20 = 0,
+        %(start)s + i * %(step)s
+    FROM generate_series(1, %(n_rows)s) AS i;
+"""
+
+INSERT_FEEDBACK = """
+    INSERT INTO feedback (conversation_id, feedback, timestamp)
+    SELECT id, CASE WHEN random() < 0.8 THEN 1 ELSE -1 END, timestamp + interval '30 seconds'
+    FROM conversations
+    WHERE hashtext(id) % 10 < 7
+    ORDER BY timestamp;
+"""
+
+## Name -> (query, whether it writes and is rolled back): the dashboard
+## panels over the last day or week, and the queries of the app
+QUERIES = {
+    "dashboard: last 5, day": ("""
+        SELECT timestamp AS time, question, answer, relevance
+        FROM conversations
+        WHERE timestamp BETWEEN now() - interval '1 day' AND now()
+        ORDER BY timestamp DESC LIMIT 5;
+    """, False),
+    "dashboard: feedback, day": ("""
+        SELECT
+            SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) AS thumbs_up,
+            SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) AS thumbs_down
+        FROM feedback
+        WHERE timestamp BETWEEN now() - interval '1 day' AND now();
+    """, False),
+    "dashboard: relevance, week": ("""
+        SELECT relevance, COUNT(*) AS count
+        FROM conversations
+        WHERE timestamp BETWEEN now() - interval '7 days' AND now()
+        GROUP BY relevance;
+    """, False),
+    "dashboard: models, week": ("""
+        SELECT model_used, COUNT(*) AS count
+        FROM conversations
+        WHERE timestamp BETWEEN now() - interval '7 days' AND now()
+        GROUP BY model_used;
+    """, False),
+    "dashboard: cost, day": ("""
+        SELECT timestamp AS time, openai_cost
+        FROM conversations
+        WHERE timestamp BETWEEN now() - interval '1 day' AND now() AND openai_cost > 0
+        ORDER BY timestamp;
+    """, False),
+    "app: recent conversations": ("""
+        SELECT c.*, f.feedback
+        FROM conversations c
+        LEFT JOIN feedback f ON c.id = f.conversation_id
+        ORDER BY c.timestamp DESC LIMIT 5;
+    """, False),
+    "app: recent NON_RELEVANT": ("""
+        SELECT c.*, f.feedback
+        FROM conversations c
+        LEFT JOIN feedback f ON c.id = f.conversation_id
+        WHERE c.relevance = 'NON_RELEVANT'
+        ORDER BY c.timestamp DESC LIMIT 5;
+    """, False),
+    "app: update relevance": ("""
+        UPDATE conversations SET relevance = 'RELEVANT'
+        WHERE id = 'conv-' || (%(n_rows)s - 100);
+    """, True),
+}
+
+## Partitioned indexes are summed over their partitions
+INDEX_SIZES_QUERY = """
+    SELECT
+        i.relname,
+        CASE WHEN i.relkind = 'I'
+            THEN (SELECT sum(pg_relation_size(relid)) FROM pg_partition_tree(i.oid))
+            ELSE pg_relation_size(i.oid)
+        END
+    FROM pg_class i
+    JOIN pg_namespace n ON n.oid = i.relnamespace
+    WHERE n.nspname = %s AND i.relkind IN ('i', 'I') AND NOT i.relispartition
+    ORDER BY 1;
+"""
+
+
+def build_schema(conn, schema, partitioned, n_rows, days):
+    """
+    Create a schema with either layout and fill it.
+
+    Returns:
+        float: The load time in seconds, indexes included.
+    """
+    start_time = time.perf_counter()
+    end = datetime.now(UTC)
+    start = end - timedelta(days=days)
+
+    conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    conn.execute(f"CREATE SCHEMA {schema};")
+    conn.execute(f"SET search_path TO {schema};")
+
+    if partitioned:
+        for create_statement in CREATE_STATEMENTS.values():
+            conn.execute(create_statement)
+        create_partitions(conn, start, end)
+    else:
+        for create_statement in UNPARTITIONED_STATEMENTS:
+            conn.execute(create_statement)
+
+    conn.execute(
+        INSERT_CONVERSATIONS,
+        {"start": start, "step": timedelta(days=days) / n_rows, "n_rows": n_rows},
+    )
+    conn.execute(INSERT_FEEDBACK)
+
+    if partitioned:
+        for index_statement in INDEX_STATEMENTS:
+            conn.execute(index_statement)
+    conn.execute("ANALYZE conversations, feedback;")
+
+    return time.perf_counter() - start_time
+
+
+def scanned_relations(plan):
+    """
+    Return the names of the tables scanned by a plan node and its children.
+    """
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        relations |= scanned_relations(child)
+    return relations
+
+
+def explain(conn, query, params, rollback):
+    """
+    Run a query under EXPLAIN ANALYZE.
+
+    Returns:
+        tuple: (execution ms, shared buffers hit and read, tables scanned).
+    """
+    with conn.transaction(force_rollback=rollback):
+        res = conn.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+        result = res.fetchone()[0]
+
+    if isinstance(result, str):
+        result = json.loads(result)
+    plan = result[0]["Plan"]
+    buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+
+    return result[0]["Execution Time"], buffers, len(scanned_relations(plan))
+
+
+def main(n_rows=10_000_000, days=365, repeats=5, keep=False):
+    """
+    Run the benchmark and print the timings.
+
+    Args:
+        n_rows (int, optional): Number of conversations. Default is 10M.
+        days (int, optional): Days the conversations span. Default is 365.
+        repeats (int, optional): Runs per query, the median is reported.
+        Default is 5.
+        keep (bool, optional): Whether to keep the benchmark schemas.
+        Default is False.
+    """
+    results = {}
+
+    with get_db_connection(**get_conn_info(is_setup=True)) as conn:
+        for schema in SCHEMAS:
+            partitioned = schema == "bench_partitioned"
+            load_time = build_schema(conn, schema, partitioned, n_rows, days)
+            print(f"{schema}: {n_rows} conversations loaded in {load_time:.1f} s", flush=True)
+
+            for name, (query, rollback) in QUERIES.items():
+                runs = [
+                    explain(conn, query, {"n_rows": n_rows}, rollback) for _ in range(repeats)
+                ]
+                results[schema, name] = (
+                    statistics.median(run[0] for run in runs),
+                    runs[-1][1],
+                    runs[-1][2],
+                )
+
+            sizes = conn.execute(INDEX_SIZES_QUERY, (schema,)).fetchall()
+            print("Index sizes (MB): " + ", ".join(
+                f"{index_name} {size / 2**20:.1f}" for index_name, size in sizes
+            ))
+
+        if not keep:
+            for schema in SCHEMAS:
+                conn.execute(f"DROP SCHEMA {schema} CASCADE;")
+
+    print(
+        f"\n{'query':<30}{'before (ms)':>13}{'after (ms)':>13}{'speedup':>10}"
+        f"{'buffers before':>16}{'buffers after':>15}{'tables':>8}"
+    )
+    for name in QUERIES:
+        before_ms, before_buffers, _ = results["bench_unpartitioned", name]
+        after_ms, after_buffers, n_tables = results["bench_partitioned", name]
+        print(
+            f"{name:<30}{before_ms:>13.2f}{after_ms:>13.2f}{before_ms / after_ms:>9.1f}x"
+            f"{before_buffers:>16}{after_buffers:>15}{n_tables:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument('--n_rows', type=int, default=10_000_000, help='Number of conversations')
+    parser.add_argument('--days', type=int, default=365, help='Days the conversations span')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per query')
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark schemas')
+    args = parser.parse_args()
+
+    main(n_rows=args.n_rows, days=args.days, repeats=args.repeats, keep=args.keep)
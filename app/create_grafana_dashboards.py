@@ -1,8 +1,10 @@
 import os
+import copy
 import json
 import argparse
 import time
 
+from utils.rollups import ALL_MODELS
 from utils.utils import initialize_env_variables, sleep_seconds
 from utils.grafana import (drop_grafana_data_source,
                            create_grafana_data_source, get_grafana_data_source,
@@ -10,6 +12,176 @@ from utils.grafana import (drop_grafana_data_source,
                            delete_dashboard)
 from exceptions.exceptions import WrongCliParams
 
+## Dashboard ranges up to this read the per-minute rollups, longer ones
+## the hourly rollups, so a panel reads at most a few thousand rows
+MINUTE_ROLLUP_MAX_RANGE = "2 days"
+
+
+def rollup_source(table):
+    """
+    Return the FROM clause reading the `<table>_minute` rollup over the
+    dashboard time range, or `<table>_hour` when the range is longer
+    than MINUTE_ROLLUP_MAX_RANGE.
+    """
+    range_length = "$__timeTo()::timestamptz - $__timeFrom()::timestamptz"
+    return (
+        "(\n"
+        f"  SELECT * FROM {table}_minute\n"
+        f"  WHERE $__timeFilter(bucket) AND {range_length} <= interval '{MINUTE_ROLLUP_MAX_RANGE}'\n"
+        "  UNION ALL\n"
+        f"  SELECT * FROM {table}_hour\n"
+        f"  WHERE $__timeFilter(bucket) AND {range_length} > interval '{MINUTE_ROLLUP_MAX_RANGE}'\n"
+        ") AS rollup"
+    )
+
+
+def rollup_sql(table, columns, group_by=None, time_series=False, where=None, aggregate=True):
+    """
+    Return a panel query aggregating `columns` over the rollup rows of
+    `table` matching `where`, per bucket as `time` for time series.
+    With `aggregate` False, the rows are read as they are.
+    """
+    if time_series:
+        columns = ["bucket AS time"] + columns
+        if aggregate:
+            group_by = ["bucket"] + (group_by or [])
+
+    sql = "SELECT\n  " + ",\n  ".join(columns) + f"\nFROM {rollup_source(table)}"
+    if where:
+        sql += f"\nWHERE {where}"
+    if group_by:
+        sql += "\nGROUP BY " + ", ".join(group_by)
+    if time_series:
+        sql += "\nORDER BY time"
+    return sql
+
+
+## Panel title -> type, position, and query over the rollups. Panels of
+## the dashboard JSON keep their look; others are copied from the first
+## panel of the same type. Latency percentiles are read from the
+## latency rollups, which hold one row per bucket and model: the
+## percentiles of the conversation rollup groups cannot be combined.
+ROLLUP_PANELS = {
+    "+1/-1": {
+        "type": "piechart",
+        "gridPos": {"h": 8, "w": 12, "x": 0, "y": 8},
+        "format": "table",
+        "rawSql": rollup_sql(
+            "feedback_rollups",
+            ["SUM(thumbs_up) AS thumbs_up", "SUM(thumbs_down) AS thumbs_down"],
+        ),
+    },
+    "Relevancy": {
+        "type": "gauge",
+        "gridPos": {"h": 8, "w": 12, "x": 12, "y": 8},
+        "format": "table",
+        "rawSql": rollup_sql(
+            "conversation_rollups", ["relevance", "SUM(conversations) AS count"], ["relevance"]
+        ),
+    },
+    "OpenAI cost": {
+        "type": "timeseries",
+        "gridPos": {"h": 8, "w": 12, "x": 0, "y": 16},
+        "format": "time_series",
+        "rawSql": rollup_sql(
+            "conversation_rollups", ["SUM(openai_cost) AS openai_cost"], time_series=True
+        ),
+    },
+    "Tokens": {
+        "type": "timeseries",
+        "gridPos": {"h": 8, "w": 12, "x": 12, "y": 16},
+        "format": "time_series",
+        "rawSql": rollup_sql(
+            "conversation_rollups",
+            ["model_used AS metric", "SUM(total_tokens) AS total_tokens"],
+            ["model_used"],
+            time_series=True,
+        ),
+    },
+    "Model used": {
+        "type": "barchart",
+        "gridPos": {"h": 8, "w": 12, "x": 0, "y": 24},
+        "format": "table",
+        "rawSql": rollup_sql(
+            "conversation_rollups", ["model_used", "SUM(conversations) AS count"], ["model_used"]
+        ),
+    },
+    "Response time": {
+        "type": "timeseries",
+        "gridPos": {"h": 9, "w": 12, "x": 12, "y": 24},
+        "format": "time_series",
+        "rawSql": rollup_sql(
+            "latency_rollups",
+            [
+                "response_time_sum / conversations AS mean",
+                "response_time_p50 AS p50",
+                "response_time_p95 AS p95",
+                "response_time_max AS max",
+                "time_to_first_token_p95",
+            ],
+            time_series=True,
+            where=f"model_used = '{ALL_MODELS}'",
+            aggregate=False,
+        ),
+    },
+    "Response time p95 by model": {
+        "type": "timeseries",
+        "gridPos": {"h": 8, "w": 12, "x": 0, "y": 33},
+        "format": "time_series",
+        "rawSql": rollup_sql(
+            "latency_rollups",
+            ["model_used AS metric", "response_time_p95 AS p95"],
+            time_series=True,
+            where=f"model_used <> '{ALL_MODELS}'",
+            aggregate=False,
+        ),
+    },
+    "Conversations by course": {
+        "type": "timeseries",
+        "gridPos": {"h": 8, "w": 12, "x": 12, "y": 33},
+        "format": "time_series",
+        "rawSql": rollup_sql(
+            "conversation_rollups",
+            ["course AS metric", "SUM(conversations) AS conversations"],
+            ["course"],
+            time_series=True,
+        ),
+    },
+}
+
+
+def generate_rollup_panels(panels):
+    """
+    Return the dashboard panels with every ROLLUP_PANELS panel querying
+    the rollups. Other panels, e.g. the last conversations, are kept.
+
+    Args:
+        panels (list): The panels of the dashboard JSON.
+
+    Returns:
+        list: The generated panels.
+    """
+    panels_by_title = {panel['title']: panel for panel in panels}
+    templates = {}
+    for panel in panels:
+        templates.setdefault(panel['type'], panel)
+    next_id = max(panel['id'] for panel in panels) + 1
+
+    for title, spec in ROLLUP_PANELS.items():
+        panel = panels_by_title.get(title)
+        if panel is None:
+            panel = copy.deepcopy(templates[spec['type']])
+            panel.update({'id': next_id, 'title': title, 'gridPos': dict(spec['gridPos'])})
+            next_id += 1
+            panels.append(panel)
+
+        target = panel['targets'][0]
+        target['format'] = spec['format']
+        target['rawSql'] = spec['rawSql']
+
+    return panels
+
+
 def main(datasource_name, recreate_ds=True):
     # Grafana settings
     grafana_host = os.getenv('GRAFANA_SETUP_HOST')
@@ -77,6 +249,9 @@ def main(datasource_name, recreate_ds=True):
     )
     with open(json_file_path, "r") as json_file:
         dashboard = json.load(json_file)
+        dashboard['dashboard']['panels'] = generate_rollup_panels(
+            dashboard['dashboard']['panels']
+        )
         for panel in dashboard['dashboard']['panels']:
             panel['datasource']['uid'] = datasource_uid
             for target in panel['targets']:
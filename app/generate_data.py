@@ -1,10 +1,33 @@
+"""
+Synthetic load generator for the conversations and feedback tables.
+
+Rows are generated vectorized with NumPy, in chunks of `batch_size`,
+and bulk-loaded with COPY by `workers` threads, each on its own pooled
+connection. Chunk k is generated from the seed and k only, so the data
+is the same for a given seed whatever the number of workers. Two modes:
+    1. history: `history_rows` rows spread over the last
+       `history_days` days, loaded as fast as possible
+    2. live: `rate` rows per second timestamped now, for `duration`
+       seconds or until Ctrl+C
+Each mode reports the throughput it achieved. The dashboard rollups
+are refreshed after the history, and periodically while live.
+
+Usage:
+    python generate_data.py --history_days 90 --history_rows 5000000 --workers 8
+    python generate_data.py --live_only true --rate 2000 --duration 60
+"""
+
 import time
-import random
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import argparse
 from zoneinfo import ZoneInfo
-from utils.postgres import save_conversation, save_feedback
+
+import numpy as np
+
+from utils.postgres import (CONVERSATION_COLUMNS, FEEDBACK_COLUMNS,
+                            ensure_partitions, pooled_connection)
+from utils.rollups import get_rollup_refresher, refresh_rollups
 from utils.utils import initialize_env_variables, load_json_document
 from exceptions.exceptions import WrongCliParams
 
@@ -20,110 +43,299 @@ TZ = ZoneInfo("Africa/Cairo")
 MODELS = ["ollama/phi3", "openai/gpt-3.5-turbo", "openai/gpt-4o", "openai/gpt-4o-mini"]
 RELEVANCE = ["RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT"]
 
-
-def get_random_answer(documents):
-    conversation_id = str(uuid.uuid4())
-    idx = random.randrange(0,len(documents))
-    question = documents[idx]['question']
-    course = documents[idx]['course']
-
-    ## Uniform relevance distribution.
-    relevance = random.choice(RELEVANCE)
-    answer = documents[idx]['question']
-
-    if relevance != "RELEVANT":
-        idx = random.randrange(0,len(documents))
-        answer = documents[idx]['question']
-        if relevance == "PARTLY_RELEVANT":
-            idx = random.randrange(0,len(documents))
-            answer = answer + "\n" + documents[idx]['question']
-
-    model = random.choice(MODELS)
-
-    openai_cost = 0
-    if model.startswith("openai/"):
-        openai_cost = random.uniform(0.001, 0.1)
-
-    answer_data = {
-        "answer": answer,
-        "response_time": random.uniform(0.5, 5.0),
-        "relevance": relevance,
-        "relevance_explanation": f"This answer is {relevance.lower()} to the question.",
-        "model_used": model,
-        "prompt_tokens": random.randint(50, 200),
-        "completion_tokens": random.randint(50, 300),
-        "total_tokens": random.randint(100, 500),
-        "eval_prompt_tokens": random.randint(50, 150),
-        "eval_completion_tokens": random.randint(20, 100),
-        "eval_total_tokens": random.randint(70, 250),
-        "openai_cost": openai_cost,
-    }
-    
-    return conversation_id, question, course, model, answer_data
-
-
-def generate_synthetic_data(documents, start_time, end_time):
-    current_time = start_time
-    conversation_count = 0
-    print(f"Starting historical data generation from {start_time} to {end_time}")
-
-    while current_time < end_time:
-        conversation_id, question, course, model, answer_data =\
-              get_random_answer(documents)
-
-        save_conversation(conversation_id, question, answer_data, course, current_time, is_setup=True)
-        print(
-            f"Saved conversation: ID={conversation_id}, Time={current_time}, Course={course}, Model={model}"
-        )
-
-        if random.random() < 0.7:
-            feedback = 1 if random.random() < 0.8 else -1
-            save_feedback(conversation_id, feedback, current_time, is_setup=True)
-            print(
-                f"Saved feedback for conversation {conversation_id}: {'Positive' if feedback > 0 else 'Negative'}"
-            )
-
-        current_time += timedelta(minutes=random.randint(1, 15))
-
-        conversation_count += 1
-        if conversation_count % 10 == 0:
-            print(f"Generated {conversation_count} conversations so far...")
-
-    print(
-        f"Historical data generation complete. Total conversations: {conversation_count}"
+FEEDBACK_RATE = 0.7
+POSITIVE_FEEDBACK_RATE = 0.8
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+## Positions of the 32 hex digits in an 8-4-4-4-12 UUID string
+UUID_DIGIT_POSITIONS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+
+
+def to_datetime64(timestamp):
+    """
+    Convert an aware datetime to a UTC datetime64[us].
+    """
+    return np.datetime64(timestamp.astimezone(ZoneInfo("UTC")).replace(tzinfo=None), "us")
+
+
+def generate_ids(rng, n_rows):
+    """
+    Return n_rows random UUID-formatted ids drawn from rng.
+    """
+    halves = rng.integers(0, 2**64, size=(n_rows, 2), dtype=np.uint64)
+    # Big-endian bytes -> one hex digit per nibble -> dashes inserted
+    id_bytes = halves.astype(">u8").view(np.uint8).reshape(n_rows, 16)
+    nibbles = np.stack([id_bytes >> 4, id_bytes & 0x0F], axis=-1).reshape(n_rows, 32)
+    digits = HEX_DIGITS[nibbles]
+    chars = np.full((n_rows, 36), ord("-"), dtype=np.uint8)
+    chars[:, UUID_DIGIT_POSITIONS] = digits
+    return chars.view("S36").ravel().astype(str).tolist()
+
+
+def generate_rows(questions, courses, timestamps, rng):
+    """
+    Generate conversation and feedback rows, one conversation per
+    timestamp.
+
+    Relevance and model are uniform. A relevant answer repeats the
+    question, a non-relevant one another question and a partly
+    relevant one two other questions.
+
+    Args:
+        questions (np.ndarray): Object array of document questions.
+        courses (np.ndarray): Object array of their courses.
+        timestamps (np.ndarray): datetime64[us] UTC timestamps.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        tuple: (conversation rows, feedback rows) as lists of tuples
+        in CONVERSATION_COLUMNS and FEEDBACK_COLUMNS order.
+    """
+    n_rows = len(timestamps)
+    n_documents = len(questions)
+
+    ids = generate_ids(rng, n_rows)
+    idx = rng.integers(0, n_documents, n_rows)
+    relevance_idx = rng.integers(0, len(RELEVANCE), n_rows)
+    model_idx = rng.integers(0, len(MODELS), n_rows)
+
+    answers = np.where(
+        relevance_idx == 0, questions[idx], questions[rng.integers(0, n_documents, n_rows)]
+    )
+    partly = relevance_idx == 1
+    answers[partly] = (
+        answers[partly] + "\n" + questions[rng.integers(0, n_documents, partly.sum())]
     )
 
+    relevance = np.array(RELEVANCE, dtype=object)[relevance_idx]
+    explanations = np.array(
+        [f"This answer is {name.lower()} to the question." for name in RELEVANCE], dtype=object
+    )[relevance_idx]
+    models = np.array(MODELS, dtype=object)[model_idx]
+
+    response_time = rng.uniform(0.5, 5.0, n_rows)
+    time_to_first_token = rng.uniform(0.1, 0.5, n_rows) * response_time
+    prompt_tokens = rng.integers(50, 201, n_rows)
+    completion_tokens = rng.integers(50, 301, n_rows)
+    eval_prompt_tokens = rng.integers(50, 151, n_rows)
+    eval_completion_tokens = rng.integers(20, 101, n_rows)
+    openai_cost = np.where(
+        np.char.startswith(models.astype(str), "openai/"), rng.uniform(0.001, 0.1, n_rows), 0.0
+    )
 
-def generate_live_data(documents):
-    conversation_count = 0
-    print("Starting live data generation...")
-    while True:
-        current_time = datetime.now(TZ)
-        conversation_id, question, course, model, answer_data =\
-              get_random_answer(documents)
-
-        save_conversation(conversation_id, question, answer_data, course, current_time, is_setup=True)
+    # COPY parses ISO 8601 strings, which NumPy formats in one call
+    timestamp_strings = np.datetime_as_string(timestamps, unit="us", timezone="UTC").tolist()
+
+    conversations = list(zip(
+        ids,
+        questions[idx].tolist(),
+        answers.tolist(),
+        courses[idx].tolist(),
+        models.tolist(),
+        response_time.tolist(),
+        time_to_first_token.tolist(),
+        relevance.tolist(),
+        explanations.tolist(),
+        prompt_tokens.tolist(),
+        completion_tokens.tolist(),
+        (prompt_tokens + completion_tokens).tolist(),
+        eval_prompt_tokens.tolist(),
+        eval_completion_tokens.tolist(),
+        (eval_prompt_tokens + eval_completion_tokens).tolist(),
+        openai_cost.tolist(),
+        [False] * n_rows,
+        timestamp_strings,
+    ))
+
+    has_feedback = np.flatnonzero(rng.random(n_rows) < FEEDBACK_RATE)
+    feedback = np.where(rng.random(len(has_feedback)) < POSITIVE_FEEDBACK_RATE, 1, -1)
+    feedbacks = [
+        (ids[row], value, timestamp_strings[row])
+        for row, value in zip(has_feedback.tolist(), feedback.tolist())
+    ]
+
+    return conversations, feedbacks
+
+
+def copy_rows(conversations, feedbacks):
+    """
+    Bulk-load rows with COPY in one transaction.
+    """
+    with pooled_connection(is_setup=True) as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # One transaction, so no feedback row is visible without its conversation
+                for table, columns, rows in [
+                    ("conversations", CONVERSATION_COLUMNS, conversations),
+                    ("feedback", FEEDBACK_COLUMNS, feedbacks),
+                ]:
+                    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                        for row in rows:
+                            copy.write_row(row)
+
+
+class LoadGenerator:
+    """
+    Generates chunks of rows and loads them with a pool of workers.
+
+    Attributes:
+        workers (int): Number of loading threads.
+        batch_size (int): Rows per chunk, i.e. per COPY transaction.
+        seed (int): The seed of the data.
+        conversations (int): Conversations loaded by the current mode.
+        feedbacks (int): Feedback rows loaded by the current mode.
+    """
+
+    def __init__(self, documents, workers=4, batch_size=10_000, seed=42):
+        """
+        Initializes the LoadGenerator.
+
+        Args:
+            documents (list): Documents with 'question' and 'course' keys.
+            workers (int): Number of loading threads. Defaults to 4.
+            batch_size (int): Rows per chunk. Defaults to 10000.
+            seed (int): The seed of the data. Defaults to 42.
+        """
+        self.questions = np.array([doc['question'] for doc in documents], dtype=object)
+        self.courses = np.array([doc['course'] for doc in documents], dtype=object)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.seed = seed
+
+        self.conversations = 0
+        self.feedbacks = 0
+        self._next_chunk = 0
+
+    def load_chunk(self, chunk_index, make_timestamps):
+        """
+        Generate and load one chunk.
+
+        Args:
+            chunk_index (int): The index of the chunk, which seeds it.
+            make_timestamps (callable): Takes the chunk's random
+            generator and returns its datetime64[us] timestamps.
+
+        Returns:
+            tuple: The numbers of conversation and feedback rows.
+        """
+        rng = np.random.default_rng([self.seed, chunk_index])
+        conversations, feedbacks = generate_rows(
+            self.questions, self.courses, make_timestamps(rng), rng
+        )
+        copy_rows(conversations, feedbacks)
+        return len(conversations), len(feedbacks)
+
+    def report(self, label, elapsed):
+        """
+        Print the rows loaded so far and the achieved throughput.
+        """
+        rows = self.conversations + self.feedbacks
         print(
-            f"Saved live conversation: ID={conversation_id}, Time={current_time}, Course={course}, Model={model}"
+            f"{label}: {self.conversations} conversations and {self.feedbacks} feedback rows "
+            f"in {elapsed:.1f}s, {self.conversations / elapsed:,.0f} conversations/s, "
+            f"{rows / elapsed:,.0f} rows/s",
+            flush=True,
         )
 
-        if random.random() < 0.7:
-            feedback = 1 if random.random() < 0.8 else -1
-            save_feedback(conversation_id, feedback, current_time, is_setup=True)
-            print(
-                f"Saved feedback for live conversation {conversation_id}: {'Positive' if feedback > 0 else 'Negative'}"
-            )
-
-        conversation_count += 1
-        if conversation_count % 10 == 0:
-            print(f"Generated {conversation_count} live conversations so far...")
-
-        time.sleep(1)
+    def generate_history(self, start_time, end_time, n_rows):
+        """
+        Load n_rows conversations spread evenly, with jitter, between
+        start_time and end_time, as fast as possible.
+        """
+        start = to_datetime64(start_time)
+        step = (to_datetime64(end_time) - start).astype(np.int64) / n_rows
+        print(f"Generating {n_rows} conversations from {start_time} to {end_time}", flush=True)
+        self.conversations = self.feedbacks = 0
+        ensure_partitions(start_time, end_time, is_setup=True)
+
+        def load(first_row):
+            n_chunk_rows = min(self.batch_size, n_rows - first_row)
+
+            def make_timestamps(rng):
+                rows = np.arange(first_row, first_row + n_chunk_rows) + rng.random(n_chunk_rows)
+                return start + (rows * step).astype("timedelta64[us]")
+
+            return self.load_chunk(self._next_chunk + first_row // self.batch_size, make_timestamps)
+
+        start_clock = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for conversations, feedbacks in pool.map(load, range(0, n_rows, self.batch_size)):
+                self.conversations += conversations
+                self.feedbacks += feedbacks
+        self._next_chunk += -(-n_rows // self.batch_size)
+
+        self.report("History", time.perf_counter() - start_clock)
+
+        start_clock = time.perf_counter()
+        with pooled_connection(is_setup=True) as conn:
+            refresh_rollups(conn, since=start_time)
+        print(f"Rollups refreshed in {time.perf_counter() - start_clock:.1f} s", flush=True)
+
+    def generate_live(self, rate, duration=None, tick=0.1, report_every=10):
+        """
+        Load `rate` conversations per second timestamped now, for
+        `duration` seconds or until interrupted.
+
+        A chunk of rate * tick rows is scheduled every `tick` seconds.
+        When loading falls behind, the achieved rate is reported below
+        the target.
+        """
+        chunk_rows = max(1, min(self.batch_size, round(rate * tick)))
+        interval = chunk_rows / rate
+        print(f"Generating {rate} conversations/s in chunks of {chunk_rows}", flush=True)
+        self.conversations = self.feedbacks = 0
+
+        def make_timestamps(rng):
+            return np.full(chunk_rows, np.datetime64(time.time_ns() // 1000, "us"))
+
+        start_clock = time.perf_counter()
+        next_report = start_clock + report_every
+        pending = []
+
+        def collect(future):
+            conversations, feedbacks = future.result()
+            self.conversations += conversations
+            self.feedbacks += feedbacks
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                n_chunks = 0
+                while duration is None or n_chunks * interval < duration:
+                    delay = start_clock + n_chunks * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                    pending.append(pool.submit(self.load_chunk, self._next_chunk, make_timestamps))
+                    self._next_chunk += 1
+                    n_chunks += 1
+
+                    # At most two chunks per worker in flight
+                    while len(pending) > 2 * self.workers:
+                        collect(pending.pop(0))
+                    if time.perf_counter() >= next_report:
+                        self.report("Live", time.perf_counter() - start_clock)
+                        next_report += report_every
+            finally:
+                for future in pending:
+                    collect(future)
+                self.report("Live", time.perf_counter() - start_clock)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Reading control parameters.")
     parser.add_argument('--live_only', type=str, required=False, help='Value of live_only')
+    parser.add_argument('--history_days', type=float, default=0.25, help='Days of history')
+    parser.add_argument(
+        '--history_rows', type=int, default=None,
+        help='Conversations of history, one per 8 minutes by default'
+    )
+    parser.add_argument('--rate', type=float, default=1.0, help='Live conversations per second')
+    parser.add_argument(
+        '--duration', type=float, default=None, help='Live seconds, until Ctrl+C if unset'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='Loading threads')
+    parser.add_argument('--batch_size', type=int, default=10_000, help='Rows per COPY')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the data')
     args = parser.parse_args()
 
     live_only = args.live_only
@@ -141,18 +353,23 @@ if __name__ == "__main__":
     documents_path = f'{PROJECT_DIR}/data/documents.json'
     documents = load_json_document(documents_path)
 
+    generator = LoadGenerator(
+        documents, workers=args.workers, batch_size=args.batch_size, seed=args.seed
+    )
+
     print(f"Script started at {datetime.now(TZ)}")
     if not live_only:
         end_time = datetime.now(TZ)
-        start_time = end_time - timedelta(hours=6)
-        print(f"Generating historical data from {start_time} to {end_time}")
-        generate_synthetic_data(documents, start_time, end_time)
+        start_time = end_time - timedelta(days=args.history_days)
+        history_rows = args.history_rows or max(1, round(args.history_days * 24 * 60 / 8))
+        generator.generate_history(start_time, end_time, history_rows)
         print("Historical data generation complete.")
 
     print("Starting live data generation... Press Ctrl+C to stop.")
+    get_rollup_refresher(is_setup=True)
     try:
-        generate_live_data(documents)
+        generator.generate_live(args.rate, args.duration)
     except KeyboardInterrupt:
         print(f"Live data generation stopped at {datetime.now(TZ)}.")
     finally:
-        print(f"Script ended at {datetime.now(TZ)}")
\ No newline at end of file
+        print(f"Script ended at {datetime.now(TZ)}")
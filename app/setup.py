@@ -5,39 +5,136 @@ import argparse
 # Replace with root project dir
 PROJECT_DIR = "/mnt/workspace/__ing/llming/DTC/course/app"
 EXPECTED_MAPPING = [
-    'text', 'section', 'question', 'course', 'id', 'question_text_vector'
+    'text', 'section', 'question', 'course', 'id', 'content_hash',
+    'question_text_vector'
 ]
+SYNC_MODES = ['delta', 'full']
 sys.path.append(PROJECT_DIR)
 
 from utils.utils import (
     initialize_env_variables,
     load_json_document,
     id_documents,
+    hash_documents,
 )
 
 from utils.elasticsearch import (
     create_elasticsearch_client,
-    remove_elasticsearch_index,
-    search_elasticsearch_indecis,
     load_index_settings,
-    create_elasticsearch_index,
-    index_document,
+    bulk_index_documents,
+    bulk_delete_documents,
     get_index_mapping,
-    get_indexed_documents_count,
+    scan_field_values,
+    get_alias_indices,
+    create_next_index_version,
+    warm_index,
+    swap_alias,
+    remove_old_index_versions,
 )
 
 from utils.ollama import (
     create_ollama_client,
-    embed_document,
+    embed_documents,
 )
 
+from utils.embedding_cache import get_embedding_cache
+
 from utils.postgres import init_db
+from utils.rollups import init_rollups
+
+
+def embed_and_index(es_client, index_name, documents):
+    """Embed documents with Ollama and upsert them into an index.
+    """
+    ## ====> Ollama Client
+    ollama_host = os.environ.get('OLLAMA_SETUP_HOST', 'localhost')
+    ollama_port = os.environ.get('OLLAMA_PORT', 11434)
+    ollama_client = create_ollama_client(ollama_host, ollama_port)
+
+    ## ====> Model
+    embed_model_name = os.environ.get('EMBED_MODEL')
+
+    print("Documents vectorization: ...")
+    vectorized_documents = embed_documents(
+        ollama_client, documents, embed_model_name
+    )
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+
+    ## ====> Indexing...
+    print(f"Documents indexing in es index {index_name}: ...")
+    summary = bulk_index_documents(
+        es_client, index_name, vectorized_documents, id_field='id', timeout=60
+    )
+    for error in summary['errors']:
+        print(f"{error['type']}: {error['reason']}", "id:", error['id'], "-> Skipped...")
+    print(
+        f"Indexed {summary['indexed']}/{len(vectorized_documents)} documents "
+        f"in {summary['seconds']:.1f}s ({summary['retried']} retried)"
+    )
+
+
+def rebuild_es_index(es_client, alias, index_settings, documents, keep_versions=1):
+    """Blue/green rebuild of the index behind an alias.
+
+    The next version `{alias}-v{N}` is created, loaded and warmed
+    while the alias keeps serving the current version. The alias is
+    then swapped in one atomic request and old versions are removed,
+    keeping `keep_versions` of them for rollback.
+    """
+    new_index_name = create_next_index_version(es_client, alias, index_settings)
+    embed_and_index(es_client, new_index_name, documents)
+    warm_index(es_client, new_index_name)
+    swap_alias(es_client, alias, new_index_name)
+    remove_old_index_versions(es_client, alias, keep=keep_versions)
 
-from utils.multithread import map_progress
 
+def sync_es_index(es_client, index_name, documents, sync_mode='delta'):
+    """Upsert new or changed documents and delete removed ones.
 
-def setup_es(reindex_es=False):
+    In 'delta' mode only new or changed documents are embedded and
+    upserted; 'full' re-embeds and upserts every document.
+    """
+    indexed_hashes = scan_field_values(es_client, index_name, 'content_hash')
+    if sync_mode == 'full':
+        changed_documents = documents
+    else:
+        changed_documents = [
+            document for document in documents
+            if indexed_hashes.get(document['id']) != document['content_hash']
+        ]
+    document_ids = {document['id'] for document in documents}
+    removed_ids = [
+        document_id for document_id in indexed_hashes if document_id not in document_ids
+    ]
+    print(
+        f"Sync ({sync_mode}): {len(changed_documents)} to upsert, "
+        f"{len(removed_ids)} to delete, {len(documents)} documents"
+    )
+
+    if changed_documents:
+        embed_and_index(es_client, index_name, changed_documents)
+
+    if removed_ids:
+        print("Removed documents deletion in es: ...")
+        summary = bulk_delete_documents(es_client, index_name, removed_ids, timeout=60)
+        for error in summary['errors']:
+            print(f"{error['type']}: {error['reason']}", "id:", error['id'], "-> Skipped...")
+        print(f"Deleted {summary['indexed']}/{len(removed_ids)} documents")
+
+    if not changed_documents and not removed_ids:
+        print(f"Index {index_name} is up to date with {len(documents)} documents")
+
+
+def setup_es(reindex_es=False, sync_mode='delta'):
     """Setup ElasticSearch Index.
+
+    `ES_INDEX_NAME` is an alias to a versioned index
+    `{ES_INDEX_NAME}-v{N}`. Documents are indexed with their `id` as
+    `_id` and a `content_hash` of their content.
+
+    A rebuild (requested, missing alias or incorrect mapping) loads a
+    new version and swaps the alias, so queries never see an empty
+    index. Otherwise the live index is synced (see `sync_es_index`).
     """
     ## ====> ElasticSearch Client
     es_host = os.environ.get('ELASTIC_SETUP_HOST', 'localhost')
@@ -52,66 +149,47 @@ def setup_es(reindex_es=False):
         )
     index_settings = load_index_settings(index_settings_path)
 
-    ## Check: if index is already created, do not recreate.
-    if reindex_es:
-        print("Recreating ElasticSearch Index {index_name}...")
-        remove_elasticsearch_index(es_client, index_name)
+    ## ====> Load Documents
+    documents_path = f'{PROJECT_DIR}/data/documents.json'
+    documents = load_json_document(documents_path)
+    documents = hash_documents(id_documents(documents))
+
+    ## Documents with the same id share one `_id`, keep the last one
+    documents = list({document['id']: document for document in documents}.values())
 
-    if index_name not in search_elasticsearch_indecis(es_client):
-        create_elasticsearch_index(es_client, index_name, index_settings)
-    ## Check: if the mapping is correct, recreate if not.
+    ## Check: rebuild if requested, if the alias is missing or if the mapping is incorrect.
+    if reindex_es:
+        rebuild_reason = "requested"
+    elif not get_alias_indices(es_client, index_name):
+        rebuild_reason = f"no index behind alias {index_name}"
     elif sorted(
             list(get_index_mapping(es_client, index_name).keys())
         ) != sorted(EXPECTED_MAPPING):
-        print(f"Incorrect Mapping of index {index_name}, recreating...")
-        remove_elasticsearch_index(es_client, index_name)
-        create_elasticsearch_index(es_client, index_name, index_settings)
+        rebuild_reason = f"incorrect mapping of index {index_name}"
     else:
-        print(f"Index {index_name} is already created.")
-
-    ## ====> Load Documents
-    documents_path = f'{PROJECT_DIR}/data/documents.json'
-    documents = load_json_document(documents_path)
-    documents = id_documents(documents)
-
-    if get_indexed_documents_count(es_client,index_name)['count'] != len(documents):     
-        ## ====> Ollama Client
-        ollama_host = os.environ.get('OLLAMA_SETUP_HOST', 'localhost')
-        ollama_port = os.environ.get('OLLAMA_PORT', 11434)
-        ollama_client = create_ollama_client(ollama_host, ollama_port)
-
-        ## ====> Model
-        embed_model_name = os.environ.get('EMBED_MODEL')
-
-        print("Documents vectorization: ...")
-        vectorized_documents = map_progress(
-            f=lambda document: embed_document(
-                ollama_client, document, embed_model_name),
-            seq=documents,
-            max_workers=6,
-        )
+        rebuild_reason = None
 
-        ## ====> Indexing...
-        print("Documents indexing in es: ...")
-        map_progress(
-            f=lambda document: index_document(
-                es_client, index_name, document, timeout=60),
-            seq=vectorized_documents,
-            max_workers=6,
-        )
+    if rebuild_reason:
+        print(f"Rebuilding ElasticSearch Index {index_name} ({rebuild_reason})...")
+        rebuild_es_index(es_client, index_name, index_settings, documents)
     else:
-        print(f"Index {index_name} already has {len(documents)} documents")
-
+        print(f"Index {index_name} is already created.")
+        sync_es_index(es_client, index_name, documents, sync_mode)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Reading control parameters.")
     parser.add_argument('--reindex_es', type=str, required=True, help='Value of reindex_es')
     parser.add_argument('--reinit_db', type=str, required=True, help='Value of reinit_db')
+    parser.add_argument(
+        '--sync_mode', type=str, default='delta', choices=SYNC_MODES,
+        help='Upsert only new or changed documents (delta) or all documents (full)'
+    )
     args = parser.parse_args()
 
     reindex_es = True if args.reindex_es == "true" else False
     reinit_db = True if args.reinit_db == "true" else False
 
     initialize_env_variables(PROJECT_DIR)
-    setup_es(reindex_es)
-    init_db(reinit_db)
\ No newline at end of file
+    setup_es(reindex_es, args.sync_mode)
+    init_db(reinit_db)
+    init_rollups(is_setup=True)
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+This module provides a cache of answers in front of `get_answer`, for
+the many students who ask the same FAQ question in slightly different
+words.
+
+An answer is cached under (normalized question, course, model, search
+type) and can be found in two ways:
+    1. Exact: the same normalized question
+    2. Semantic: the cosine similarity of the question embeddings, among
+       the entries of the same course, model and search type, is at
+       least `similarity_threshold`
+Entries expire after `ttl` seconds, the least recently used entry is
+evicted beyond `max_items`, and the whole cache is cleared when the
+version of the Elasticsearch index changes.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.embedding_cache import normalize_text
+
+
+def normalize_question(question):
+    """
+    Normalize a question for exact lookups: whitespace runs become one
+    space, case is folded and trailing punctuation is dropped.
+
+    Args:
+        question (str): The question.
+
+    Returns:
+        str: The normalized question.
+    """
+    return re.sub(r"[\s?!.]+$", "", normalize_text(question).lower())
+
+
+class AnswerCache:
+    """
+    An in-memory TTL/LRU cache of answers with exact and semantic
+    lookups. All methods are thread-safe.
+
+    Attributes:
+        max_items (int): Maximum number of entries.
+        ttl (float): Seconds an entry stays valid.
+        similarity_threshold (float): Minimum cosine similarity of a
+            semantic hit, None to disable semantic lookups.
+        index_version (str): The index version of the entries.
+        exact_hits (int): Lookups answered by an exact match.
+        semantic_hits (int): Lookups answered by a similar question.
+        misses (int): Lookups not in the cache.
+    """
+
+    def __init__(self, max_items=1000, ttl=24 * 3600, similarity_threshold=0.95):
+        """
+        Initializes the AnswerCache.
+
+        Args:
+            max_items (int): Maximum number of entries. Defaults to 1000.
+            ttl (float): Seconds an entry stays valid. Defaults to one day.
+            similarity_threshold (float): Minimum cosine similarity of a
+                semantic hit, None to disable. Defaults to 0.95.
+        """
+        self.max_items = max_items
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.index_version = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        # key -> (answer_data, unit embedding or None, expiry time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(question, course, model_choice, search_type):
+        """
+        Return the exact-lookup key of a question.
+        """
+        return normalize_question(question), course, model_choice, search_type
+
+    def set_index_version(self, index_version):
+        """
+        Record the current index version, clearing the cache if it changed.
+
+        Args:
+            index_version (str): The version of the index answers come from.
+        """
+        with self._lock:
+            if index_version != self.index_version:
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, key, embedding=None, count_miss=True):
+        """
+        Look up an answer by exact key, then by embedding similarity.
+
+        Args:
+            key (tuple): The key from `make_key`.
+            embedding (list, optional): The question embedding, needed
+                for semantic lookups.
+            count_miss (bool): Whether a miss counts in `misses`; False
+                for an exact lookup followed by a semantic one.
+
+        Returns:
+            tuple: (answer_data, hit type) where the hit type is 'exact'
+            or 'semantic', or (None, None) on a miss.
+        """
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return dict(self._entries[key][0]), "exact"
+
+            if embedding is not None and self.similarity_threshold is not None:
+                candidates = [
+                    (candidate_key, entry[1])
+                    for candidate_key, entry in self._entries.items()
+                    if candidate_key[1:] == key[1:] and entry[1] is not None
+                ]
+                if candidates:
+                    similarities = np.stack([vector for _, vector in candidates]) @ unit_vector(
+                        embedding
+                    )
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        best_key = candidates[best][0]
+                        self._entries.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return dict(self._entries[best_key][0]), "semantic"
+
+            if count_miss:
+                self.misses += 1
+            return None, None
+
+    def put(self, key, answer_data, embedding=None):
+        """
+        Store an answer, evicting the least recently used entries.
+
+        Args:
+            key (tuple): The key from `make_key`.
+            answer_data (dict): The `get_answer` dictionary.
+            embedding (list, optional): The question embedding, for
+                semantic lookups.
+        """
+        vector = None if embedding is None else unit_vector(embedding)
+
+        with self._lock:
+            self._entries[key] = (dict(answer_data), vector, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Return the hit/miss counters.
+
+        Returns:
+            dict: exact_hits, semantic_hits, misses, hit_rate and the
+            number of entries.
+        """
+        with self._lock:
+            n_lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / n_lookups
+                if n_lookups
+                else 0.0,
+                "items": len(self._entries),
+            }
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.exact_hits = self.semantic_hits = self.misses = 0
+
+    def _expire(self, now):
+        """
+        Drop the expired entries.
+        """
+        expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+def unit_vector(embedding):
+    """
+    Return an embedding as an L2-normalized float32 array.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -0,0 +1,758 @@
+"""
+This module provides the asyncio version of the RAG hot path in
+`utils.query`: embedding, Elasticsearch text/kNN/hybrid search, LLM
+answer and LLM-as-a-judge evaluation, ending in `get_answer` and its
+streaming version `get_answer_stream`.
+
+All coroutines run on one background event loop shared by the whole
+process (see `run_async` and `submit_async`), so the async
+Elasticsearch and OpenAI clients, and their connection pools, are
+shared by every Streamlit session. Each backend has its own
+semaphore, which bounds the number of concurrent requests to it:
+    1. elasticsearch: $ES_MAX_CONCURRENCY (default 16)
+    2. ollama: $OLLAMA_MAX_CONCURRENCY (default 4)
+    3. openai: $OPENAI_MAX_CONCURRENCY (default 16)
+
+LLM-as-a-judge evaluation is not on the request path: `get_answer`
+returns with relevance 'PENDING' and `save_conversation_async` hands
+the conversation to a `JudgeQueue`, configured by $JUDGE_WORKERS
+(default 2), $JUDGE_SAMPLE_RATE (default 1.0), $JUDGE_PEAK_SAMPLE_RATE
+(default 0.1) and $JUDGE_QUEUE_SIZE (default 1000).
+
+Answers are looked up in an `AnswerCache` before retrieval, configured
+by $ANSWER_CACHE_SIZE (default 1000), $ANSWER_CACHE_TTL (seconds,
+default 86400) and $ANSWER_CACHE_SIMILARITY (default 0.95, empty to
+disable semantic lookups). It is cleared when the index behind the
+alias changes, i.e. after a blue/green rebuild; delta syncs into the
+same index only take effect on cached answers once they expire.
+Cache hits are saved with cache_hit set and no tokens or cost.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from openai import AsyncOpenAI
+
+from utils.answer_cache import AnswerCache
+from utils.batch_writer import get_batch_writer
+from utils.embedding_cache import get_embedding_cache
+from utils.fusion import reciprocal_rank_fusion
+from utils.judge_queue import (NOT_EVALUATED_RELEVANCE, PENDING_RELEVANCE,
+                               JudgeQueue)
+from utils.ollama import estimate_tokens
+from utils.postgres import TZ, update_conversations_relevance
+from utils.query import (EVAL_PROMPT_TEMPLATE_PATH, INDEX_NAME,
+                         QA_PROMPT_TEMPLATE_PATH, build_context,
+                         build_prompt, calculate_openai_cost)
+from utils.utils import parse_json_response
+
+EMBED_MODEL_NAME = "locusai/multi-qa-minilm-l6-cos-v1"
+
+BACKEND_CONCURRENCY = {
+    "elasticsearch": int(os.getenv("ES_MAX_CONCURRENCY", "16")),
+    "ollama": int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")),
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+}
+
+JUDGE_CONFIG = {
+    "n_workers": int(os.getenv("JUDGE_WORKERS", "2")),
+    "sample_rate": float(os.getenv("JUDGE_SAMPLE_RATE", "1.0")),
+    "peak_sample_rate": float(os.getenv("JUDGE_PEAK_SAMPLE_RATE", "0.1")),
+    "max_queue_size": int(os.getenv("JUDGE_QUEUE_SIZE", "1000")),
+}
+
+ANSWER_CACHE_CONFIG = {
+    "max_items": int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+    "ttl": float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    "similarity_threshold": float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+    if os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")
+    else None,
+}
+
+## Search types whose questions are embedded for semantic cache lookups.
+## Vector and hybrid searches embed the query anyway; text search would
+## otherwise not need Ollama at all.
+SEMANTIC_CACHE_SEARCH_TYPES = os.getenv(
+    "ANSWER_CACHE_SEMANTIC_SEARCH_TYPES", "Vector,Hybrid"
+).split(",")
+
+## Seconds between checks of the index version behind the alias
+INDEX_VERSION_CHECK_INTERVAL = 30
+
+ZERO_TOKENS = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
+_loop = None
+_loop_lock = threading.Lock()
+_clients = None
+_judge_queue = None
+_answer_cache = None
+_index_version_checked_at = 0
+
+
+class AsyncClients:
+    """
+    The async clients of every backend and their concurrency limits.
+
+    Must be created on the event loop it is used from.
+
+    Attributes:
+        es_client (AsyncElasticsearch): The Elasticsearch client.
+        ollama_client (AsyncOpenAI): The OpenAI-compatible Ollama client.
+        openai_client (AsyncOpenAI): The OpenAI client.
+        semaphores (dict): One asyncio.Semaphore per backend.
+    """
+
+    def __init__(self, concurrency=None):
+        """
+        Initializes the clients from the environment variables.
+
+        Args:
+            concurrency (dict, optional): Maximum concurrent requests
+            per backend. Defaults to BACKEND_CONCURRENCY.
+        """
+        concurrency = {**BACKEND_CONCURRENCY, **(concurrency or {})}
+
+        self.es_client = AsyncElasticsearch(
+            f"http://{os.getenv('ELASTIC_HOST')}:{os.getenv('ELASTIC_PORT')}",
+            connections_per_node=concurrency["elasticsearch"],
+        )
+        self.ollama_client = AsyncOpenAI(
+            base_url=f"http://{os.getenv('OLLAMA_HOST')}:{os.getenv('OLLAMA_PORT')}/v1/",
+            api_key="ollama",
+        )
+        self.openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.semaphores = {
+            backend: asyncio.Semaphore(limit) for backend, limit in concurrency.items()
+        }
+
+    async def close(self):
+        """
+        Close the connection pools of all clients.
+        """
+        await self.es_client.close()
+        await self.ollama_client.close()
+        await self.openai_client.close()
+
+
+def get_event_loop():
+    """
+    Return the process-wide background event loop, starting it in a
+    daemon thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="async-query-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def submit_async(coroutine):
+    """
+    Schedule a coroutine on the background event loop.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        concurrent.futures.Future: Its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+
+def run_async(coroutine, timeout=None):
+    """
+    Run a coroutine on the background event loop and wait for it.
+
+    Safe to call from any thread that is not the loop's own, e.g.
+    the Streamlit script thread of every session.
+
+    Args:
+        coroutine: The coroutine to run.
+        timeout (float, optional): Seconds to wait for the result.
+
+    Returns:
+        The result of the coroutine.
+    """
+    return submit_async(coroutine).result(timeout)
+
+
+def get_clients():
+    """
+    Return the shared clients, created on first use.
+
+    Must be called from the background event loop.
+
+    Returns:
+        AsyncClients: The shared clients.
+    """
+    global _clients
+
+    if _clients is None:
+        _clients = AsyncClients()
+    return _clients
+
+
+def get_eval_model():
+    """
+    Return the LLM-as-a-judge model, from $EVAL_MODEL.
+    """
+    return os.getenv('EVAL_MODEL', 'ollama/phi3')
+
+
+def write_evaluations(results):
+    """
+    Write a batch of judge results to the conversations table.
+
+    Args:
+        results (list): (conversation_id, timestamp, relevance,
+        explanation, tokens) tuples; tokens is None when the judge did
+        not run.
+    """
+    eval_model = get_eval_model()
+    evaluations = []
+
+    for conversation_id, timestamp, relevance, explanation, tokens in results:
+        tokens = tokens or ZERO_TOKENS
+        evaluations.append({
+            'id': conversation_id,
+            'timestamp': timestamp,
+            'relevance': relevance,
+            'relevance_explanation': explanation,
+            'eval_prompt_tokens': tokens['prompt_tokens'],
+            'eval_completion_tokens': tokens['completion_tokens'],
+            'eval_total_tokens': tokens['total_tokens'],
+            'eval_cost': calculate_openai_cost(eval_model, tokens),
+        })
+
+    update_conversations_relevance(evaluations)
+
+
+def get_judge_queue():
+    """
+    Return the shared judge queue, created and started on first use.
+
+    Must be called from the background event loop.
+
+    Returns:
+        JudgeQueue: The shared judge queue.
+    """
+    global _judge_queue
+
+    if _judge_queue is None:
+        _judge_queue = JudgeQueue(
+            lambda question, answer: evaluate_relevance(question, answer, get_eval_model()),
+            write_evaluations,
+            **JUDGE_CONFIG,
+        )
+    return _judge_queue
+
+
+def get_answer_cache():
+    """
+    Return the shared answer cache, created on first use.
+
+    Returns:
+        AnswerCache: The shared answer cache.
+    """
+    global _answer_cache
+
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(**ANSWER_CACHE_CONFIG)
+    return _answer_cache
+
+
+async def es_search(body, size):
+    """
+    Run a search on the index, within the Elasticsearch limit.
+    """
+    clients = get_clients()
+
+    async with clients.semaphores["elasticsearch"]:
+        responses = await clients.es_client.search(index=INDEX_NAME, body=body, size=size)
+
+    return [hit["_source"] for hit in responses["hits"]["hits"]]
+
+
+async def get_embedding(text, model_name=EMBED_MODEL_NAME):
+    """
+    Get the embedding of a text from Ollama, through the embedding
+    cache.
+
+    Args:
+        text (str): The text to be embedded.
+        model_name (str, optional): The name of the embedding model.
+
+    Returns:
+        list: The embedding of the text as a list of floats.
+    """
+    text = text.replace("\n", " ")
+    cache = get_embedding_cache()
+
+    # The cache may hit SQLite, keep it off the event loop
+    embedding = await asyncio.to_thread(cache.get, model_name, text)
+    if embedding is None:
+        clients = get_clients()
+        async with clients.semaphores["ollama"]:
+            response = await clients.ollama_client.embeddings.create(
+                input=[text], model=model_name
+            )
+        embedding = response.data[0].embedding
+        await asyncio.to_thread(cache.put, model_name, text, embedding)
+
+    return embedding
+
+
+async def elastic_search_text(query, course, num_results=5):
+    """
+    Async version of `utils.query.elastic_search_text`.
+    """
+    search_query = {
+        "query": {
+            "bool": {
+                "must": {
+                    "multi_match": {
+                        "query": query,
+                        "fields": ["question^3", "text", "section"],
+                        "type": "best_fields",
+                    }
+                },
+                "filter": {"term": {"course": course}},
+            }
+        },
+    }
+
+    return await es_search(search_query, num_results)
+
+
+async def elastic_search_knn(query_vector, course, num_results=5):
+    """
+    Async version of `utils.query.elastic_search_knn`.
+    """
+    search_query = {
+        "knn": {
+            "field": "question_text_vector",
+            "query_vector": query_vector,
+            "k": num_results,
+            "num_candidates": 10_000,
+            "filter": {"term": {"course": course}},
+        },
+        "_source": ["text", "section", "question", "course", "id"],
+    }
+
+    return await es_search(search_query, num_results)
+
+
+async def elastic_search_vector(query, course, num_results=5):
+    """
+    Embed the query and run a kNN search with it.
+    """
+    query_vector = await get_embedding(query)
+    return await elastic_search_knn(query_vector, course, num_results)
+
+
+async def elastic_search_hybrid(query, course, num_results=5, rank_window_size=10):
+    """
+    Run the text and vector searches concurrently and fuse their
+    rankings with reciprocal rank fusion.
+    """
+    text_results, vector_results = await asyncio.gather(
+        elastic_search_text(query, course, rank_window_size),
+        elastic_search_vector(query, course, rank_window_size),
+    )
+    return reciprocal_rank_fusion(
+        [text_results, vector_results], num_results=num_results
+    )
+
+
+def get_llm_client(model_choice):
+    """
+    Return the client and backend name of a model choice.
+    """
+    clients = get_clients()
+
+    if model_choice.startswith('ollama/'):
+        return clients.ollama_client, "ollama"
+    elif model_choice.startswith('openai/'):
+        return clients.openai_client, "openai"
+    else:
+        raise ValueError(f"Unknown model choice: {model_choice}")
+
+
+async def llm(prompt, model_choice="ollama/phi3"):
+    """
+    Async version of `utils.query.llm`.
+
+    Returns:
+        tuple: (answer, tokens, response time in seconds).
+    """
+    start_time = time.time()
+    client, backend = get_llm_client(model_choice)
+
+    async with get_clients().semaphores[backend]:
+        response = await client.chat.completions.create(
+            model=model_choice.split('/')[-1],
+            messages=[{"role": "user", "content": prompt}]
+        )
+    answer = response.choices[0].message.content
+    tokens = {
+        'prompt_tokens': response.usage.prompt_tokens,
+        'completion_tokens': response.usage.completion_tokens,
+        'total_tokens': response.usage.total_tokens
+    }
+
+    response_time = time.time() - start_time
+
+    return answer, tokens, response_time
+
+
+async def llm_stream(prompt, model_choice="ollama/phi3", usage=None):
+    """
+    Streaming version of `llm`: yields the answer in pieces as the
+    model generates them.
+
+    Args:
+        prompt (str): The prompt.
+        model_choice (str, optional): The model, 'ollama/...' or 'openai/...'.
+        usage (dict, optional): Filled in once the stream ends with
+        answer, tokens, response_time and time_to_first_token, all
+        times in seconds from the call.
+
+    Yields:
+        str: The next piece of the answer.
+    """
+    start_time = time.time()
+    usage = {} if usage is None else usage
+    client, backend = get_llm_client(model_choice)
+
+    pieces = []
+    tokens = None
+    time_to_first_token = None
+
+    async with get_clients().semaphores[backend]:
+        stream = await client.chat.completions.create(
+            model=model_choice.split('/')[-1],
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            # With include_usage, the last chunk has the usage and no choices
+            if chunk.usage is not None:
+                tokens = {
+                    'prompt_tokens': chunk.usage.prompt_tokens,
+                    'completion_tokens': chunk.usage.completion_tokens,
+                    'total_tokens': chunk.usage.total_tokens
+                }
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+
+            if time_to_first_token is None:
+                time_to_first_token = time.time() - start_time
+            pieces.append(chunk.choices[0].delta.content)
+            yield pieces[-1]
+
+    if tokens is None:
+        # Servers that ignore include_usage: about one token per chunk
+        prompt_tokens = estimate_tokens(prompt)
+        tokens = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(pieces),
+            'total_tokens': prompt_tokens + len(pieces)
+        }
+
+    response_time = time.time() - start_time
+    usage.update({
+        'answer': "".join(pieces),
+        'tokens': tokens,
+        'response_time': response_time,
+        'time_to_first_token': response_time if time_to_first_token is None else time_to_first_token,
+    })
+
+
+async def evaluate_relevance(question, answer, eval_model):
+    """
+    Async version of `utils.query.evaluate_relevance`.
+    """
+    prompt = build_prompt(
+        EVAL_PROMPT_TEMPLATE_PATH,
+        **{'question': question, 'answer': answer}
+    )
+
+    evaluation, tokens, _ = await llm(prompt, eval_model)
+
+    try:
+        json_eval = parse_json_response(evaluation)
+        return json_eval['Relevance'], json_eval['Explanation'], tokens
+    except json.JSONDecodeError:
+        return "UNKNOWN", "Failed to parse evaluation", tokens
+
+
+async def build_answer_prompt(query, course, search_type):
+    """
+    Retrieve the context of a query and build the QA prompt.
+    """
+    if search_type == 'Vector':
+        search_results = await elastic_search_vector(query, course)
+    elif search_type == 'Text':
+        search_results = await elastic_search_text(query, course)
+    elif search_type == 'Hybrid':
+        search_results = await elastic_search_hybrid(query, course)
+
+    context = build_context(search_results)
+    document_dict = {"question": query, "context": context}
+
+    return build_prompt(
+        QA_PROMPT_TEMPLATE_PATH, **document_dict
+    )
+
+
+async def get_index_version():
+    """
+    Return the version of the index, the names of the indices behind
+    the alias.
+    """
+    clients = get_clients()
+
+    try:
+        async with clients.semaphores["elasticsearch"]:
+            response = await clients.es_client.indices.get_alias(name=INDEX_NAME)
+    except NotFoundError:
+        # A concrete index, not yet rebuilt behind the alias
+        return INDEX_NAME
+
+    return ",".join(sorted(response))
+
+
+async def lookup_answer(query, course, model_choice, search_type):
+    """
+    Look up an answer in the answer cache, first checking that the
+    cache still matches the index. The question is embedded only on an
+    exact miss, for the SEMANTIC_CACHE_SEARCH_TYPES search types.
+
+    Returns:
+        tuple: (cached `get_answer` dictionary or None, cache key,
+        question embedding or None).
+    """
+    global _index_version_checked_at
+
+    cache = get_answer_cache()
+    if time.time() - _index_version_checked_at >= INDEX_VERSION_CHECK_INTERVAL:
+        _index_version_checked_at = time.time()
+        cache.set_index_version(await get_index_version())
+
+    key = cache.make_key(query, course, model_choice, search_type)
+    is_semantic = (
+        cache.similarity_threshold is not None and search_type in SEMANTIC_CACHE_SEARCH_TYPES
+    )
+
+    # Exact repeats are answered without embedding the question
+    answer_data, _ = cache.get(key, count_miss=not is_semantic)
+    if answer_data is not None or not is_semantic:
+        return answer_data, key, None
+
+    # Through the embedding cache, so the search reuses this embedding
+    embedding = await get_embedding(query)
+    answer_data, _ = cache.get(key, embedding)
+    return answer_data, key, embedding
+
+
+def build_cached_answer_data(cached_answer_data, response_time, model_choice):
+    """
+    Return the `get_answer` dictionary of a cache hit: no tokens were
+    spent and the answer is judged again for this question.
+    """
+    answer_data = build_answer_data(
+        cached_answer_data['answer'], ZERO_TOKENS, response_time, response_time, model_choice
+    )
+    answer_data['cache_hit'] = True
+    return answer_data
+
+
+def build_answer_data(answer, tokens, response_time, time_to_first_token, model_choice):
+    """
+    Return the `get_answer` dictionary of an answer whose evaluation
+    is still pending.
+    """
+    return {
+        'answer': answer,
+        'response_time': response_time,
+        'time_to_first_token': time_to_first_token,
+        'relevance': PENDING_RELEVANCE,
+        'relevance_explanation': "Evaluation pending",
+        'model_used': model_choice,
+        'prompt_tokens': tokens['prompt_tokens'],
+        'completion_tokens': tokens['completion_tokens'],
+        'total_tokens': tokens['total_tokens'],
+        'eval_prompt_tokens': 0,
+        'eval_completion_tokens': 0,
+        'eval_total_tokens': 0,
+        'openai_cost': calculate_openai_cost(model_choice, tokens),
+        'cache_hit': False,
+    }
+
+
+async def get_answer(query, course, model_choice, search_type):
+    """
+    Async version of `utils.query.get_answer`, returning the same
+    dictionary without waiting for the LLM-as-a-judge: relevance is
+    'PENDING', the eval tokens are 0 and openai_cost covers the answer
+    only. `save_conversation_async` queues the evaluation.
+
+    While one request waits on a backend, the event loop serves the
+    requests of other sessions.
+    """
+    start_time = time.time()
+    cached_answer_data, key, embedding = await lookup_answer(
+        query, course, model_choice, search_type
+    )
+    if cached_answer_data is not None:
+        return build_cached_answer_data(
+            cached_answer_data, time.time() - start_time, model_choice
+        )
+
+    prompt = await build_answer_prompt(query, course, search_type)
+    answer, tokens, response_time = await llm(
+        prompt=prompt,
+        model_choice=model_choice,
+    )
+
+    # Nothing is shown before the whole answer arrives
+    answer_data = build_answer_data(answer, tokens, response_time, response_time, model_choice)
+    get_answer_cache().put(key, answer_data, embedding)
+
+    return answer_data
+
+
+async def get_answer_stream(query, course, model_choice, search_type, answer_data):
+    """
+    Streaming version of `get_answer`: yields the answer in pieces as
+    the model generates them.
+
+    response_time and time_to_first_token are measured from the call,
+    so they include retrieval.
+
+    Args:
+        answer_data (dict): Filled in with the `get_answer` dictionary
+        once the stream ends.
+
+    Yields:
+        str: The next piece of the answer.
+    """
+    start_time = time.time()
+    cached_answer_data, key, embedding = await lookup_answer(
+        query, course, model_choice, search_type
+    )
+    if cached_answer_data is not None:
+        answer_data.update(build_cached_answer_data(
+            cached_answer_data, time.time() - start_time, model_choice
+        ))
+        yield answer_data['answer']
+        return
+
+    prompt = await build_answer_prompt(query, course, search_type)
+    retrieval_time = time.time() - start_time
+
+    usage = {}
+    async for piece in llm_stream(prompt, model_choice, usage):
+        yield piece
+
+    answer_data.update(build_answer_data(
+        usage['answer'],
+        usage['tokens'],
+        retrieval_time + usage['response_time'],
+        retrieval_time + usage['time_to_first_token'],
+        model_choice,
+    ))
+    get_answer_cache().put(key, answer_data, embedding)
+
+
+def iterate_async(async_iterator):
+    """
+    Iterate an async iterator on the background event loop from a
+    synchronous caller, one item at a time, e.g. for `st.write_stream`.
+
+    Closing the returned generator early closes the async iterator
+    too, which releases its backend semaphore.
+
+    Args:
+        async_iterator: The async generator to iterate.
+
+    Yields:
+        Its items.
+    """
+    try:
+        while True:
+            try:
+                yield run_async(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(async_iterator.aclose())
+
+
+async def save_conversation_async(conversation_id, question, answer_data, course):
+    """
+    Save a conversation through the batch writer, then queue its
+    LLM-as-a-judge evaluation if it is sampled.
+
+    With 'sync' durability, returns once the conversation is
+    committed; with 'async', once it is buffered. Either way the event
+    loop keeps running while the writer's buffer is full.
+    """
+    judge_queue = get_judge_queue()
+    sampled = False
+
+    if answer_data['relevance'] == PENDING_RELEVANCE:
+        sampled = judge_queue.sample()
+        if not sampled:
+            answer_data = {
+                **answer_data,
+                'relevance': NOT_EVALUATED_RELEVANCE,
+                'relevance_explanation': "Not sampled for evaluation",
+            }
+
+    # With the id, it identifies the row the judge result updates
+    timestamp = datetime.now(TZ)
+
+    # Buffering blocks while the writer's buffer is full, off the loop
+    writer = get_batch_writer()
+    future = await asyncio.to_thread(
+        writer.save_conversation,
+        conversation_id,
+        question,
+        answer_data,
+        course,
+        timestamp=timestamp,
+        wait=False,
+    )
+
+    if sampled:
+        loop = asyncio.get_running_loop()
+
+        def submit_when_committed(future):
+            # The judge result updates the row, which must exist
+            if future.exception() is None:
+                loop.call_soon_threadsafe(
+                    judge_queue.submit,
+                    conversation_id,
+                    timestamp,
+                    question,
+                    answer_data['answer'],
+                )
+
+        future.add_done_callback(submit_when_committed)
+
+    if writer.durability == "sync":
+        await asyncio.wrap_future(future)
@@ -0,0 +1,336 @@
+"""
+This module provides a write-behind buffer for the conversations and
+feedback inserts.
+
+Rows are collected in memory and written in batches, by a background
+thread, with COPY (or executemany, which psycopg pipelines) in one
+transaction per flush. Conversations are written before feedback, so
+that a reader who sees a feedback row also sees its conversation.
+When a batch fails on its data (e.g. a constraint or encoding error),
+it is retried in halves down to single rows, so only the bad rows
+fail; they are counted in `stats["dropped_rows"]`. A flush happens when:
+    1. `max_rows` rows are buffered
+    2. The oldest buffered row is `max_delay` seconds old
+    3. `flush` or `close` is called; `close` runs at exit
+
+Two durability modes decide when a save returns:
+    1. 'sync' (flush-before-ack): once its batch is committed. Saves
+       from concurrent threads share one commit.
+    2. 'async' (fire-and-forget): at once. Rows buffered when the
+       process dies are lost, and failed flushes are only logged.
+"""
+
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from psycopg import DataError, IntegrityError
+
+from utils.postgres import (CONVERSATION_COLUMNS, FEEDBACK_COLUMNS, TZ,
+                            conversation_row, get_pool, pooled_connection)
+
+DURABILITY_MODES = ["sync", "async"]
+
+TABLE_COLUMNS = {
+    "conversations": CONVERSATION_COLUMNS,
+    "feedback": FEEDBACK_COLUMNS,
+}
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class BatchWriter:
+    """
+    Buffers conversation and feedback rows and writes them in batches.
+
+    Attributes:
+        max_rows (int): Buffered rows that trigger a flush.
+        max_delay (float): Seconds a row may wait before a flush.
+        durability (str): 'sync' or 'async', the default of `wait`.
+        method (str): 'copy' or 'executemany'.
+        max_buffered_rows (int): Rows above which saves block until
+            the next flush.
+        stats (dict): Rows written, flushes, failed flushes, rows
+            dropped for bad data and the total flush time in seconds.
+    """
+
+    def __init__(
+        self,
+        max_rows=500,
+        max_delay=0.2,
+        durability="sync",
+        method="copy",
+        max_buffered_rows=50_000,
+        is_setup=False,
+    ):
+        """
+        Initializes the BatchWriter and starts its flush thread.
+
+        Args:
+            max_rows (int): Buffered rows that trigger a flush. Defaults to 500.
+            max_delay (float): Seconds a row may wait. Defaults to 0.2.
+            durability (str): 'sync' or 'async'. Defaults to 'sync'.
+            method (str): 'copy' or 'executemany'. Defaults to 'copy'.
+            max_buffered_rows (int): Rows above which saves block.
+                Defaults to 50000.
+            is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"`durability` must be in {DURABILITY_MODES}, got {durability}")
+        if method not in ["copy", "executemany"]:
+            raise ValueError(f"`method` must be 'copy' or 'executemany', got {method}")
+
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.durability = durability
+        self.method = method
+        self.max_buffered_rows = max_buffered_rows
+        self.is_setup = is_setup
+
+        self.stats = {
+            "rows": 0, "flushes": 0, "failed_flushes": 0, "dropped_rows": 0, "flush_seconds": 0.0
+        }
+
+        # table -> list of (row, future)
+        self._buffers = {table: [] for table in TABLE_COLUMNS}
+        self._oldest = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def save_conversation(self, conversation_id, question, answer_data, course, timestamp=None, wait=None):
+        """
+        Buffer a conversation row.
+
+        Args:
+            wait (bool, optional): Whether to return only once the row is
+            committed. Defaults to `durability == 'sync'`.
+
+        Returns:
+            concurrent.futures.Future: Resolved when the row is committed.
+        """
+        return self._add(
+            "conversations",
+            conversation_row(conversation_id, question, answer_data, course, timestamp),
+            wait,
+        )
+
+    def save_feedback(self, conversation_id, feedback, timestamp=None, wait=None):
+        """
+        Buffer a feedback row. See `save_conversation`.
+        """
+        if timestamp is None:
+            timestamp = datetime.now(TZ)
+
+        return self._add("feedback", (conversation_id, feedback, timestamp), wait)
+
+    def flush(self):
+        """
+        Write the buffered rows now, and wait for them.
+
+        Raises:
+            Exception: The error of the flush, if it failed.
+        """
+        with self._condition:
+            futures = [future for items in self._buffers.values() for _, future in items]
+            self._condition.notify_all()
+        self._flush()
+
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """
+        Flush the buffered rows and stop the flush thread.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._flush()
+
+    def _add(self, table, row, wait):
+        """
+        Buffer a row, blocking while the buffer is full.
+        """
+        future = Future()
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The batch writer is closed")
+            while self._n_buffered() >= self.max_buffered_rows:
+                self._condition.wait()
+
+            self._buffers[table].append((row, future))
+            # The flush thread waits for a first row, then for a full batch
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._condition.notify_all()
+            elif self._n_buffered() >= self.max_rows:
+                self._condition.notify_all()
+
+        if wait is None:
+            wait = self.durability == "sync"
+        if wait:
+            future.result()
+        return future
+
+    def _n_buffered(self):
+        return sum(len(items) for items in self._buffers.values())
+
+    def _run(self):
+        """
+        Flush on the size and time thresholds until closed.
+        """
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._n_buffered() >= self.max_rows:
+                        break
+                    if self._oldest is not None:
+                        timeout = self._oldest + self.max_delay - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._condition.wait(timeout)
+                closed = self._closed
+
+            self._flush()
+            if closed:
+                return
+
+    def _flush(self):
+        """
+        Take the buffered rows and write them in one transaction.
+        """
+        with self._flush_lock:
+            with self._condition:
+                buffers = self._buffers
+                self._buffers = {table: [] for table in TABLE_COLUMNS}
+                self._oldest = None
+                # Wake up the saves blocked on a full buffer
+                self._condition.notify_all()
+
+            n_rows = sum(len(items) for items in buffers.values())
+            if not n_rows:
+                return
+
+            start_time = time.perf_counter()
+            try:
+                with pooled_connection(self.is_setup) as conn:
+                    try:
+                        self._write_tables(conn, buffers)
+                    except (DataError, IntegrityError) as e:
+                        print(
+                            f"Failed to write a batch of {n_rows} rows, retrying in parts: {e}",
+                            flush=True,
+                        )
+                        for table, items in buffers.items():
+                            self._write_isolating_errors(conn, table, items)
+                        self.stats["flushes"] += 1
+                        self.stats["flush_seconds"] += time.perf_counter() - start_time
+                        return
+            except Exception as e:  # pylint: disable=broad-except
+                self.stats["failed_flushes"] += 1
+                print(f"Failed to write a batch of {n_rows} rows: {e}", flush=True)
+                for items in buffers.values():
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                return
+
+            self.stats["rows"] += n_rows
+            self.stats["flushes"] += 1
+            self.stats["flush_seconds"] += time.perf_counter() - start_time
+            for items in buffers.values():
+                for _, future in items:
+                    future.set_result(None)
+
+    def _write_tables(self, conn, buffers):
+        """
+        Write the rows of every table in one transaction.
+        """
+        with conn.transaction():
+            with conn.cursor() as cur:
+                # Conversations first, see the module docstring
+                for table, columns in TABLE_COLUMNS.items():
+                    if buffers[table]:
+                        self._write(cur, table, columns, [row for row, _ in buffers[table]])
+
+    def _write_isolating_errors(self, conn, table, items):
+        """
+        Write (row, future) items of one table in halves, one transaction
+        each, until the rows with bad data are isolated and dropped.
+        """
+        if not items:
+            return
+
+        try:
+            self._write_tables(conn, {**{name: [] for name in TABLE_COLUMNS}, table: items})
+        except (DataError, IntegrityError) as e:
+            if len(items) == 1:
+                self.stats["dropped_rows"] += 1
+                print(f"Dropped a {table} row with bad data: {e}", flush=True)
+                items[0][1].set_exception(e)
+                return
+            middle = len(items) // 2
+            self._write_isolating_errors(conn, table, items[:middle])
+            self._write_isolating_errors(conn, table, items[middle:])
+            return
+
+        self.stats["rows"] += len(items)
+        for _, future in items:
+            future.set_result(None)
+
+    def _write(self, cur, table, columns, rows):
+        """
+        Write the rows of one table with COPY or executemany.
+        """
+        column_list = ", ".join(columns)
+
+        if self.method == "copy":
+            with cur.copy(f"COPY {table} ({column_list}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            placeholders = ", ".join(["%s"] * len(columns))
+            cur.executemany(
+                f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", rows
+            )
+
+
+def get_batch_writer(is_setup=False, **kwargs):
+    """
+    Return the process-wide batch writer, created on first use and
+    closed, i.e. flushed, at exit. Later calls ignore `kwargs`.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+        **kwargs: Arguments of BatchWriter. durability, max_rows and
+        max_delay default to $POSTGRES_WRITE_DURABILITY,
+        $POSTGRES_WRITE_BATCH_ROWS and $POSTGRES_WRITE_BATCH_DELAY.
+
+    Returns:
+        BatchWriter: The batch writer.
+    """
+    with _writers_lock:
+        if is_setup not in _writers:
+            kwargs.setdefault("durability", os.getenv("POSTGRES_WRITE_DURABILITY", "sync"))
+            kwargs.setdefault("max_rows", int(os.getenv("POSTGRES_WRITE_BATCH_ROWS", "500")))
+            kwargs.setdefault("max_delay", float(os.getenv("POSTGRES_WRITE_BATCH_DELAY", "0.2")))
+            # Opened first so that it is closed after the writer's last flush
+            get_pool(is_setup)
+            writer = BatchWriter(is_setup=is_setup, **kwargs)
+            atexit.register(writer.close)
+            _writers[is_setup] = writer
+        return _writers[is_setup]
@@ -1,15 +1,20 @@
 """
 This module provides utility functions for interacting with Elasticsearch.
 It includes functions to create an Elasticsearch client, manage indices, 
-search, and index documents.
+search, and index documents, including a streaming bulk indexer, and
+to serve an alias from versioned indices rebuilt without downtime.
 Custom exceptions are also handled for connection and query errors.
 """
 
 import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from elasticsearch import Elasticsearch
+from elasticsearch import ApiError, Elasticsearch
 from elasticsearch.exceptions import (NotFoundError,
                                       RequestError)
+from tqdm.auto import tqdm
 
 from exceptions.exceptions import ElasticsearchConnectionError
 
@@ -138,6 +143,345 @@ def index_document(es_client, index_name, document, timeout=60):
         print(f"{e}", "id:", document['id'], "-> Skipped...")
 
 
+def bulk_actions(documents, index_name, id_field=None):
+    """
+    Serialize documents into bulk `index` actions.
+
+    Every action is serialized once, so its size is known when
+    chunking and the bytes are sent as they are.
+
+    Args:
+        documents (iterable): The documents to index.
+        index_name (str): The name of the index.
+        id_field (str, optional): Document field used as the `_id`.
+        Elasticsearch generates ids if not given.
+
+    Yields:
+        tuple: (position, document id, action line, source line).
+    """
+    for position, document in enumerate(documents):
+        action = {"_index": index_name}
+        if id_field:
+            action["_id"] = document[id_field]
+
+        yield (
+            position,
+            action.get("_id"),
+            json.dumps({"index": action}).encode("utf-8"),
+            json.dumps(document).encode("utf-8"),
+        )
+
+
+def bulk_delete_actions(document_ids, index_name):
+    """
+    Serialize document ids into bulk `delete` actions.
+
+    Args:
+        document_ids (iterable): The `_id`s of the documents to delete.
+        index_name (str): The name of the index.
+
+    Yields:
+        tuple: (position, document id, action line, None).
+    """
+    for position, document_id in enumerate(document_ids):
+        yield (
+            position,
+            document_id,
+            json.dumps({"delete": {"_index": index_name, "_id": document_id}}).encode("utf-8"),
+            None,
+        )
+
+
+def chunk_bulk_actions(actions, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024):
+    """
+    Group serialized actions into chunks bounded by count and size.
+
+    Args:
+        actions (iterable): Actions as yielded by `bulk_actions`.
+        chunk_size (int): Maximum number of documents per chunk.
+        max_chunk_bytes (int): Maximum request body size in bytes. A
+        single larger document is still sent, alone.
+
+    Yields:
+        list: Chunks of actions.
+    """
+    chunk = []
+    chunk_bytes = 0
+
+    for action in actions:
+        # action line + optional source line, each followed by a newline
+        action_bytes = sum(len(line) + 1 for line in action[2:] if line is not None)
+
+        if chunk and (
+            len(chunk) >= chunk_size or chunk_bytes + action_bytes > max_chunk_bytes
+        ):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append(action)
+        chunk_bytes += action_bytes
+
+    if chunk:
+        yield chunk
+
+
+def send_bulk_chunk(
+    es_client,
+    chunk,
+    max_retries=3,
+    initial_backoff=1,
+    max_backoff=60,
+    timeout=60,
+):
+    """
+    Send one chunk with the bulk API, retrying rejected items.
+
+    Items rejected with HTTP 429 (a full write queue), or the whole
+    request if it is rejected, are resent with exponential backoff.
+    Items that fail for any other reason are not retried. Deleting a
+    missing document counts as done.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        chunk (list): Actions as yielded by `chunk_bulk_actions`.
+        max_retries (int): Maximum number of retries. Default is 3.
+        initial_backoff (float): Seconds to wait before the first
+        retry, doubled for every further one. Default is 1.
+        max_backoff (float): Maximum seconds to wait. Default is 60.
+        timeout (int): The timeout for the bulk request in seconds.
+        Default is 60.
+
+    Returns:
+        tuple: (number of successful items, list of item errors,
+        number of retried items).
+    """
+    n_indexed = 0
+    n_retried = 0
+    errors = []
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(max_backoff, initial_backoff * 2 ** (attempt - 1)))
+            n_retried += len(chunk)
+
+        try:
+            response = es_client.bulk(
+                operations=[
+                    line for action in chunk for line in action[2:] if line is not None
+                ],
+                refresh=False,
+                timeout=f"{timeout}s",
+            )
+        except ApiError as e:
+            if e.meta.status != 429 or attempt == max_retries:
+                raise
+            continue
+
+        rejected = []
+        for action, item in zip(chunk, response["items"]):
+            # One key per item: the operation, e.g. "index" or "delete"
+            result = next(iter(item.values()))
+
+            if result["status"] < 300 or result.get("result") == "not_found":
+                n_indexed += 1
+            elif result["status"] == 429 and attempt < max_retries:
+                rejected.append(action)
+            else:
+                errors.append(
+                    {
+                        "position": action[0],
+                        "id": action[1] if action[1] is not None else result.get("_id"),
+                        "status": result["status"],
+                        "type": result.get("error", {}).get("type"),
+                        "reason": result.get("error", {}).get("reason"),
+                    }
+                )
+
+        chunk = rejected
+        if not chunk:
+            break
+
+    return n_indexed, errors, n_retried
+
+
+def bulk_index_documents(
+    es_client,
+    index_name,
+    documents,
+    id_field=None,
+    **bulk_params,
+):
+    """
+    Index documents with the bulk API, streaming them in chunks.
+
+    Documents with an existing `_id` are overwritten, so indexing
+    with `id_field` is an upsert. See `run_bulk` for the chunking,
+    concurrency, retry and refresh behaviour.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        documents (iterable): The documents to index.
+        id_field (str, optional): Document field used as the `_id`.
+        Elasticsearch generates ids if not given.
+        **bulk_params: Further arguments of `run_bulk`.
+
+    Returns:
+        dict: The summary returned by `run_bulk`.
+    """
+    return run_bulk(
+        es_client,
+        index_name,
+        bulk_actions(documents, index_name, id_field),
+        total=len(documents) if hasattr(documents, "__len__") else None,
+        **bulk_params,
+    )
+
+
+def bulk_delete_documents(es_client, index_name, document_ids, **bulk_params):
+    """
+    Delete documents by `_id` with the bulk API.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        document_ids (list): The `_id`s of the documents to delete.
+        **bulk_params: Further arguments of `run_bulk`.
+
+    Returns:
+        dict: The summary returned by `run_bulk`.
+    """
+    return run_bulk(
+        es_client,
+        index_name,
+        bulk_delete_actions(document_ids, index_name),
+        total=len(document_ids),
+        **bulk_params,
+    )
+
+
+def run_bulk(
+    es_client,
+    index_name,
+    actions,
+    total=None,
+    chunk_size=500,
+    max_chunk_bytes=10 * 1024 * 1024,
+    max_in_flight=4,
+    max_retries=3,
+    initial_backoff=1,
+    max_backoff=60,
+    disable_refresh=True,
+    timeout=60,
+):
+    """
+    Send serialized bulk actions, streaming them in chunks.
+
+    Actions are consumed lazily and grouped into chunks bounded
+    by `chunk_size` documents and `max_chunk_bytes` bytes. Up to
+    `max_in_flight` bulk requests run concurrently. Rejected items
+    are retried with exponential backoff (see `send_bulk_chunk`).
+    Refresh is disabled on the index during the load, then the
+    previous refresh interval is restored and the index refreshed.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        actions (iterable): Actions as yielded by `bulk_actions` or
+        `bulk_delete_actions`.
+        total (int, optional): Number of actions, for the progress bar.
+        chunk_size (int): Maximum number of documents per request.
+        Default is 500.
+        max_chunk_bytes (int): Maximum request body size in bytes.
+        Default is 10 MiB.
+        max_in_flight (int): Maximum number of concurrent requests.
+        Default is 4.
+        max_retries (int): Maximum number of retries of rejected
+        items. Default is 3.
+        initial_backoff (float): Seconds to wait before the first
+        retry. Default is 1.
+        max_backoff (float): Maximum seconds to wait. Default is 60.
+        disable_refresh (bool): Disable refresh during the load.
+        Default is True.
+        timeout (int): The timeout for bulk requests in seconds.
+        Default is 60.
+
+    Returns:
+        dict: Summary with keys 'indexed', 'failed', 'retried',
+        'seconds' and 'errors', a list of dicts with keys 'position',
+        'id', 'status', 'type' and 'reason', one per failed action.
+    """
+    summary = {"indexed": 0, "failed": 0, "retried": 0, "seconds": 0.0, "errors": []}
+    start_time = time.perf_counter()
+
+    refresh_intervals = {}
+    if disable_refresh:
+        # Keyed by concrete index, also when index_name is an alias
+        settings = es_client.indices.get_settings(
+            index=index_name, name="index.refresh_interval"
+        )
+        refresh_intervals = {
+            name: index_settings.get("settings", {}).get("index", {}).get("refresh_interval")
+            for name, index_settings in settings.items()
+        }
+        es_client.indices.put_settings(
+            index=index_name, settings={"index": {"refresh_interval": "-1"}}
+        )
+
+    def collect(future):
+        n_indexed, errors, n_retried = future.result()
+        summary["indexed"] += n_indexed
+        summary["failed"] += len(errors)
+        summary["retried"] += n_retried
+        summary["errors"].extend(errors)
+        progress.update(n_indexed + len(errors))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool, tqdm(
+            total=total
+        ) as progress:
+            in_flight = set()
+
+            for chunk in chunk_bulk_actions(
+                actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+            ):
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+
+                in_flight.add(
+                    pool.submit(
+                        send_bulk_chunk,
+                        es_client,
+                        chunk,
+                        max_retries=max_retries,
+                        initial_backoff=initial_backoff,
+                        max_backoff=max_backoff,
+                        timeout=timeout,
+                    )
+                )
+
+            for future in wait(in_flight).done:
+                collect(future)
+
+    finally:
+        if disable_refresh:
+            # None resets the setting to the index default
+            for name, refresh_interval in refresh_intervals.items():
+                es_client.indices.put_settings(
+                    index=name, settings={"index": {"refresh_interval": refresh_interval}}
+                )
+            es_client.indices.refresh(index=index_name)
+
+    summary["seconds"] = time.perf_counter() - start_time
+
+    return summary
+
+
 def get_index_mapping(es_client, index_name):
     """
     Retrieve and return the mapping for an Elasticsearch index.
@@ -153,8 +497,9 @@ def get_index_mapping(es_client, index_name):
         # Retrieve the mapping for the given index
         mapping = es_client.indices.get_mapping(index=index_name)
 
-        # Extract the properties section which contains the field mappings
-        properties = mapping[index_name]["mappings"]["properties"]
+        # Extract the properties section which contains the field mappings.
+        # For an alias the response is keyed by the index behind it.
+        properties = next(iter(mapping.values()))["mappings"]["properties"]
 
         # Extract field names and their types
         field_types = {field: properties[field]["type"] for field in properties}
@@ -164,3 +509,232 @@ def get_index_mapping(es_client, index_name):
     except RequestError as e:
         print(f"An error occurred: {e}")
         return None
+
+
+def scan_field_values(es_client, index_name, field, page_size=1000, keep_alive="1m"):
+    """
+    Read one field of every document of an index.
+
+    Pages through the index with a point in time and `search_after`,
+    so the result is consistent even while the index is written to,
+    and only the requested field is fetched.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        field (str): The field to read, e.g. 'content_hash'.
+        page_size (int): Documents per page. Default is 1000.
+        keep_alive (str): Point in time keep alive between pages.
+        Default is '1m'.
+
+    Returns:
+        dict: Maps every document `_id` to its value of `field`,
+        None if the document has no such field.
+    """
+    values = {}
+    pit_id = es_client.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+
+    try:
+        search_after = None
+
+        while True:
+            response = es_client.search(
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                size=page_size,
+                sort=[{"_shard_doc": "asc"}],
+                source=[field],
+                search_after=search_after,
+                track_total_hits=False,
+            )
+            pit_id = response.get("pit_id", pit_id)
+            hits = response["hits"]["hits"]
+
+            for hit in hits:
+                values[hit["_id"]] = hit.get("_source", {}).get(field)
+
+            if len(hits) < page_size:
+                break
+            search_after = hits[-1]["sort"]
+
+    finally:
+        es_client.close_point_in_time(id=pit_id)
+
+    return values
+
+
+def versioned_index_name(alias, version):
+    """
+    Return the name of a version of the index behind an alias.
+
+    Args:
+        alias (str): The alias, e.g. 'course-questions'.
+        version (int): The version number.
+
+    Returns:
+        str: The index name, e.g. 'course-questions-v3'.
+    """
+    return f"{alias}-v{version}"
+
+
+def list_index_versions(es_client, alias):
+    """
+    List the versioned indices of an alias, oldest first.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        alias (str): The alias.
+
+    Returns:
+        list: (version, index name) tuples sorted by version.
+    """
+    pattern = re.compile(rf"^{re.escape(alias)}-v(\d+)$")
+    indices = es_client.indices.get(index=f"{alias}-v*", allow_no_indices=True)
+
+    return sorted(
+        (int(match.group(1)), index)
+        for index in indices
+        if (match := pattern.match(index))
+    )
+
+
+def get_alias_indices(es_client, alias):
+    """
+    Return the indices an alias points to.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        alias (str): The alias.
+
+    Returns:
+        list: Index names, empty if the alias does not exist.
+    """
+    try:
+        return list(es_client.indices.get_alias(name=alias))
+    except NotFoundError:
+        return []
+
+
+def create_next_index_version(es_client, alias, index_settings, timeout=60):
+    """
+    Create the next version of the index behind an alias.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        alias (str): The alias.
+        index_settings (dict): The settings for the index.
+        timeout (int): The timeout for the index creation request in seconds. Default is 60.
+
+    Returns:
+        str: The name of the new index.
+    """
+    versions = list_index_versions(es_client, alias)
+    index_name = versioned_index_name(alias, versions[-1][0] + 1 if versions else 1)
+    create_elasticsearch_index(es_client, index_name, index_settings, timeout=timeout)
+
+    return index_name
+
+
+def warm_index(es_client, index_name, queries=None, timeout=60):
+    """
+    Make a freshly loaded index ready to serve before it goes live.
+
+    Refreshes the index, waits until its shards are allocated and
+    runs a few searches so that caches and the vector graph are
+    loaded before the first user query.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        queries (list, optional): Search bodies to run. Defaults to a
+        match_all query.
+        timeout (int): Seconds to wait for the shards. Default is 60.
+    """
+    es_client.indices.refresh(index=index_name)
+    es_client.cluster.health(
+        index=index_name, wait_for_status="yellow", timeout=f"{timeout}s"
+    )
+
+    for query in queries or [{"query": {"match_all": {}}, "size": 10}]:
+        es_client.search(index=index_name, body=query)
+
+
+def swap_alias(es_client, alias, index_name):
+    """
+    Point an alias to an index, atomically.
+
+    All other indices are removed from the alias in the same request,
+    so searches through the alias never see an empty or mixed state.
+    A concrete index with the alias's name (created before aliases
+    were used) is deleted in that request too.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        alias (str): The alias.
+        index_name (str): The index the alias should point to.
+    """
+    current_indices = get_alias_indices(es_client, alias)
+
+    actions = [
+        {"remove": {"index": index, "alias": alias}}
+        for index in current_indices
+        if index != index_name
+    ]
+    if not current_indices and es_client.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index_name, "alias": alias}})
+
+    es_client.indices.update_aliases(actions=actions)
+    print(f"Alias {alias} now points to {index_name}.")
+
+
+def get_index_age(es_client, index_name):
+    """
+    Return the seconds since an index was created.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The index.
+
+    Returns:
+        float: The age of the index in seconds.
+    """
+    settings = es_client.indices.get_settings(index=index_name, name="index.creation_date")
+    creation_date = int(settings[index_name]["settings"]["index"]["creation_date"])
+    return time.time() - creation_date / 1000
+
+
+def remove_old_index_versions(es_client, alias, keep=1, abandoned_after=24 * 3600):
+    """
+    Delete versioned indices that are not behind the alias.
+
+    The `keep` most recent versions older than the live one are
+    kept for rollback. Versions newer than the live one are either
+    being loaded by a rebuild running elsewhere or left over from a
+    failed one; they are deleted only once `abandoned_after` seconds
+    old.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        alias (str): The alias.
+        keep (int): Number of previous versions to keep. Default is 1.
+        abandoned_after (float): Age in seconds after which a version
+        newer than the live one is deleted. Default is one day.
+    """
+    live_indices = set(get_alias_indices(es_client, alias))
+    versions = list_index_versions(es_client, alias)
+    live_versions = [version for version, index in versions if index in live_indices]
+    if not live_versions:
+        return
+
+    previous = [
+        index for version, index in versions if version < min(live_versions)
+    ]
+    abandoned = [
+        index
+        for version, index in versions
+        if version > max(live_versions) and get_index_age(es_client, index) > abandoned_after
+    ]
+    stale = previous[: max(len(previous) - keep, 0)] + abandoned
+
+    for index in stale:
+        remove_elasticsearch_index(es_client, index)
@@ -0,0 +1,314 @@
+"""
+This module provides a persistent cache of text embeddings.
+
+Embeddings are keyed by (model name, hash of the normalized text), so
+the same text embedded by the same model is computed only once, across
+processes and restarts. The cache has two tiers:
+    1. An in-memory LRU of the most recently used embeddings
+    2. A SQLite table of float32 blobs on disk
+
+The default cache used by the embedding utilities lives at
+$EMBEDDING_CACHE_PATH (~/.cache/embeddings.sqlite3 if unset); an
+empty value keeps it in memory only.
+
+This module is duplicated in utils/ and app/utils/, as the app image
+only ships app/. Keep both copies identical;
+unit_tests/test_shared_modules.py checks it.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "embeddings.sqlite3")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """
+    Normalize a text before hashing: whitespace runs, including
+    newlines, become one space and the ends are stripped.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The normalized text.
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text):
+    """
+    Return the SHA-256 hex digest of the normalized text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The hex digest.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    A two-tier cache of embeddings keyed by (model name, text hash).
+
+    Both tiers hold float32 vectors; lookups return lists of floats
+    like the embedding APIs do. All methods are thread-safe.
+
+    Attributes:
+        path (str): Path of the SQLite file, or None for memory only.
+        max_memory_items (int): Capacity of the in-memory LRU tier.
+        memory_hits (int): Lookups answered from memory.
+        disk_hits (int): Lookups answered from disk.
+        misses (int): Lookups not in the cache.
+    """
+
+    def __init__(self, path=None, max_memory_items=10_000):
+        """
+        Initializes the EmbeddingCache.
+
+        Args:
+            path (str): Path of the SQLite file, created if missing.
+                Memory only if None.
+            max_memory_items (int): Capacity of the in-memory LRU tier.
+                Defaults to 10000.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """
+            )
+            self._connection.commit()
+
+    def get_many(self, model_name, texts):
+        """
+        Look up the embeddings of many texts.
+
+        Args:
+            model_name (str): The name of the embedding model.
+            texts (list): The texts.
+
+        Returns:
+            list: The embeddings as lists of floats, None for misses.
+        """
+        keys = [(model_name, text_hash(text)) for text in texts]
+        embeddings = [None] * len(keys)
+
+        with self._lock:
+            disk_positions = {}
+            for position, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    embeddings[position] = self._memory[key].tolist()
+                    self.memory_hits += 1
+                else:
+                    disk_positions.setdefault(key[1], []).append(position)
+
+            if disk_positions and self._connection is not None:
+                found = self._select(model_name, list(disk_positions))
+                for hash_value, vector in found.items():
+                    vector = np.frombuffer(vector, dtype=np.float32)
+                    self._remember((model_name, hash_value), vector)
+                    for position in disk_positions.pop(hash_value):
+                        embeddings[position] = vector.tolist()
+                        self.disk_hits += 1
+
+            self.misses += sum(len(positions) for positions in disk_positions.values())
+
+        return embeddings
+
+    def put_many(self, model_name, texts, embeddings):
+        """
+        Store the embeddings of many texts in both tiers.
+
+        Args:
+            model_name (str): The name of the embedding model.
+            texts (list): The texts.
+            embeddings (list): Their embeddings, in the same order.
+        """
+        rows = []
+
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = (model_name, text_hash(text))
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((model_name, key[1], vector.tobytes()))
+
+            if rows and self._connection is not None:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) "
+                    "VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._connection.commit()
+
+    def get(self, model_name, text):
+        """
+        Look up the embedding of one text, None if missing.
+        """
+        return self.get_many(model_name, [text])[0]
+
+    def put(self, model_name, text, embedding):
+        """
+        Store the embedding of one text.
+        """
+        self.put_many(model_name, [text], [embedding])
+
+    def stats(self):
+        """
+        Return the hit/miss counters.
+
+        Returns:
+            dict: memory_hits, disk_hits, misses, hit_rate and the
+            number of items held in memory.
+        """
+        with self._lock:
+            n_lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / n_lookups
+                if n_lookups
+                else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+    def clear(self):
+        """
+        Remove all embeddings from both tiers and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM embeddings")
+                self._connection.commit()
+
+    def close(self):
+        """
+        Close the SQLite connection.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _remember(self, key, vector):
+        """
+        Insert into the LRU tier, evicting the least recently used item.
+        """
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _select(self, model_name, hash_values, batch_size=500):
+        """
+        Read vectors from disk, in batches below SQLite's variable limit.
+        """
+        found = {}
+        for start in range(0, len(hash_values), batch_size):
+            batch = hash_values[start : start + batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            found.update(
+                self._connection.execute(
+                    "SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_name, *batch],
+                ).fetchall()
+            )
+        return found
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide default cache, created on first use.
+
+    Returns:
+        EmbeddingCache: The default cache.
+    """
+    global _default_cache
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path=os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH) or None
+            )
+        return _default_cache
+
+
+def set_embedding_cache(cache):
+    """
+    Replace the process-wide default cache.
+
+    Args:
+        cache (EmbeddingCache): The new default cache.
+    """
+    global _default_cache
+
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def cached_embeddings(cache, model_name, texts, embed_fn):
+    """
+    Return embeddings of texts, computing only the cache misses.
+
+    Args:
+        cache (EmbeddingCache): The cache, or None to always compute.
+        model_name (str): The name of the embedding model.
+        texts (list): The texts.
+        embed_fn (callable): Takes a list of texts and returns their
+        embeddings in order.
+
+    Returns:
+        list: The embeddings, in the order of `texts`.
+    """
+    if cache is None:
+        return embed_fn(texts)
+
+    embeddings = cache.get_many(model_name, texts)
+    missing = [position for position, embedding in enumerate(embeddings) if embedding is None]
+
+    if missing:
+        # Embed every distinct missing text once
+        missing_texts = list(dict.fromkeys(texts[position] for position in missing))
+        computed = dict(zip(missing_texts, embed_fn(missing_texts)))
+        cache.put_many(model_name, missing_texts, [computed[text] for text in missing_texts])
+
+        for position in missing:
+            embeddings[position] = computed[texts[position]]
+
+    return embeddings
@@ -0,0 +1,208 @@
+"""
+This module provides a background queue for LLM-as-a-judge
+evaluations, so that users get their answer without waiting for
+the judge.
+
+Conversations picked by `sample` are saved with relevance 'PENDING'
+and then submitted to the queue. Worker tasks take jobs in batches, judge each batch
+concurrently and write the results of a batch to the database in
+one transaction. Judge traffic is kept from starving user traffic:
+    1. Only `n_workers` judge calls run at once
+    2. The queue is bounded; when it is full the oldest job is dropped
+    3. Only `sample_rate` of the conversations are judged, and only
+       `peak_sample_rate` once the queue is above `high_watermark`
+Conversations that are not judged get relevance 'NOT_EVALUATED'.
+"""
+
+import asyncio
+import random
+
+PENDING_RELEVANCE = "PENDING"
+NOT_EVALUATED_RELEVANCE = "NOT_EVALUATED"
+
+
+class JudgeQueue:
+    """
+    A bounded asyncio queue of judge jobs processed by a worker pool.
+
+    Must be created and used on one event loop.
+
+    Attributes:
+        stats (dict): Counters of sampled conversations (submitted,
+            sampled_out), of jobs (dropped, evaluated, failed) and of
+            written batches.
+    """
+
+    def __init__(
+        self,
+        evaluate_fn,
+        write_fn,
+        n_workers=2,
+        batch_size=8,
+        batch_timeout=0.5,
+        max_queue_size=1000,
+        sample_rate=1.0,
+        peak_sample_rate=0.1,
+        high_watermark=0.5,
+    ):
+        """
+        Initializes the JudgeQueue and starts its workers.
+
+        Args:
+            evaluate_fn (callable): Coroutine function taking
+                (question, answer) and returning (relevance,
+                explanation, tokens).
+            write_fn (callable): Blocking function taking a list of
+                (conversation_id, timestamp, relevance, explanation,
+                tokens) tuples and writing them; run in a worker thread.
+            n_workers (int): Number of concurrent judge calls. Defaults to 2.
+            batch_size (int): Maximum jobs per batch. Defaults to 8.
+            batch_timeout (float): Seconds a worker waits to fill a
+                batch once it has a first job. Defaults to 0.5.
+            max_queue_size (int): Queue capacity. Defaults to 1000.
+            sample_rate (float): Fraction of conversations judged.
+                Defaults to 1.0.
+            peak_sample_rate (float): Fraction judged while the queue is
+                above the high watermark. Defaults to 0.1.
+            high_watermark (float): Queue fill ratio above which
+                `peak_sample_rate` applies. Defaults to 0.5.
+        """
+        self.evaluate_fn = evaluate_fn
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.sample_rate = sample_rate
+        self.peak_sample_rate = peak_sample_rate
+        self.high_watermark = high_watermark
+
+        self.stats = {
+            "submitted": 0,
+            "sampled_out": 0,
+            "dropped": 0,
+            "evaluated": 0,
+            "failed": 0,
+            "batches": 0,
+        }
+
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+        self._semaphore = asyncio.Semaphore(n_workers)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(n_workers)]
+
+    def sample(self):
+        """
+        Decide whether the next conversation is judged, sampling less
+        while the queue is above the high watermark.
+
+        Returns:
+            bool: Whether to judge it. If not, save it as NOT_EVALUATED.
+        """
+        self.stats["submitted"] += 1
+
+        fill_ratio = self._queue.qsize() / max(self._queue.maxsize, 1)
+        rate = self.peak_sample_rate if fill_ratio > self.high_watermark else self.sample_rate
+        if random.random() >= rate:
+            self.stats["sampled_out"] += 1
+            return False
+        return True
+
+    def submit(self, conversation_id, timestamp, question, answer):
+        """
+        Queue a saved conversation for judging, without waiting.
+
+        If the queue is full, the oldest job is dropped and its
+        conversation marked NOT_EVALUATED.
+
+        Args:
+            conversation_id (str): The id of the conversation row.
+            timestamp (datetime): The timestamp of the conversation row,
+                which with the id identifies it.
+            question (str): The user question.
+            answer (str): The generated answer.
+        """
+        if self._queue.full():
+            # The newest answer is the more useful one to judge
+            dropped_id, dropped_timestamp, _, _ = self._queue.get_nowait()
+            self._queue.task_done()
+            self.stats["dropped"] += 1
+            asyncio.create_task(
+                self._write([(
+                    dropped_id,
+                    dropped_timestamp,
+                    NOT_EVALUATED_RELEVANCE,
+                    "Dropped from the judge queue",
+                    None,
+                )])
+            )
+
+        self._queue.put_nowait((conversation_id, timestamp, question, answer))
+
+    async def join(self):
+        """
+        Wait until every queued job has been processed.
+        """
+        await self._queue.join()
+
+    async def close(self):
+        """
+        Stop the workers; queued jobs are not processed.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _next_batch(self):
+        """
+        Wait for a first job, then collect more for up to `batch_timeout`.
+        """
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_timeout
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _judge(self, job):
+        """
+        Judge one job within the worker limit.
+        """
+        conversation_id, timestamp, question, answer = job
+
+        async with self._semaphore:
+            try:
+                relevance, explanation, tokens = await self.evaluate_fn(question, answer)
+                self.stats["evaluated"] += 1
+            except Exception as e:  # pylint: disable=broad-except
+                relevance, explanation, tokens = "UNKNOWN", f"Evaluation failed: {e}", None
+                self.stats["failed"] += 1
+
+        return conversation_id, timestamp, relevance, explanation, tokens
+
+    async def _write(self, results):
+        """
+        Write results from a worker thread, logging failures.
+        """
+        try:
+            await asyncio.to_thread(self.write_fn, results)
+            self.stats["batches"] += 1
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Failed to write {len(results)} judge results: {e}", flush=True)
+
+    async def _worker(self):
+        """
+        Process batches until cancelled.
+        """
+        while True:
+            batch = await self._next_batch()
+            try:
+                results = await asyncio.gather(*[self._judge(job) for job in batch])
+                await self._write(results)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
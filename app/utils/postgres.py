@@ -1,24 +1,73 @@
 """
+This module provides the Postgres schema and data access of the app.
+
+Data-access functions borrow connections from a process-wide
+psycopg_pool ConnectionPool, `get_pool`, instead of connecting on every
+call. It is configured from the POSTGRES_* environment variables:
+    1. POSTGRES_POOL_MIN_SIZE / POSTGRES_POOL_MAX_SIZE (default 1 / 10)
+    2. POSTGRES_POOL_MAX_LIFETIME: seconds before a connection is
+       recycled (default 1800)
+    3. POSTGRES_POOL_MAX_IDLE: seconds before an idle connection above
+       min_size is closed (default 300)
+    4. POSTGRES_POOL_TIMEOUT: seconds to wait for a connection
+       (default 30)
+Connections are checked before being handed out. `get_pool_stats`
+reports checkout wait times and pool saturation, and the app logs them
+on every run.
+
+Both tables are range-partitioned by month of `timestamp`, so dashboard
+time ranges only scan the partitions they cover. `init_db` migrates the
+unpartitioned tables of earlier versions, keeps monthly partitions from
+PARTITION_MONTHS_BACK months ago to PARTITION_MONTHS_AHEAD months ahead
+and creates the INDEX_STATEMENTS indexes. `maintain_partitions` keeps
+creating the months ahead from the running app, moving any rows that
+already fell back to the default partitions. See
+benchmarks/postgres_schema.py for the EXPLAIN-backed comparison.
 """
 
+import atexit
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg
 from psycopg.rows import dict_row
 from psycopg.errors import DatabaseError, OperationalError
-from datetime import datetime
+from psycopg_pool import ConnectionPool
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 TZ = ZoneInfo("Africa/Cairo")
+UTC = ZoneInfo("UTC")
+
+POOL_CONFIG = {
+    'min_size': int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1")),
+    'max_size': int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10")),
+    'max_lifetime': float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", "1800")),
+    'max_idle': float(os.getenv("POSTGRES_POOL_MAX_IDLE", "300")),
+    'timeout': float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
 
+## Both tables are partitioned by month of timestamp, which must then be
+## part of their primary keys. For the same reason feedback.conversation_id
+## cannot reference conversations(id) and is only indexed, and a repeated
+## conversation id is no longer rejected: writers must use a new id per
+## conversation (the app does per question), and updates of a row must
+## match on (id, timestamp).
 CREATE_STATEMENTS = {
     'conversations' : """
         CREATE TABLE conversations (
-            id TEXT PRIMARY KEY,
+            id TEXT NOT NULL,
             question TEXT NOT NULL,
             answer TEXT NOT NULL,
             course TEXT NOT NULL,
             model_used TEXT NOT NULL,
             response_time FLOAT NOT NULL,
+            time_to_first_token FLOAT,
             relevance TEXT NOT NULL,
             relevance_explanation TEXT NOT NULL,
             prompt_tokens INTEGER NOT NULL,
@@ -28,19 +77,59 @@ CREATE_STATEMENTS = {
             eval_completion_tokens INTEGER NOT NULL,
             eval_total_tokens INTEGER NOT NULL,
             openai_cost FLOAT NOT NULL,
-            timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-        );
+            cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
     """.strip(),
     'feedback' : """
         CREATE TABLE feedback (
-            id SERIAL PRIMARY KEY,
-            conversation_id TEXT REFERENCES conversations(id),
+            id SERIAL,
+            conversation_id TEXT NOT NULL,
             feedback INTEGER NOT NULL,
-            timestamp TIMESTAMP WITH TIME ZONE NOT NULL
-        )
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
     """.strip(),
 }
 
+## Created on the partitioned tables, hence on every partition:
+##   - BRIN on timestamp: tiny, for the time-range scans of the dashboards
+##   - B-tree on timestamp: for ORDER BY timestamp DESC LIMIT n
+##   - (relevance, timestamp): for the relevance filter of recent conversations
+##   - feedback.conversation_id: for the conversations/feedback join
+INDEX_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS conversations_timestamp_brin ON conversations USING brin (timestamp);",
+    "CREATE INDEX IF NOT EXISTS conversations_timestamp_idx ON conversations (timestamp);",
+    "CREATE INDEX IF NOT EXISTS conversations_relevance_timestamp_idx ON conversations (relevance, timestamp);",
+    "CREATE INDEX IF NOT EXISTS feedback_timestamp_brin ON feedback USING brin (timestamp);",
+    "CREATE INDEX IF NOT EXISTS feedback_conversation_id_idx ON feedback (conversation_id);",
+]
+
+CONVERSATION_COLUMNS = [
+    "id", "question", "answer", "course", "model_used", "response_time",
+    "time_to_first_token", "relevance", "relevance_explanation", "prompt_tokens",
+    "completion_tokens", "total_tokens", "eval_prompt_tokens", "eval_completion_tokens",
+    "eval_total_tokens", "openai_cost", "cache_hit", "timestamp",
+]
+FEEDBACK_COLUMNS = ["conversation_id", "feedback", "timestamp"]
+PARTITION_COLUMNS = {
+    'conversations': CONVERSATION_COLUMNS,
+    'feedback': ["id"] + FEEDBACK_COLUMNS,
+}
+
+## Monthly partitions are created this many months around now by init_db,
+## and ahead of now by maintain_partitions; rows outside of them go to the
+## default partition
+PARTITION_MONTHS_BACK = 12
+PARTITION_MONTHS_AHEAD = 3
+
+## Applied to existing tables by init_db
+ADDED_COLUMNS = [
+    ('conversations', 'time_to_first_token FLOAT'),
+    ('conversations', 'cache_hit BOOLEAN NOT NULL DEFAULT FALSE'),
+]
+
 
 def get_db_connection(autocommit=True, **conn_info):
     """
@@ -107,6 +196,161 @@ def drop_db(conn, db_name):
             print(f"Database {db_name} doesn't exist!")
 
 
+def month_ranges(start, end):
+    """
+    Return the (first day, first day of next month) UTC bounds of every
+    month from the month of start to the month of end.
+    """
+    month = datetime(start.year, start.month, 1, tzinfo=UTC)
+    ranges = []
+    while month <= end:
+        next_month = datetime(
+            month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=UTC
+        )
+        ranges.append((month, next_month))
+        month = next_month
+    return ranges
+
+
+def create_partition(conn, table_name, month, next_month):
+    """
+    Create the partition of one month, in one transaction. Rows of the
+    month already in the default partition, e.g. inserted after the
+    partitions ran out, are moved to it, as Postgres refuses to create
+    it over them.
+    """
+    partition_name = f"{table_name}_{month:%Y_%m}"
+    default_name = f"{table_name}_default"
+    columns = ", ".join(PARTITION_COLUMNS[table_name])
+    bounds = {'start': month, 'end': next_month}
+
+    with conn.transaction():
+        has_rows = conn.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {default_name} "
+            f"WHERE timestamp >= %(start)s AND timestamp < %(end)s);",
+            bounds,
+        ).fetchone()[0]
+        if has_rows:
+            conn.execute(f"ALTER TABLE {table_name} DETACH PARTITION {default_name};")
+
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}');"
+        )
+
+        if has_rows:
+            conn.execute(
+                f"INSERT INTO {partition_name} ({columns}) SELECT {columns} FROM {default_name} "
+                f"WHERE timestamp >= %(start)s AND timestamp < %(end)s;",
+                bounds,
+            )
+            conn.execute(
+                f"DELETE FROM {default_name} WHERE timestamp >= %(start)s AND timestamp < %(end)s;",
+                bounds,
+            )
+            conn.execute(f"ALTER TABLE {table_name} ATTACH PARTITION {default_name} DEFAULT;")
+            print(f'Moved the {month:%Y-%m} rows of {default_name} to {partition_name}')
+
+
+def create_partitions(conn, start, end):
+    """
+    Create the default partitions of both tables, and their missing
+    monthly partitions from the month of start to the month of end.
+    """
+    for table_name in CREATE_STATEMENTS:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT;"
+        )
+        for month, next_month in month_ranges(start, end):
+            if not check_table_exists(conn, f"{table_name}_{month:%Y_%m}"):
+                create_partition(conn, table_name, month, next_month)
+
+
+def ensure_partitions(start, end, is_setup=False):
+    """
+    Create the monthly partitions from the month of start to the month
+    of end, e.g. before loading history.
+    """
+    with pooled_connection(is_setup) as conn:
+        create_partitions(conn, start, end)
+
+
+def count_default_partition_rows(conn):
+    """
+    Return the number of rows of each default partition. They should be
+    empty, rows only land there outside of the monthly partitions.
+    """
+    return {
+        table_name: conn.execute(f"SELECT count(*) FROM {table_name}_default;").fetchone()[0]
+        for table_name in CREATE_STATEMENTS
+    }
+
+
+def maintain_partitions(is_setup=False):
+    """
+    Create the partitions of this month to PARTITION_MONTHS_AHEAD months
+    ahead, so that new rows never fall back to the default partitions.
+    Run periodically by the RollupRefresher, as init_db only runs on setup.
+
+    Returns:
+        dict: The number of rows of each default partition.
+    """
+    now = datetime.now(UTC)
+    with pooled_connection(is_setup) as conn:
+        create_partitions(conn, now, now + timedelta(days=31 * PARTITION_MONTHS_AHEAD))
+        return count_default_partition_rows(conn)
+
+
+def check_table_partitioned(conn, table_name):
+    """
+    """
+    res = conn.execute(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (table_name,)
+    )
+    return bool(res.fetchone()[0])
+
+
+def migrate_to_partitioned_tables(conn):
+    """
+    Move the rows of the unpartitioned tables of earlier versions to
+    partitioned tables, in one transaction.
+    """
+    with conn.transaction():
+        for table_name in CREATE_STATEMENTS:
+            conn.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_unpartitioned;")
+            conn.execute(
+                f"ALTER INDEX {table_name}_pkey RENAME TO {table_name}_unpartitioned_pkey;"
+            )
+        conn.execute("ALTER SEQUENCE feedback_id_seq RENAME TO feedback_unpartitioned_id_seq;")
+
+        start, end = conn.execute(
+            "SELECT min(timestamp), max(timestamp) FROM conversations_unpartitioned;"
+        ).fetchone()
+        now = datetime.now(UTC)
+
+        for table_name, create_statement in CREATE_STATEMENTS.items():
+            conn.execute(create_statement)
+        create_partitions(conn, min(start or now, now), max(end or now, now))
+
+        conversation_columns = ", ".join(PARTITION_COLUMNS['conversations'])
+        feedback_columns = ", ".join(PARTITION_COLUMNS['feedback'])
+        conn.execute(
+            f"INSERT INTO conversations ({conversation_columns}) "
+            f"SELECT {conversation_columns} FROM conversations_unpartitioned;"
+        )
+        conn.execute(
+            f"INSERT INTO feedback ({feedback_columns}) "
+            f"SELECT {feedback_columns} FROM feedback_unpartitioned;"
+        )
+        conn.execute(
+            "SELECT setval(pg_get_serial_sequence('feedback', 'id'), "
+            "COALESCE((SELECT max(id) FROM feedback), 0) + 1, false);"
+        )
+
+        conn.execute("DROP TABLE feedback_unpartitioned;")
+        conn.execute("DROP TABLE conversations_unpartitioned;")
+
+
 def init_db(reinit_db=False):
     """
     """
@@ -140,88 +384,279 @@ def init_db(reinit_db=False):
                 conn.execute(CREATE_STATEMENTS[table_name])
                 print(f'Successfully created table {table_name}')
 
+        ## =====> Columns added after the tables were first created
+        for table_name, column_definition in ADDED_COLUMNS:
+            conn.execute(
+                f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_definition};"
+            )
 
-def save_conversation(conversation_id, question, answer_data, course, timestamp=None, is_setup=False):
-    if timestamp is None:
-        timestamp = datetime.now(TZ)
+        ## =====> Partitions and indexes
+        if not check_table_partitioned(conn, 'conversations'):
+            print('Migrating tables to monthly partitions...')
+            migrate_to_partitioned_tables(conn)
+            print('Successfully migrated tables to monthly partitions')
+
+        now = datetime.now(UTC)
+        create_partitions(
+            conn,
+            now - timedelta(days=31 * PARTITION_MONTHS_BACK),
+            now + timedelta(days=31 * PARTITION_MONTHS_AHEAD),
+        )
+        for index_statement in INDEX_STATEMENTS:
+            conn.execute(index_statement)
+        print('Partitions and indexes are up to date')
 
-    conn_info = {
-        'postgres_host':os.getenv("POSTGRES_HOST"),
+
+def get_conn_info(is_setup=False):
+    """
+    Return the connection info of the app database from the
+    environment variables.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST,
+        for scripts running outside the containers.
+
+    Returns:
+        dict: The `get_db_connection` arguments.
+    """
+    return {
+        'postgres_host':os.getenv("POSTGRES_SETUP_HOST" if is_setup else "POSTGRES_HOST"),
         'postgres_user':os.getenv("POSTGRES_USER"),
         'postgres_password':os.getenv("POSTGRES_PASSWORD"),
         'postgres_port':os.getenv("POSTGRES_PORT"),
         'postgres_db':os.getenv("POSTGRES_DB"),
     }
 
-    if is_setup:
-        conn_info['postgres_host'] = os.getenv("POSTGRES_SETUP_HOST")
-    
-    with get_db_connection(**conn_info) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO conversations 
-                (id, question, answer, course, model_used, response_time, relevance, 
-                relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
-            """,
-                (
-                    conversation_id,
-                    question,
-                    answer_data["answer"],
-                    course,
-                    answer_data["model_used"],
-                    answer_data["response_time"],
-                    answer_data["relevance"],
-                    answer_data["relevance_explanation"],
-                    answer_data["prompt_tokens"],
-                    answer_data["completion_tokens"],
-                    answer_data["total_tokens"],
-                    answer_data["eval_prompt_tokens"],
-                    answer_data["eval_completion_tokens"],
-                    answer_data["eval_total_tokens"],
-                    answer_data["openai_cost"],
-                    timestamp,
-                ),
+
+def pool_kwargs(conn_info):
+    """
+    Return the connection arguments of a pool: the same connections
+    as `get_db_connection`, in autocommit mode.
+    """
+    return {
+        'host': conn_info.get("postgres_host"),
+        'dbname': conn_info.get("postgres_db"),
+        'user': conn_info.get("postgres_user"),
+        'password': conn_info.get("postgres_password"),
+        'port': conn_info.get("postgres_port"),
+        'autocommit': True,
+    }
+
+
+class PoolMetrics:
+    """
+    Checkout metrics of a pool. Thread-safe.
+
+    Attributes:
+        checkouts (int): Connections borrowed.
+        wait_seconds_total (float): Total time spent waiting for them.
+        wait_seconds_max (float): Longest wait.
+        saturated_checkouts (int): Checkouts that found no idle
+            connection at the maximum pool size.
+    """
+
+    def __init__(self):
+        """
+        Initializes the PoolMetrics.
+        """
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.saturated_checkouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait_seconds, saturated):
+        """
+        Record one checkout.
+        """
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self.saturated_checkouts += saturated
+
+    def snapshot(self):
+        """
+        Return the metrics as a dictionary.
+        """
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_seconds_mean': self.wait_seconds_total / self.checkouts
+                if self.checkouts
+                else 0.0,
+                'wait_seconds_max': self.wait_seconds_max,
+                'saturated_checkouts': self.saturated_checkouts,
+            }
+
+
+def is_saturated(pool):
+    """
+    Whether a pool has no idle connection and cannot grow.
+    """
+    stats = pool.get_stats()
+    return stats['pool_available'] == 0 and stats['pool_size'] >= pool.max_size
+
+
+def get_pool(is_setup=False):
+    """
+    Return the process-wide connection pool, opened on first use.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+
+    Returns:
+        ConnectionPool: The pool, with a `metrics` attribute.
+    """
+    with _pools_lock:
+        if is_setup not in _pools:
+            pool = ConnectionPool(
+                kwargs=pool_kwargs(get_conn_info(is_setup)),
+                check=ConnectionPool.check_connection,
+                name="postgres-setup" if is_setup else "postgres",
+                open=True,
+                **POOL_CONFIG,
             )
+            pool.metrics = PoolMetrics()
+            atexit.register(pool.close)
+            _pools[is_setup] = pool
+        return _pools[is_setup]
 
 
-def save_feedback(conversation_id, feedback, timestamp=None, is_setup=False):
+@contextmanager
+def pooled_connection(is_setup=False):
+    """
+    Borrow a connection from the pool, recording the checkout wait.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+
+    Yields:
+        psycopg.Connection: An autocommit connection, returned to the
+        pool on exit.
+    """
+    pool = get_pool(is_setup)
+    saturated = is_saturated(pool)
+    start_time = time.perf_counter()
+
+    with pool.connection() as conn:
+        pool.metrics.record(time.perf_counter() - start_time, saturated)
+        yield conn
+
+
+def get_pool_stats():
+    """
+    Return the metrics of the open pools.
+
+    Returns:
+        dict: Per pool name, the psycopg_pool stats (pool_size,
+        pool_available, requests_waiting, ...), the checkout metrics
+        and the saturation, the fraction of max_size in use.
+    """
+    stats = {}
+    for pool in list(_pools.values()):
+        pool_stats = pool.get_stats()
+        in_use = pool_stats['pool_size'] - pool_stats['pool_available']
+        stats[pool.name] = {
+            **pool_stats,
+            **pool.metrics.snapshot(),
+            'saturation': in_use / pool.max_size,
+        }
+    return stats
+
+
+INSERT_CONVERSATION = """
+    INSERT INTO conversations 
+    (id, question, answer, course, model_used, response_time, time_to_first_token,
+    relevance, relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
+    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, cache_hit, timestamp)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+"""
+
+UPDATE_CONVERSATION_RELEVANCE = """
+    UPDATE conversations SET
+        relevance = %(relevance)s,
+        relevance_explanation = %(relevance_explanation)s,
+        eval_prompt_tokens = %(eval_prompt_tokens)s,
+        eval_completion_tokens = %(eval_completion_tokens)s,
+        eval_total_tokens = %(eval_total_tokens)s,
+        openai_cost = openai_cost + %(eval_cost)s
+    WHERE id = %(id)s AND timestamp = %(timestamp)s
+"""
+
+
+def conversation_row(conversation_id, question, answer_data, course, timestamp=None):
+    """
+    Return the INSERT_CONVERSATION parameters of a conversation.
+    """
     if timestamp is None:
         timestamp = datetime.now(TZ)
 
-    conn_info = {
-        'postgres_host':os.getenv("POSTGRES_HOST"),
-        'postgres_user':os.getenv("POSTGRES_USER"),
-        'postgres_password':os.getenv("POSTGRES_PASSWORD"),
-        'postgres_port':os.getenv("POSTGRES_PORT"),
-        'postgres_db':os.getenv("POSTGRES_DB"),
-    }
+    return (
+        conversation_id,
+        question,
+        answer_data["answer"],
+        course,
+        answer_data["model_used"],
+        answer_data["response_time"],
+        answer_data.get("time_to_first_token"),
+        answer_data["relevance"],
+        answer_data["relevance_explanation"],
+        answer_data["prompt_tokens"],
+        answer_data["completion_tokens"],
+        answer_data["total_tokens"],
+        answer_data["eval_prompt_tokens"],
+        answer_data["eval_completion_tokens"],
+        answer_data["eval_total_tokens"],
+        answer_data["openai_cost"],
+        answer_data.get("cache_hit", False),
+        timestamp,
+    )
 
-    if is_setup:
-        conn_info['postgres_host'] = os.getenv("POSTGRES_SETUP_HOST")
-    
-    with get_db_connection(**conn_info) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO feedback (conversation_id, feedback, timestamp) VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))",
-                (conversation_id, feedback, timestamp),
-            )
 
+def save_conversation(conversation_id, question, answer_data, course, timestamp=None, is_setup=False):
+    with pooled_connection(is_setup) as conn:
+        conn.execute(
+            INSERT_CONVERSATION,
+            conversation_row(conversation_id, question, answer_data, course, timestamp),
+        )
 
-def get_recent_conversations(limit=5, relevance=None):
+
+def update_conversations_relevance(evaluations, is_setup=False):
     """
+    Fill in the LLM-as-a-judge columns of saved conversations, all in
+    one transaction.
+
+    Args:
+        evaluations (list): Dicts with the keys id, timestamp,
+            relevance, relevance_explanation, eval_prompt_tokens,
+            eval_completion_tokens, eval_total_tokens and eval_cost,
+            which is added to the conversation's openai_cost.
     """
-    conn_info = {
-        'postgres_host':os.getenv("POSTGRES_HOST"),
-        'postgres_user':os.getenv("POSTGRES_USER"),
-        'postgres_password':os.getenv("POSTGRES_PASSWORD"),
-        'postgres_port':os.getenv("POSTGRES_PORT"),
-        'postgres_db':os.getenv("POSTGRES_DB"),
-    }
+    if not evaluations:
+        return
 
-    with get_db_connection(**conn_info) as conn:
+    with pooled_connection(is_setup) as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.executemany(UPDATE_CONVERSATION_RELEVANCE, evaluations)
+
+
+def save_feedback(conversation_id, feedback, timestamp=None, is_setup=False):
+    if timestamp is None:
+        timestamp = datetime.now(TZ)
+
+    with pooled_connection(is_setup) as conn:
+        conn.execute(
+            "INSERT INTO feedback (conversation_id, feedback, timestamp) VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))",
+            (conversation_id, feedback, timestamp),
+        )
+
+
+def get_recent_conversations(limit=5, relevance=None):
+    """
+    """
+    with pooled_connection() as conn:
         with conn.cursor(row_factory=dict_row) as cur:
             query = """
                 SELECT c.*, f.feedback
@@ -239,15 +674,7 @@ def get_recent_conversations(limit=5, relevance=None):
 def get_feedback_stats():
     """
     """
-    conn_info = {
-        'postgres_host':os.getenv("POSTGRES_HOST"),
-        'postgres_user':os.getenv("POSTGRES_USER"),
-        'postgres_password':os.getenv("POSTGRES_PASSWORD"),
-        'postgres_port':os.getenv("POSTGRES_PORT"),
-        'postgres_db':os.getenv("POSTGRES_DB"),
-    }
-
-    with get_db_connection(**conn_info) as conn:
+    with pooled_connection() as conn:
         with conn.cursor(row_factory=dict_row) as cur:
             cur.execute("""
                 SELECT 
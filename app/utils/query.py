@@ -17,6 +17,8 @@ from utils.elasticsearch import create_elasticsearch_client
 from utils.ollama import (create_ollama_client,
                           get_embedding)
 from utils.openai import create_openai_client
+from utils.fusion import reciprocal_rank_fusion
+from utils.multithread import run_in_parallel
 
 
 ## Create clients 
@@ -95,7 +97,7 @@ def build_prompt(prompt_template_path, **document_dict):
     return prompt
 
 
-def elastic_search_text(query, course):
+def elastic_search_text(query, course, num_results=5):
     """
     """
     search_query = {
@@ -116,21 +118,21 @@ def elastic_search_text(query, course):
     responses = ES_CLIENT.search(
         index=INDEX_NAME,
         body=search_query,
-        size=5,
+        size=num_results,
     )
     
     return [hit["_source"] for hit in responses["hits"]["hits"]]    
 
 
 def elastic_search_knn(
-    query_vector, course
+    query_vector, course, num_results=5
 ):
     """
     """
     knn = {
         "field": "question_text_vector",
         "query_vector": query_vector,
-        "k": 5,
+        "k": num_results,
         "num_candidates": 10_000,
         "filter": {"term": {"course": course}},
     }
@@ -143,12 +145,39 @@ def elastic_search_knn(
     responses = ES_CLIENT.search(
         index=INDEX_NAME,
         body=search_query,
-        size=5,
+        size=num_results,
     )
     
     return [hit["_source"] for hit in responses["hits"]["hits"]]
 
 
+def elastic_search_vector(query, course, num_results=5):
+    """
+    Embed the query and run a kNN search with it.
+    """
+    query_vector = get_embedding(
+        client=OLLAMA_CLIENT, 
+        text=query, 
+        model_name="locusai/multi-qa-minilm-l6-cos-v1",
+    )
+    return elastic_search_knn(query_vector, course, num_results)
+
+
+def elastic_search_hybrid(query, course, num_results=5, rank_window_size=10):
+    """
+    Run the text and vector searches concurrently and fuse their
+    rankings with reciprocal rank fusion. Latency is that of the
+    slower of the two searches.
+    """
+    text_results, vector_results = run_in_parallel(
+        lambda: elastic_search_text(query, course, rank_window_size),
+        lambda: elastic_search_vector(query, course, rank_window_size),
+    )
+    return reciprocal_rank_fusion(
+        [text_results, vector_results], num_results=num_results
+    )
+
+
 def llm(prompt, model_choice="ollama/phi3"):
     """
     """
@@ -210,14 +239,11 @@ def get_answer(query, course, model_choice, search_type):
     """
     """
     if search_type == 'Vector':
-        query_vector = get_embedding(
-            client=OLLAMA_CLIENT, 
-            text=query, 
-            model_name="locusai/multi-qa-minilm-l6-cos-v1",
-        )
-        search_results = elastic_search_knn(query_vector, course)
+        search_results = elastic_search_vector(query, course)
     elif search_type == 'Text':
         search_results = elastic_search_text(query, course)
+    elif search_type == 'Hybrid':
+        search_results = elastic_search_hybrid(query, course)
 
     context = build_context(search_results)
     document_dict = {"question": query, "context": context}
@@ -239,6 +265,7 @@ def get_answer(query, course, model_choice, search_type):
     return {
         'answer': answer,
         'response_time': response_time,
+        'time_to_first_token': response_time,
         'relevance': relevance,
         'relevance_explanation': explanation,
         'model_used': model_choice,
@@ -249,4 +276,5 @@ def get_answer(query, course, model_choice, search_type):
         'eval_completion_tokens': eval_tokens['completion_tokens'],
         'eval_total_tokens': eval_tokens['total_tokens'],
         'openai_cost': openai_cost,
+        'cache_hit': False,
     }
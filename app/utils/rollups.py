@@ -0,0 +1,374 @@
+"""
+This module maintains the pre-aggregated rollup tables the Grafana
+dashboard reads instead of the raw `conversations` and `feedback` rows.
+
+There are two granularities, `minute` and `hour`, each with:
+    1. conversation_rollups_<granularity>: per bucket, model, course and
+       relevance, the number of conversations and cache hits, token and
+       cost sums, and response time and time to first token percentiles
+    2. feedback_rollups_<granularity>: per bucket, thumbs up and down
+    3. latency_rollups_<granularity>: per bucket, over all models
+       (model_used = ALL_MODELS) and per model, the response time and
+       time to first token percentiles. Percentiles of the groups of
+       conversation_rollups cannot be combined into the percentile of a
+       bucket, so the dashboard reads these
+
+Rows change after they are written (the relevance of a conversation is
+filled in by the judge), and percentiles cannot be updated incrementally,
+so `refresh_rollups` recomputes every bucket from a given time on from
+the raw rows, in one transaction. Thanks to the monthly partitions and
+the timestamp index only those rows are read. `RollupRefresher` does it
+every `interval` seconds for the buckets since its previous refresh,
+minus `lookback` seconds for late relevance updates. Rows updated
+later than that keep their old rollup until a refresh from an earlier
+time, e.g. `refresh_rollups(conn)` over all of history. On the same
+schedule it runs `maintain_partitions`, and warns when rows fell back to
+the default partitions.
+"""
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.postgres import UTC, maintain_partitions, pooled_connection
+
+ROLLUP_GRANULARITIES = ["minute", "hour"]
+
+## Any other refresh holding it is already doing the work
+ROLLUP_LOCK_ID = 4_242_001
+
+## model_used of the latency rollup rows over all models
+ALL_MODELS = "all"
+
+CREATE_ROLLUP_STATEMENTS = {
+    'conversation_rollups' : """
+        CREATE TABLE IF NOT EXISTS conversation_rollups_{granularity} (
+            bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+            model_used TEXT NOT NULL,
+            course TEXT NOT NULL,
+            relevance TEXT NOT NULL,
+            conversations INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            prompt_tokens BIGINT NOT NULL,
+            completion_tokens BIGINT NOT NULL,
+            total_tokens BIGINT NOT NULL,
+            eval_total_tokens BIGINT NOT NULL,
+            openai_cost FLOAT NOT NULL,
+            response_time_sum FLOAT NOT NULL,
+            response_time_p50 FLOAT NOT NULL,
+            response_time_p95 FLOAT NOT NULL,
+            response_time_p99 FLOAT NOT NULL,
+            response_time_max FLOAT NOT NULL,
+            time_to_first_token_p50 FLOAT,
+            time_to_first_token_p95 FLOAT,
+            PRIMARY KEY (bucket, model_used, course, relevance)
+        );
+    """.strip(),
+    'feedback_rollups' : """
+        CREATE TABLE IF NOT EXISTS feedback_rollups_{granularity} (
+            bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+            thumbs_up INTEGER NOT NULL,
+            thumbs_down INTEGER NOT NULL
+        );
+    """.strip(),
+    'latency_rollups' : """
+        CREATE TABLE IF NOT EXISTS latency_rollups_{granularity} (
+            bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+            model_used TEXT NOT NULL,
+            conversations INTEGER NOT NULL,
+            response_time_sum FLOAT NOT NULL,
+            response_time_p50 FLOAT NOT NULL,
+            response_time_p95 FLOAT NOT NULL,
+            response_time_p99 FLOAT NOT NULL,
+            response_time_max FLOAT NOT NULL,
+            time_to_first_token_p50 FLOAT,
+            time_to_first_token_p95 FLOAT,
+            PRIMARY KEY (bucket, model_used)
+        );
+    """.strip(),
+}
+
+REFRESH_STATEMENTS = {
+    'conversation_rollups' : """
+        INSERT INTO conversation_rollups_{granularity}
+        SELECT
+            date_trunc('{granularity}', timestamp, 'UTC') AS bucket,
+            model_used,
+            course,
+            relevance,
+            COUNT(*),
+            COUNT(*) FILTER (WHERE cache_hit),
+            SUM(prompt_tokens),
+            SUM(completion_tokens),
+            SUM(total_tokens),
+            SUM(eval_total_tokens),
+            SUM(openai_cost),
+            SUM(response_time),
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY response_time),
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY response_time),
+            percentile_cont(0.99) WITHIN GROUP (ORDER BY response_time),
+            MAX(response_time),
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY time_to_first_token),
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY time_to_first_token)
+        FROM conversations
+        WHERE timestamp >= %(start)s
+        GROUP BY 1, 2, 3, 4;
+    """.strip(),
+    'feedback_rollups' : """
+        INSERT INTO feedback_rollups_{granularity}
+        SELECT
+            date_trunc('{granularity}', timestamp, 'UTC') AS bucket,
+            COUNT(*) FILTER (WHERE feedback > 0),
+            COUNT(*) FILTER (WHERE feedback < 0)
+        FROM feedback
+        WHERE timestamp >= %(start)s
+        GROUP BY 1;
+    """.strip(),
+    'latency_rollups' : """
+        INSERT INTO latency_rollups_{granularity}
+        SELECT
+            date_trunc('{granularity}', timestamp, 'UTC') AS bucket,
+            CASE WHEN GROUPING(model_used) = 1 THEN %(all_models)s ELSE model_used END,
+            COUNT(*),
+            SUM(response_time),
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY response_time),
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY response_time),
+            percentile_cont(0.99) WITHIN GROUP (ORDER BY response_time),
+            MAX(response_time),
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY time_to_first_token),
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY time_to_first_token)
+        FROM conversations
+        WHERE timestamp >= %(start)s
+        GROUP BY GROUPING SETS (
+            (date_trunc('{granularity}', timestamp, 'UTC')),
+            (date_trunc('{granularity}', timestamp, 'UTC'), model_used)
+        );
+    """.strip(),
+}
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def create_rollup_tables(conn):
+    """
+    Create the rollup tables of every granularity, if missing.
+    """
+    for granularity in ROLLUP_GRANULARITIES:
+        for create_statement in CREATE_ROLLUP_STATEMENTS.values():
+            conn.execute(create_statement.format(granularity=granularity))
+
+
+def truncate_time(timestamp, granularity):
+    """
+    Return the start of the minute or hour of a timestamp.
+    """
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def refresh_rollups(conn, since=None):
+    """
+    Recompute the rollup buckets from `since` on, in one transaction.
+
+    Args:
+        conn (psycopg.Connection): An autocommit connection.
+        since (datetime, optional): The first time to recompute, rounded
+            down to its bucket. Defaults to all of history.
+
+    Returns:
+        bool: False if another refresh was running, and this one skipped.
+    """
+    with conn.transaction():
+        locked = conn.execute(
+            "SELECT pg_try_advisory_xact_lock(%s);", (ROLLUP_LOCK_ID,)
+        ).fetchone()[0]
+        if not locked:
+            return False
+
+        for granularity in ROLLUP_GRANULARITIES:
+            start = (
+                datetime(1970, 1, 1, tzinfo=UTC)
+                if since is None
+                else truncate_time(since.astimezone(UTC), granularity)
+            )
+            for table, refresh_statement in REFRESH_STATEMENTS.items():
+                conn.execute(
+                    f"DELETE FROM {table}_{granularity} WHERE bucket >= %(start)s;",
+                    {'start': start},
+                )
+                conn.execute(
+                    refresh_statement.format(granularity=granularity),
+                    {'start': start, 'all_models': ALL_MODELS},
+                )
+
+    return True
+
+
+def init_rollups(is_setup=False):
+    """
+    Create the rollup tables, and fill them from all of history when
+    they are empty. Run by setup.py after `init_db`.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+    """
+    with pooled_connection(is_setup) as conn:
+        create_rollup_tables(conn)
+
+        # The latency rollups were added last, and are empty on upgrade
+        is_empty = conn.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM latency_rollups_hour);"
+        ).fetchone()[0]
+        if is_empty:
+            print('Filling the rollup tables...')
+            refresh_rollups(conn)
+        print('Rollup tables are up to date')
+
+
+class RollupRefresher:
+    """
+    Refreshes the recent rollup buckets and creates the upcoming monthly
+    partitions periodically, in a background thread.
+
+    Attributes:
+        interval (float): Seconds between refreshes.
+        lookback (float): Seconds before the previous refresh that are
+            recomputed, for rows updated after they were rolled up.
+        stats (dict): Refreshes, skipped and failed refreshes and
+            partition checks, the total refresh time in seconds and the
+            rows in the default partitions at the last check.
+    """
+
+    def __init__(self, interval=60, lookback=900, is_setup=False):
+        """
+        Initializes the RollupRefresher and starts its thread.
+
+        Args:
+            interval (float): Seconds between refreshes. Defaults to 60.
+            lookback (float): Seconds recomputed before the previous
+                refresh. Defaults to 900.
+            is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+        """
+        self.interval = interval
+        self.lookback = lookback
+        self.is_setup = is_setup
+
+        self.stats = {
+            "refreshes": 0,
+            "skipped": 0,
+            "failed": 0,
+            "refresh_seconds": 0.0,
+            "default_partition_rows": 0,
+        }
+
+        self._last_refresh = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rollup-refresher", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """
+        Recompute the buckets since the previous refresh minus `lookback`.
+        The first refresh starts from the latest rolled up bucket instead.
+        """
+        refresh_time = datetime.now(UTC)
+
+        since = None
+        start_time = time.perf_counter()
+        try:
+            with pooled_connection(self.is_setup) as conn:
+                last_refresh = self._last_refresh or conn.execute(
+                    "SELECT max(bucket) FROM conversation_rollups_minute;"
+                ).fetchone()[0]
+                since = last_refresh and last_refresh - timedelta(seconds=self.lookback)
+                refreshed = refresh_rollups(conn, since)
+        except Exception as e:  # pylint: disable=broad-except
+            self.stats["failed"] += 1
+            print(f"Failed to refresh the rollups since {since}: {e}", flush=True)
+            return
+
+        if refreshed:
+            self._last_refresh = refresh_time
+            self.stats["refreshes"] += 1
+            self.stats["refresh_seconds"] += time.perf_counter() - start_time
+        else:
+            self.stats["skipped"] += 1
+
+    def check_partitions(self):
+        """
+        Create the upcoming monthly partitions, and warn when the rows in
+        the default partitions change.
+        """
+        try:
+            default_rows = maintain_partitions(self.is_setup)
+        except Exception as e:  # pylint: disable=broad-except
+            self.stats["failed"] += 1
+            print(f"Failed to create the upcoming partitions: {e}", flush=True)
+            return
+
+        ## Warn again only when the number of rows changes
+        n_default_rows = sum(default_rows.values())
+        if n_default_rows == self.stats["default_partition_rows"]:
+            return
+        self.stats["default_partition_rows"] = n_default_rows
+        for table_name, n_rows in default_rows.items():
+            if n_rows:
+                print(
+                    f"WARNING: {n_rows} rows in {table_name}_default, outside of the monthly partitions",
+                    flush=True,
+                )
+
+    def close(self):
+        """
+        Stop the refresh thread.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        """
+        Check the partitions and refresh now, then every `interval`
+        seconds until closed.
+        """
+        self._tick()
+        while not self._stop.wait(self.interval):
+            self._tick()
+
+    def _tick(self):
+        """
+        Check the partitions and refresh, without ever raising, so that
+        one bad tick cannot end the thread.
+        """
+        try:
+            self.check_partitions()
+            self.refresh()
+        except Exception as e:  # pylint: disable=broad-except
+            self.stats["failed"] += 1
+            print(f"Rollup refresher tick failed: {e}", flush=True)
+
+
+def get_rollup_refresher(is_setup=False, **kwargs):
+    """
+    Return the process-wide rollup refresher, started on first use and
+    stopped at exit. Later calls ignore `kwargs`.
+
+    Args:
+        is_setup (bool): Whether to connect through POSTGRES_SETUP_HOST.
+        **kwargs: Arguments of RollupRefresher. interval and lookback
+        default to $ROLLUP_REFRESH_INTERVAL and $ROLLUP_LOOKBACK.
+
+    Returns:
+        RollupRefresher: The rollup refresher.
+    """
+    with _refreshers_lock:
+        if is_setup not in _refreshers:
+            kwargs.setdefault("interval", float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60")))
+            kwargs.setdefault("lookback", float(os.getenv("ROLLUP_LOOKBACK", "900")))
+            refresher = RollupRefresher(is_setup=is_setup, **kwargs)
+            atexit.register(refresher.close)
+            _refreshers[is_setup] = refresher
+        return _refreshers[is_setup]
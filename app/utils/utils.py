@@ -2,7 +2,8 @@
 This module provides utility functions for handling various
 tasks such as parameter extraction from text, environment
 variable initialization, JSON document loading, duplicate
-finding, document ID generation, and JSON response parsing.
+finding, document ID and content hash generation, and JSON
+response parsing.
 """
 
 import hashlib
@@ -144,6 +145,40 @@ def id_documents(docs):
     return docs
 
 
+def generate_content_hash(doc, fields=("course", "section", "question", "text")):
+    """
+    Generate a hash of the full content of a document.
+
+    Unlike the document ID, which only covers the start of the
+    text, the hash changes whenever any of the fields changes.
+
+    Args:
+        doc (dict): The document.
+        fields (tuple, optional): The fields to hash.
+
+    Returns:
+        str: The MD5 hex digest of the fields.
+    """
+    combined = json.dumps([doc.get(field) for field in fields], ensure_ascii=False)
+    return hashlib.md5(combined.encode()).hexdigest()
+
+
+def hash_documents(docs):
+    """
+    Assign content hashes to a list of documents.
+
+    Args:
+        docs (list): A list of documents.
+
+    Returns:
+        list: The list of documents with a 'content_hash' field.
+    """
+    for doc in docs:
+        doc["content_hash"] = generate_content_hash(doc)
+
+    return docs
+
+
 def correct_json_string(input_string):
     """
     Correct JSON string by replacing single backslashes with
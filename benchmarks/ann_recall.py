@@ -0,0 +1,160 @@
+"""
+This module measures recall against latency of `minsearch.IVFIndex`
+compared with the exact `minsearch.VectorIndex` on synthetic corpora.
+
+Vectors are drawn from a Gaussian mixture, so the corpus has cluster
+structure like real embeddings, and every document gets one of a few
+courses so the per-course partitioning is exercised. For each corpus
+size the exact index is the reference; the IVF index is swept over
+`nprobe` and reports recall@k and mean per-query latency of `search`.
+
+Usage:
+    python benchmarks/ann_recall.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils import minsearch
+
+
+def make_corpus(n_docs, dim, n_courses, n_clusters, rng):
+    """
+    Build a synthetic corpus of clustered vectors.
+
+    Args:
+        n_docs (int): Number of documents.
+        dim (int): Vector dimension.
+        n_courses (int): Number of distinct course values.
+        n_clusters (int): Number of mixture components.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        tuple: (docs, vectors, centers).
+    """
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_docs)]
+    vectors += 0.5 * rng.normal(size=(n_docs, dim)).astype(np.float32)
+
+    docs = [{"id": str(i), "course": f"course-{i % n_courses}"} for i in range(n_docs)]
+
+    return docs, vectors, centers
+
+
+def recall_at_k(exact_results, approx_results):
+    """
+    Average fraction of the exact top-k found by the approximate search.
+    """
+    recalls = [
+        len({d["id"] for d in exact} & {d["id"] for d in approx}) / len(exact)
+        for exact, approx in zip(exact_results, approx_results)
+        if exact
+    ]
+
+    return float(np.mean(recalls))
+
+
+def time_search(index, query_vectors, filter_dicts, num_results, **search_params):
+    """
+    Mean latency in ms of single-query `search`.
+    """
+    start_time = time.perf_counter()
+    for query_vector, filter_dict in zip(query_vectors, filter_dicts):
+        index.search(query_vector, filter_dict, num_results, **search_params)
+
+    return (time.perf_counter() - start_time) / len(query_vectors) * 1000
+
+
+def main(
+    sizes=(10_000, 100_000, 1_000_000),
+    dim=384,
+    n_queries=200,
+    num_results=10,
+    nprobes=(1, 2, 4, 8, 16, 32),
+    n_courses=3,
+    seed=1,
+):
+    """
+    Run the benchmark and print one table per corpus size.
+
+    Args:
+        sizes (tuple, optional): Corpus sizes to benchmark.
+        dim (int, optional): Vector dimension. Default is 384, the
+        dimension of multi-qa-MiniLM-L6-cos-v1.
+        n_queries (int, optional): Number of queries. Default is 200.
+        num_results (int, optional): The k of recall@k. Default is 10.
+        nprobes (tuple, optional): Values of `nprobe` to sweep.
+        n_courses (int, optional): Number of courses. Default is 3.
+        seed (int, optional): Random seed. Default is 1.
+    """
+    rng = np.random.default_rng(seed)
+
+    for n_docs in sizes:
+        docs, vectors, centers = make_corpus(
+            n_docs, dim, n_courses, n_clusters=max(n_docs // 1000, 10), rng=rng
+        )
+        query_vectors = centers[rng.integers(0, len(centers), n_queries)]
+        query_vectors += 0.5 * rng.normal(size=query_vectors.shape).astype(np.float32)
+        filter_dicts = [
+            {"course": f"course-{i % n_courses}"} for i in range(n_queries)
+        ]
+
+        exact_index = minsearch.VectorIndex("vector", ["course"]).fit(docs, vectors)
+        exact_results = exact_index.search_batch(query_vectors, filter_dicts, num_results)
+        exact_ms = time_search(exact_index, query_vectors, filter_dicts, num_results)
+
+        start_time = time.perf_counter()
+        ivf_index = minsearch.IVFIndex(
+            "vector", ["course"], partition_field="course", seed=seed
+        ).fit(docs, vectors)
+        fit_time = time.perf_counter() - start_time
+
+        print(
+            f"\nDocuments: {n_docs}, dim: {dim}, queries: {n_queries}, "
+            f"lists: {len(ivf_index.centroids)}, IVF fit: {fit_time:.1f} s"
+        )
+        print(f"{'index':<14}{'recall@' + str(num_results):>10}{'search (ms)':>13}")
+        print(f"{'exact':<14}{1.0:>10.3f}{exact_ms:>13.3f}")
+
+        for nprobe in nprobes:
+            approx_results = ivf_index.search_batch(
+                query_vectors, filter_dicts, num_results, nprobe=nprobe
+            )
+            ivf_ms = time_search(
+                ivf_index, query_vectors, filter_dicts, num_results, nprobe=nprobe
+            )
+            print(
+                f"{'ivf nprobe=' + str(nprobe):<14}"
+                f"{recall_at_k(exact_results, approx_results):>10.3f}{ivf_ms:>13.3f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+        help='Corpus sizes'
+    )
+    parser.add_argument('--dim', type=int, default=384, help='Vector dimension')
+    parser.add_argument('--n_queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--num_results', type=int, default=10, help='Results per query')
+    parser.add_argument(
+        '--nprobes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+        help='nprobe values to sweep'
+    )
+    args = parser.parse_args()
+
+    main(
+        sizes=args.sizes,
+        dim=args.dim,
+        n_queries=args.n_queries,
+        num_results=args.num_results,
+        nprobes=args.nprobes,
+    )
@@ -0,0 +1,151 @@
+"""
+This module compares the encodings of `EmbeddingStore` on a synthetic
+corpus of clustered, L2-normalized embeddings.
+
+For every encoding it reports the memory of the codes, the saving
+against embeddings attached to documents as Python lists of floats
+(what `vectorize_sentences` and `embed_documents` produce) and against
+float32, recall@k against exact float32 search with and without
+full-precision re-ranking, and mean per-query latency.
+
+Usage:
+    python benchmarks/embedding_quantization.py --n_docs 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils.embedding_store import QUANTIZATIONS, EmbeddingStore
+
+
+def python_list_nbytes(n_docs, dim):
+    """
+    Bytes of n_docs embeddings stored as lists of Python floats: the
+    list header, one pointer per item and one float object per item.
+    """
+    vector = [0.5] * dim
+    per_list = sys.getsizeof(vector) + dim * sys.getsizeof(0.5)
+    return n_docs * per_list
+
+
+def recall_at_k(exact_indices, approx_indices):
+    """
+    Average fraction of the exact top-k found by the approximate search.
+    """
+    return float(
+        np.mean(
+            [
+                len(set(exact) & set(approx)) / len(exact)
+                for exact, approx in zip(exact_indices, approx_indices)
+            ]
+        )
+    )
+
+
+def main(
+    n_docs=100_000,
+    dim=384,
+    latent_dim=32,
+    n_queries=200,
+    num_results=10,
+    rerank=4,
+    n_subvectors=None,
+    seed=1,
+):
+    """
+    Run the benchmark and print one line per encoding.
+
+    Args:
+        n_docs (int, optional): Number of vectors. Default is 100000.
+        dim (int, optional): Vector dimension. Default is 384, the
+        dimension of multi-qa-MiniLM-L6-cos-v1.
+        latent_dim (int, optional): Dimension of the subspace the
+        clusters are drawn in. Default is 32.
+        n_queries (int, optional): Number of queries. Default is 200.
+        num_results (int, optional): The k of recall@k. Default is 10.
+        rerank (int, optional): Re-ranking depth as a multiple of
+        num_results. Default is 4.
+        n_subvectors (int, optional): Number of PQ subvectors.
+        Default is dim / 8.
+        seed (int, optional): Random seed. Default is 1.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n_docs // 1000, 10), latent_dim)).astype(np.float32)
+    projection = rng.normal(size=(latent_dim, dim)).astype(np.float32)
+
+    def sample(n):
+        # Clusters in a low-dimensional subspace plus a little isotropic
+        # noise, which is closer to sentence embeddings than full-rank noise
+        latent = centers[rng.integers(0, len(centers), n)]
+        latent += 0.5 * rng.normal(size=latent.shape).astype(np.float32)
+        vectors = latent @ projection
+        vectors += 0.1 * np.sqrt(latent_dim) * rng.normal(size=vectors.shape).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    vectors = sample(n_docs)
+    query_vectors = sample(n_queries)
+
+    exact_indices, _ = (
+        EmbeddingStore("float32").fit(vectors).search(query_vectors, num_results)
+    )
+    list_nbytes = python_list_nbytes(n_docs, dim)
+
+    print(f"Documents: {n_docs}, dim: {dim}, queries: {n_queries}")
+    print(f"Python lists: {list_nbytes / 2**20:.1f} MiB")
+    print(
+        f"{'encoding':<10}{'MiB':>9}{'vs lists':>10}{'vs f32':>8}"
+        f"{'recall':>8}{'+rerank':>9}{'search (ms)':>13}{'+rerank (ms)':>14}"
+    )
+
+    for quantization in QUANTIZATIONS:
+        store = EmbeddingStore(
+            quantization, n_subvectors=n_subvectors, seed=seed
+        ).fit(vectors)
+
+        recalls = []
+        latencies = []
+        for depth in [0, rerank]:
+            start_time = time.perf_counter()
+            approx_indices = [
+                store.search(query_vector, num_results, rerank=depth)[0][0]
+                for query_vector in query_vectors
+            ]
+            latencies.append((time.perf_counter() - start_time) / n_queries * 1000)
+            recalls.append(recall_at_k(exact_indices, approx_indices))
+
+        print(
+            f"{quantization:<10}{store.nbytes / 2**20:>9.1f}"
+            f"{list_nbytes / store.nbytes:>9.0f}x{vectors.nbytes / store.nbytes:>7.1f}x"
+            f"{recalls[0]:>8.3f}{recalls[1]:>9.3f}{latencies[0]:>13.3f}{latencies[1]:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument('--n_docs', type=int, default=100_000, help='Number of vectors')
+    parser.add_argument('--dim', type=int, default=384, help='Vector dimension')
+    parser.add_argument('--latent_dim', type=int, default=32, help='Cluster subspace dimension')
+    parser.add_argument('--n_queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--num_results', type=int, default=10, help='Results per query')
+    parser.add_argument(
+        '--rerank', type=int, default=4, help='Re-ranking depth as a multiple of k'
+    )
+    parser.add_argument('--n_subvectors', type=int, default=None, help='PQ subvectors')
+    args = parser.parse_args()
+
+    main(
+        n_docs=args.n_docs,
+        dim=args.dim,
+        latent_dim=args.latent_dim,
+        n_queries=args.n_queries,
+        num_results=args.num_results,
+        rerank=args.rerank,
+        n_subvectors=args.n_subvectors,
+    )
@@ -0,0 +1,92 @@
+"""
+This module compares the TF-IDF and BM25 rankings of `minsearch.Index`
+on the ground-truth dataset. For each ranking it reports hit rate,
+MRR, the time of one `search_batch` over all questions and the mean
+per-query latency of `search`.
+
+Usage:
+    python benchmarks/minsearch_bm25.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils import minsearch
+from utils.evaluate import calculate_relevance_batch, hit_rate, mrr
+from utils.utils import id_documents, load_json_document
+
+
+def main(num_results=5, n_latency_queries=500, boost=None):
+    """
+    Run the benchmark and print one line per ranking.
+
+    Args:
+        num_results (int, optional): Number of results per query.
+        Default is 5.
+        n_latency_queries (int, optional): Number of questions used
+        to time single-query `search`. Default is 500.
+        boost (dict, optional): Dictionary of boost values.
+    """
+    documents = id_documents(
+        load_json_document(os.path.join(PROJECT_DIR, "data/1/documents.json"))
+    )
+    df_ground_truth = pd.read_csv(
+        os.path.join(PROJECT_DIR, "data/3/ground-truth-data.csv")
+    )
+    df_latency = df_ground_truth.sample(n=n_latency_queries, random_state=1)
+
+    print(f"Queries: {len(df_ground_truth)}, documents: {len(documents)}")
+    print(
+        f"{'ranking':<8}{'hit rate':>10}{'mrr':>8}"
+        f"{'batch (s)':>11}{'search (ms)':>13}"
+    )
+
+    for ranking in minsearch.RANKINGS:
+        index = minsearch.Index(
+            text_fields=["question", "text", "section"],
+            keyword_fields=["course"],
+            ranking=ranking,
+        ).fit(documents)
+
+        start_time = time.perf_counter()
+        relevance_total = calculate_relevance_batch(
+            df_ground_truth, index, boost=boost, num_results=num_results
+        )
+        batch_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for q in df_latency.to_dict(orient="records"):
+            index.search(
+                q["question"],
+                filter_dict={"course": q["course"]},
+                boost_dict=boost,
+                num_results=num_results,
+            )
+        search_ms = (time.perf_counter() - start_time) / len(df_latency) * 1000
+
+        print(
+            f"{ranking:<8}{hit_rate(relevance_total):>10.3f}{mrr(relevance_total):>8.3f}"
+            f"{batch_time:>11.3f}{search_ms:>13.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument('--num_results', type=int, default=5, help='Results per query')
+    parser.add_argument(
+        '--n_latency_queries', type=int, default=500, help='Queries timed one by one'
+    )
+    args = parser.parse_args()
+
+    main(
+        num_results=args.num_results,
+        n_latency_queries=args.n_latency_queries,
+        boost={"question": 3.0},
+    )
@@ -0,0 +1,120 @@
+"""
+This module benchmarks per-query latency of `minsearch.Index.search`
+with and without keyword filters. The "before" numbers come from a
+reference implementation of the previous scoring path, which scores
+the whole corpus and multiplies it by a pandas `==` mask per filter.
+
+Usage:
+    python benchmarks/minsearch_filters.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils import minsearch
+from utils.utils import id_documents, load_json_document
+
+
+def mask_search(index, keyword_df, query, filter_dict, boost_dict, num_results):
+    """
+    Search the index the way it was done before keyword postings:
+    full-corpus scoring followed by a pandas mask per filter.
+    """
+    scores = np.zeros(len(index.docs))
+
+    for field in index.text_fields:
+        query_vec = index.vectorizers[field].transform([query])
+        text_matrix = index.text_matrix[:, index.field_slices[field]]
+        sim = cosine_similarity(query_vec, text_matrix).flatten()
+        scores += sim * boost_dict.get(field, 1)
+
+    for field, value in filter_dict.items():
+        if field in index.keyword_fields:
+            mask = keyword_df[field] == value
+            scores = scores * mask.to_numpy()
+
+    top_indices = minsearch.top_k_indices(scores[np.newaxis, :], num_results)[0]
+
+    return [index.docs[i] for i in top_indices if scores[i] > 0]
+
+
+def time_per_query(search_fn, queries, filter_dicts):
+    """
+    Return the mean latency of `search_fn` in milliseconds.
+    """
+    start_time = time.perf_counter()
+    for query, filter_dict in zip(queries, filter_dicts):
+        search_fn(query, filter_dict)
+    return (time.perf_counter() - start_time) / len(queries) * 1000
+
+
+def main(n_queries=1000, num_results=5, boost=None):
+    """
+    Run the benchmark and print the timings.
+
+    Args:
+        n_queries (int, optional): Number of ground-truth questions
+        to time. Default is 1000.
+        num_results (int, optional): Number of results per query.
+        Default is 5.
+        boost (dict, optional): Dictionary of boost values.
+    """
+    if not boost:
+        boost = {}
+
+    documents = id_documents(
+        load_json_document(os.path.join(PROJECT_DIR, "data/1/documents.json"))
+    )
+    df_ground_truth = pd.read_csv(
+        os.path.join(PROJECT_DIR, "data/3/ground-truth-data.csv")
+    ).sample(n=n_queries, random_state=1)
+    queries = df_ground_truth["question"].tolist()
+
+    index = minsearch.Index(
+        text_fields=["question", "text", "section"],
+        keyword_fields=["course"],
+    ).fit(documents)
+    keyword_df = pd.DataFrame(
+        {field: [doc.get(field, "") for doc in documents] for field in index.keyword_fields}
+    )
+
+    def before(query, filter_dict):
+        return mask_search(index, keyword_df, query, filter_dict, boost, num_results)
+
+    def after(query, filter_dict):
+        return index.search(query, filter_dict, boost, num_results)
+
+    scenarios = {
+        "no filter": [{}] * len(queries),
+        "course filter": [{"course": course} for course in df_ground_truth["course"]],
+    }
+
+    print(f"Queries: {len(queries)}, documents: {len(documents)}")
+    print(f"{'scenario':<15}{'before (ms)':>13}{'after (ms)':>13}{'speedup':>10}")
+
+    for name, filter_dicts in scenarios.items():
+        for query, filter_dict in zip(queries, filter_dicts):
+            expected = [d["id"] for d in before(query, filter_dict)]
+            assert expected == [d["id"] for d in after(query, filter_dict)], query
+
+        before_ms = time_per_query(before, queries, filter_dicts)
+        after_ms = time_per_query(after, queries, filter_dicts)
+        print(f"{name:<15}{before_ms:>13.3f}{after_ms:>13.3f}{before_ms / after_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument('--n_queries', type=int, default=1000, help='Number of queries')
+    parser.add_argument('--num_results', type=int, default=5, help='Results per query')
+    args = parser.parse_args()
+
+    main(n_queries=args.n_queries, num_results=args.num_results, boost={"question": 3.0})
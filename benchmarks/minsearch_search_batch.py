@@ -0,0 +1,80 @@
+"""
+This module benchmarks `minsearch.Index.search_batch` against
+calling `minsearch.Index.search` once per question on the
+ground-truth dataset. It checks that both return the same
+ranked documents and reports the wall-clock time of each.
+
+Usage:
+    python benchmarks/minsearch_search_batch.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.append(PROJECT_DIR)
+
+from utils import minsearch
+from utils.utils import id_documents, load_json_document
+
+
+def main(num_results=5, boost=None):
+    """
+    Run the benchmark and print the timings.
+
+    Args:
+        num_results (int, optional): Number of results per query.
+        Default is 5.
+        boost (dict, optional): Dictionary of boost values.
+    """
+    documents = id_documents(
+        load_json_document(os.path.join(PROJECT_DIR, "data/1/documents.json"))
+    )
+    df_ground_truth = pd.read_csv(
+        os.path.join(PROJECT_DIR, "data/3/ground-truth-data.csv")
+    )
+    queries = df_ground_truth["question"].tolist()
+    filter_dicts = [{"course": course} for course in df_ground_truth["course"]]
+
+    index = minsearch.Index(
+        text_fields=["question", "text", "section"],
+        keyword_fields=["course"],
+    ).fit(documents)
+
+    start_time = time.perf_counter()
+    single_results = [
+        index.search(
+            query, filter_dict=filter_dict, boost_dict=boost, num_results=num_results
+        )
+        for query, filter_dict in zip(queries, filter_dicts)
+    ]
+    single_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch_results = index.search_batch(
+        queries, filter_dicts=filter_dicts, boost_dict=boost, num_results=num_results
+    )
+    batch_time = time.perf_counter() - start_time
+
+    n_mismatches = sum(
+        [d["id"] for d in single] != [d["id"] for d in batch]
+        for single, batch in zip(single_results, batch_results)
+    )
+
+    print(f"Queries: {len(queries)}, documents: {len(documents)}")
+    print(f"search       : {single_time:.3f} s")
+    print(f"search_batch : {batch_time:.3f} s")
+    print(f"Speedup      : {single_time / batch_time:.1f}x")
+    print(f"Mismatched rankings: {n_mismatches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reading control parameters.")
+    parser.add_argument('--num_results', type=int, default=5, help='Results per query')
+    args = parser.parse_args()
+
+    main(num_results=args.num_results, boost={"question": 3.0})
@@ -0,0 +1,39 @@
+"""
+A Streamlit session keeps one conversation id for all of its questions,
+so judge results must be written to the row of their question only.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "app"))
+
+from utils.judge_queue import JudgeQueue  # noqa: E402
+
+
+def test_two_questions_in_one_session_are_judged_separately():
+    conversation_id = "session-1"
+    first_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    second_time = first_time + timedelta(seconds=30)
+    written = []
+
+    async def evaluate(question, answer):
+        relevance = "RELEVANT" if question == "first" else "NON_RELEVANT"
+        return relevance, f"Judged {question}", None
+
+    async def run():
+        judge_queue = JudgeQueue(evaluate, written.extend, batch_timeout=0.01)
+        judge_queue.submit(conversation_id, first_time, "first", "answer")
+        judge_queue.submit(conversation_id, second_time, "second", "answer")
+        await judge_queue.join()
+        await judge_queue.close()
+
+    asyncio.run(run())
+
+    assert sorted(written) == [
+        (conversation_id, first_time, "RELEVANT", "Judged first", None),
+        (conversation_id, second_time, "NON_RELEVANT", "Judged second", None),
+    ]
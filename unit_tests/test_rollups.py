@@ -0,0 +1,33 @@
+"""
+The rollup refresher runs in a daemon thread for the life of the app, so
+a failed refresh must be counted and retried, never end the thread.
+"""
+
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "app"))
+
+from utils import rollups  # noqa: E402
+
+
+def test_refresher_survives_database_errors(monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(rollups, "pooled_connection", unreachable)
+    monkeypatch.setattr(rollups, "maintain_partitions", unreachable)
+
+    refresher = rollups.RollupRefresher(interval=0.01)
+    try:
+        deadline = time.monotonic() + 5
+        while refresher.stats["failed"] < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert refresher._thread.is_alive()
+        assert refresher.stats["failed"] >= 4
+        assert refresher.stats["refreshes"] == 0
+    finally:
+        refresher.close()
@@ -0,0 +1,22 @@
+"""
+The modules shared by the project and the app are copied in utils/ and
+app/utils/, as the app image only ships app/. The copies must not drift.
+"""
+
+import filecmp
+import os
+
+import pytest
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+
+SHARED_MODULES = ["embedding_cache.py", "fusion.py"]
+
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_shared_module_copies_are_identical(module):
+    assert filecmp.cmp(
+        os.path.join(PROJECT_DIR, "utils", module),
+        os.path.join(PROJECT_DIR, "app", "utils", module),
+        shallow=False,
+    ), f"utils/{module} and app/utils/{module} differ"
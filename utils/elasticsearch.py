@@ -1,13 +1,15 @@
 """
 This module provides utility functions for interacting with Elasticsearch.
 It includes functions to create an Elasticsearch client, manage indices, 
-search, and index documents.
+search, and index documents, including a streaming bulk indexer.
 Custom exceptions are also handled for connection and query errors.
 """
 
 import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from elasticsearch import Elasticsearch
+from elasticsearch import ApiError, Elasticsearch
 from elasticsearch.exceptions import (NotFoundError,
                                       RequestError)
 from tqdm.auto import tqdm
@@ -114,7 +116,7 @@ def load_index_settings(index_settings_path):
     return index_settings
 
 
-def index_documents(es_client, index_name, documents, timeout=60):
+def index_documents(es_client, index_name, documents, timeout=60, **bulk_params):
     """
     Index multiple documents into an Elasticsearch index.
 
@@ -123,25 +125,285 @@ def index_documents(es_client, index_name, documents, timeout=60):
         index_name (str): The name of the index.
         documents (list): A list of documents to index.
         timeout (int): The timeout for indexing requests in seconds. Default is 60.
-    """
-    n_skipped = 0
-    n_documents = len(documents)
-    idx = 0
+        **bulk_params: Further arguments of `bulk_index_documents`,
+            e.g. chunk_size, max_chunk_bytes or max_in_flight.
 
-    for doc in tqdm(documents):
-        try:
-            es_client.index(index=index_name, document=doc, timeout=f"{timeout}s")
-        except RequestError as e:
-            print(f"{e}", "index:", idx, "-> Skipped...")
-            n_skipped += 1
+    Returns:
+        dict: The summary returned by `bulk_index_documents`.
+    """
+    summary = bulk_index_documents(
+        es_client, index_name, documents, timeout=timeout, **bulk_params
+    )
 
-        idx += 1
+    for error in summary["errors"]:
+        print(
+            f"{error['type']}: {error['reason']}", "index:", error["position"], "-> Skipped..."
+        )
 
-    n_parsed = n_documents - n_skipped
     print(
-        f"Successfully indexed {n_parsed}/{n_documents} documents in index {index_name}"
+        f"Successfully indexed {summary['indexed']}/{len(documents)} documents in index {index_name}"
     )
 
+    return summary
+
+
+def bulk_actions(documents, index_name, id_field=None):
+    """
+    Serialize documents into bulk `index` actions.
+
+    Every action is serialized once, so its size is known when
+    chunking and the bytes are sent as they are.
+
+    Args:
+        documents (iterable): The documents to index.
+        index_name (str): The name of the index.
+        id_field (str, optional): Document field used as the `_id`.
+        Elasticsearch generates ids if not given.
+
+    Yields:
+        tuple: (position, document id, action line, source line).
+    """
+    for position, document in enumerate(documents):
+        action = {"_index": index_name}
+        if id_field:
+            action["_id"] = document[id_field]
+
+        yield (
+            position,
+            action.get("_id"),
+            json.dumps({"index": action}).encode("utf-8"),
+            json.dumps(document).encode("utf-8"),
+        )
+
+
+def chunk_bulk_actions(actions, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024):
+    """
+    Group serialized actions into chunks bounded by count and size.
+
+    Args:
+        actions (iterable): Actions as yielded by `bulk_actions`.
+        chunk_size (int): Maximum number of documents per chunk.
+        max_chunk_bytes (int): Maximum request body size in bytes. A
+        single larger document is still sent, alone.
+
+    Yields:
+        list: Chunks of actions.
+    """
+    chunk = []
+    chunk_bytes = 0
+
+    for action in actions:
+        # action line + source line, each followed by a newline
+        action_bytes = len(action[2]) + len(action[3]) + 2
+
+        if chunk and (
+            len(chunk) >= chunk_size or chunk_bytes + action_bytes > max_chunk_bytes
+        ):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append(action)
+        chunk_bytes += action_bytes
+
+    if chunk:
+        yield chunk
+
+
+def send_bulk_chunk(
+    es_client,
+    chunk,
+    max_retries=3,
+    initial_backoff=1,
+    max_backoff=60,
+    timeout=60,
+):
+    """
+    Send one chunk with the bulk API, retrying rejected items.
+
+    Items rejected with HTTP 429 (a full write queue), or the whole
+    request if it is rejected, are resent with exponential backoff.
+    Items that fail for any other reason are not retried.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        chunk (list): Actions as yielded by `chunk_bulk_actions`.
+        max_retries (int): Maximum number of retries. Default is 3.
+        initial_backoff (float): Seconds to wait before the first
+        retry, doubled for every further one. Default is 1.
+        max_backoff (float): Maximum seconds to wait. Default is 60.
+        timeout (int): The timeout for the bulk request in seconds.
+        Default is 60.
+
+    Returns:
+        tuple: (number of indexed documents, list of item errors,
+        number of retried items).
+    """
+    n_indexed = 0
+    n_retried = 0
+    errors = []
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(min(max_backoff, initial_backoff * 2 ** (attempt - 1)))
+            n_retried += len(chunk)
+
+        try:
+            response = es_client.bulk(
+                operations=[line for action in chunk for line in action[2:]],
+                refresh=False,
+                timeout=f"{timeout}s",
+            )
+        except ApiError as e:
+            if e.meta.status != 429 or attempt == max_retries:
+                raise
+            continue
+
+        rejected = []
+        for action, item in zip(chunk, response["items"]):
+            result = item["index"]
+
+            if result["status"] < 300:
+                n_indexed += 1
+            elif result["status"] == 429 and attempt < max_retries:
+                rejected.append(action)
+            else:
+                errors.append(
+                    {
+                        "position": action[0],
+                        "id": action[1] if action[1] is not None else result.get("_id"),
+                        "status": result["status"],
+                        "type": result.get("error", {}).get("type"),
+                        "reason": result.get("error", {}).get("reason"),
+                    }
+                )
+
+        chunk = rejected
+        if not chunk:
+            break
+
+    return n_indexed, errors, n_retried
+
+
+def bulk_index_documents(
+    es_client,
+    index_name,
+    documents,
+    chunk_size=500,
+    max_chunk_bytes=10 * 1024 * 1024,
+    max_in_flight=4,
+    max_retries=3,
+    initial_backoff=1,
+    max_backoff=60,
+    id_field=None,
+    disable_refresh=True,
+    timeout=60,
+):
+    """
+    Index documents with the bulk API, streaming them in chunks.
+
+    Documents are consumed lazily and grouped into chunks bounded
+    by `chunk_size` documents and `max_chunk_bytes` bytes. Up to
+    `max_in_flight` bulk requests run concurrently. Rejected items
+    are retried with exponential backoff (see `send_bulk_chunk`).
+    Refresh is disabled on the index during the load, then the
+    previous refresh interval is restored and the index refreshed.
+
+    Args:
+        es_client (Elasticsearch): The Elasticsearch client instance.
+        index_name (str): The name of the index.
+        documents (iterable): The documents to index.
+        chunk_size (int): Maximum number of documents per request.
+        Default is 500.
+        max_chunk_bytes (int): Maximum request body size in bytes.
+        Default is 10 MiB.
+        max_in_flight (int): Maximum number of concurrent requests.
+        Default is 4.
+        max_retries (int): Maximum number of retries of rejected
+        items. Default is 3.
+        initial_backoff (float): Seconds to wait before the first
+        retry. Default is 1.
+        max_backoff (float): Maximum seconds to wait. Default is 60.
+        id_field (str, optional): Document field used as the `_id`.
+        disable_refresh (bool): Disable refresh during the load.
+        Default is True.
+        timeout (int): The timeout for bulk requests in seconds.
+        Default is 60.
+
+    Returns:
+        dict: Summary with keys 'indexed', 'failed', 'retried',
+        'seconds' and 'errors', a list of dicts with keys 'position',
+        'id', 'status', 'type' and 'reason', one per failed document.
+    """
+    summary = {"indexed": 0, "failed": 0, "retried": 0, "seconds": 0.0, "errors": []}
+    start_time = time.perf_counter()
+
+    refresh_intervals = {}
+    if disable_refresh:
+        # Keyed by concrete index, also when index_name is an alias
+        settings = es_client.indices.get_settings(
+            index=index_name, name="index.refresh_interval"
+        )
+        refresh_intervals = {
+            name: index_settings.get("settings", {}).get("index", {}).get("refresh_interval")
+            for name, index_settings in settings.items()
+        }
+        es_client.indices.put_settings(
+            index=index_name, settings={"index": {"refresh_interval": "-1"}}
+        )
+
+    def collect(future):
+        n_indexed, errors, n_retried = future.result()
+        summary["indexed"] += n_indexed
+        summary["failed"] += len(errors)
+        summary["retried"] += n_retried
+        summary["errors"].extend(errors)
+        progress.update(n_indexed + len(errors))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool, tqdm(
+            total=len(documents) if hasattr(documents, "__len__") else None
+        ) as progress:
+            in_flight = set()
+
+            for chunk in chunk_bulk_actions(
+                bulk_actions(documents, index_name, id_field),
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+            ):
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+
+                in_flight.add(
+                    pool.submit(
+                        send_bulk_chunk,
+                        es_client,
+                        chunk,
+                        max_retries=max_retries,
+                        initial_backoff=initial_backoff,
+                        max_backoff=max_backoff,
+                        timeout=timeout,
+                    )
+                )
+
+            for future in wait(in_flight).done:
+                collect(future)
+
+    finally:
+        if disable_refresh:
+            # None resets the setting to the index default
+            for name, refresh_interval in refresh_intervals.items():
+                es_client.indices.put_settings(
+                    index=name, settings={"index": {"refresh_interval": refresh_interval}}
+                )
+            es_client.indices.refresh(index=index_name)
+
+    summary["seconds"] = time.perf_counter() - start_time
+
+    return summary
+
 
 def get_index_mapping(es_client, index_name):
     """
@@ -0,0 +1,428 @@
+"""
+This module provides a compact in-memory store for dense embeddings.
+
+Embeddings are kept as one matrix in one of four encodings:
+    1. float32: the reference, 4 bytes per dimension
+    2. float16: half precision, 2 bytes per dimension
+    3. int8: scalar quantization with a per-dimension offset and scale,
+       1 byte per dimension
+    4. pq: product quantization, 1 byte per subvector
+
+Queries are never quantized (asymmetric distance computation): scores
+are inner products between the float32 query and the decoded vectors,
+computed directly from the codes. The top candidates can then be
+re-ranked with full-precision vectors, which may live on disk.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from utils.minsearch import top_k_indices
+
+QUANTIZATIONS = ["float32", "float16", "int8", "pq"]
+
+
+class EmbeddingStore:
+    """
+    A store of dense embeddings scored by inner product.
+
+    Row i of the store is the i-th vector passed to `fit`, so rows line
+    up with the documents the embeddings were computed from.
+
+    Attributes:
+        quantization (str): One of "float32", "float16", "int8" or "pq".
+        codes (np.ndarray): Encoded vectors, one row per vector.
+        offset (np.ndarray): Per-dimension minimum, for "int8".
+        scale (np.ndarray): Per-dimension step, for "int8".
+        codebooks (np.ndarray): Float32 array of shape
+            (n_subvectors, n_centroids, subvector_dim), for "pq".
+        full_vectors (np.ndarray): Float32 vectors used for re-ranking,
+            or None when `keep_full_precision` is False.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        quantization="int8",
+        n_subvectors=None,
+        n_centroids=256,
+        keep_full_precision=True,
+        n_iter=10,
+        max_train=65536,
+        seed=0,
+    ):
+        """
+        Initializes the EmbeddingStore.
+
+        Args:
+            quantization (str): One of "float32", "float16", "int8" or
+                "pq". Defaults to "int8".
+            n_subvectors (int): Number of PQ subvectors, must divide the
+                dimension. Defaults to dim / 8.
+            n_centroids (int): Number of PQ centroids per subvector, at
+                most 256. Defaults to 256.
+            keep_full_precision (bool): Keep float32 vectors to re-rank
+                candidates with. Defaults to True.
+            n_iter (int): Number of PQ k-means iterations. Defaults to 10.
+            max_train (int): PQ codebooks are trained on at most this many
+                sampled vectors. Defaults to 65536.
+            seed (int): Random seed of the PQ training.
+        """
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"`quantization` must be one of {QUANTIZATIONS}, but got '{quantization}'"
+            )
+        if not 0 < n_centroids <= 256:
+            raise ValueError(f"`n_centroids` must be in [1, 256], but got {n_centroids}")
+
+        self.quantization = quantization
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.keep_full_precision = keep_full_precision
+        self.n_iter = n_iter
+        self.max_train = max_train
+        self.seed = seed
+
+        self.codes = None
+        self.offset = None
+        self.scale = None
+        self.codebooks = None
+        self.full_vectors = None
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the codes and quantizer parameters, without
+        the full-precision vectors.
+        """
+        arrays = [self.codes, self.offset, self.scale, self.codebooks]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def fit(self, vectors):
+        """
+        Trains the quantizer on the vectors and encodes them.
+
+        Args:
+            vectors (array-like): Embeddings of shape (n_vectors, dim).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError(f"Expected a 2-D array of vectors, but got {vectors.shape}")
+
+        if self.quantization == "int8":
+            self.offset = vectors.min(axis=0)
+            self.scale = (vectors.max(axis=0) - self.offset) / 255
+            self.scale[self.scale == 0] = 1.0
+
+        elif self.quantization == "pq":
+            dim = vectors.shape[1]
+            if not self.n_subvectors:
+                self.n_subvectors = max(dim // 8, 1)
+            if dim % self.n_subvectors:
+                raise ValueError(
+                    f"`n_subvectors`={self.n_subvectors} must divide the dimension {dim}"
+                )
+            self.codebooks = train_codebooks(
+                vectors,
+                self.n_subvectors,
+                min(self.n_centroids, len(vectors)),
+                n_iter=self.n_iter,
+                max_train=self.max_train,
+                rng=np.random.default_rng(self.seed),
+            )
+
+        self.codes = self.encode(vectors)
+        self.full_vectors = vectors if self.keep_full_precision else None
+
+        return self
+
+    def encode(self, vectors):
+        """
+        Encodes vectors with the trained quantizer.
+
+        Args:
+            vectors (np.ndarray): Float32 array of shape (n_vectors, dim).
+
+        Returns:
+            np.ndarray: The codes, one row per vector.
+        """
+        if self.quantization == "float32":
+            return vectors.copy()
+
+        if self.quantization == "float16":
+            return vectors.astype(np.float16)
+
+        if self.quantization == "int8":
+            codes = np.rint((vectors - self.offset) / self.scale)
+            return np.clip(codes, 0, 255).astype(np.uint8)
+
+        return pq_encode(vectors, self.codebooks)
+
+    def decode(self, rows=None):
+        """
+        Reconstructs float32 vectors from the codes.
+
+        Args:
+            rows (np.ndarray or slice): Optional rows to decode. All rows
+                if not given.
+
+        Returns:
+            np.ndarray: Float32 array of shape (n_rows, dim).
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+
+        if self.quantization in ["float32", "float16"]:
+            return codes.astype(np.float32)
+
+        if self.quantization == "int8":
+            return codes * self.scale + self.offset
+
+        n_subvectors = self.codebooks.shape[0]
+        return self.codebooks[np.arange(n_subvectors), codes].reshape(len(codes), -1)
+
+    def score(self, query_vectors, rows=None, chunk_size=16384):
+        """
+        Computes approximate inner products of queries and stored vectors.
+
+        Args:
+            query_vectors (array-like): Float32 queries of shape (n_queries, dim).
+            rows (np.ndarray or slice): Optional rows to score. All rows
+                if not given.
+            chunk_size (int): Number of vectors decoded at once, bounding
+                the temporary memory.
+
+        Returns:
+            np.ndarray: Scores of shape (n_queries, n_rows).
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        codes = self.codes if rows is None else self.codes[rows]
+
+        if self.quantization == "float32":
+            return query_vectors @ codes.T
+
+        scores = np.empty((len(query_vectors), len(codes)), dtype=np.float32)
+
+        if self.quantization == "pq":
+            # Lookup table of every query subvector against every centroid
+            n_subvectors, n_centroids, subvector_dim = self.codebooks.shape
+            tables = np.einsum(
+                "qmd,mcd->qmc",
+                query_vectors.reshape(len(query_vectors), n_subvectors, subvector_dim),
+                self.codebooks,
+            ).reshape(len(query_vectors), -1)
+            code_offsets = np.arange(n_subvectors) * n_centroids
+
+            for start in range(0, len(codes), chunk_size):
+                flat_codes = codes[start : start + chunk_size] + code_offsets
+                for i, table in enumerate(tables):
+                    scores[i, start : start + chunk_size] = table[flat_codes].sum(axis=1)
+
+            return scores
+
+        if self.quantization == "int8":
+            # q . (offset + scale * code) = q . offset + (q * scale) . code
+            bias = query_vectors @ self.offset
+            query_vectors = query_vectors * self.scale
+        else:
+            bias = 0.0
+
+        for start in range(0, len(codes), chunk_size):
+            chunk = codes[start : start + chunk_size].astype(np.float32)
+            scores[:, start : start + chunk_size] = query_vectors @ chunk.T
+
+        return scores + np.asarray(bias)[..., np.newaxis]
+
+    def search(self, query_vectors, num_results=10, rows=None, rerank=4):
+        """
+        Returns the rows with the highest inner product for every query.
+
+        Candidates are ranked on the codes; the best
+        `num_results * rerank` of them are then re-scored with the
+        full-precision vectors, if the store keeps them.
+
+        Args:
+            query_vectors (array-like): Float32 queries of shape (n_queries, dim).
+            num_results (int): The number of rows to return per query.
+                Defaults to 10.
+            rows (np.ndarray): Optional candidate rows. All rows if not given.
+            rerank (int): Re-ranking depth as a multiple of `num_results`.
+                0 disables re-ranking. Defaults to 4.
+
+        Returns:
+            tuple: (indices, scores), arrays of shape
+            (n_queries, min(num_results, n_rows)), best first.
+        """
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if rows is not None:
+            rows = np.asarray(rows)
+
+        scores = self.score(query_vectors, rows)
+        do_rerank = (
+            rerank and self.full_vectors is not None and self.quantization != "float32"
+        )
+        n_candidates = num_results * rerank if do_rerank else num_results
+        top_indices = top_k_indices(scores, n_candidates)
+        top_scores = np.take_along_axis(scores, top_indices, axis=1)
+
+        if rows is not None:
+            top_indices = rows[top_indices]
+
+        if not do_rerank:
+            return top_indices, top_scores
+
+        exact_scores = np.einsum(
+            "qd,qkd->qk", query_vectors, self.full_vectors[top_indices]
+        )
+        order = top_k_indices(exact_scores, num_results)
+
+        return (
+            np.take_along_axis(top_indices, order, axis=1),
+            np.take_along_axis(exact_scores, order, axis=1),
+        )
+
+    def save(self, path):
+        """
+        Saves the store to a directory as `.npy` files plus `meta.json`,
+        so that `load` can memory-map them.
+
+        Args:
+            path (str): Directory to write the store to. Created if missing.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        meta = {
+            "format_version": self.FORMAT_VERSION,
+            "quantization": self.quantization,
+            "n_subvectors": self.n_subvectors,
+            "n_centroids": self.n_centroids,
+            "keep_full_precision": self.full_vectors is not None,
+        }
+        arrays = {
+            "codes": self.codes,
+            "offset": self.offset,
+            "scale": self.scale,
+            "codebooks": self.codebooks,
+            "full_vectors": self.full_vectors,
+        }
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(path, "meta.json"), "wt", encoding="utf-8") as f_out:
+            json.dump(meta, f_out)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a store previously written with `save`.
+
+        With `mmap`, the full-precision vectors stay on disk and only the
+        rows being re-ranked are read.
+
+        Args:
+            path (str): Directory the store was saved to.
+            mmap (bool): Memory-map the arrays read-only. Defaults to True.
+
+        Returns:
+            EmbeddingStore: The loaded store.
+        """
+        with open(os.path.join(path, "meta.json"), "rt", encoding="utf-8") as f_in:
+            meta = json.load(f_in)
+
+        if meta["format_version"] != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported store format version {meta['format_version']}, "
+                f"expected {cls.FORMAT_VERSION}"
+            )
+
+        store = cls(
+            quantization=meta["quantization"],
+            n_subvectors=meta["n_subvectors"],
+            n_centroids=meta["n_centroids"],
+            keep_full_precision=meta["keep_full_precision"],
+        )
+
+        mmap_mode = "r" if mmap else None
+        for name in ["codes", "offset", "scale", "codebooks", "full_vectors"]:
+            file_path = os.path.join(path, f"{name}.npy")
+            if os.path.exists(file_path):
+                setattr(store, name, np.load(file_path, mmap_mode=mmap_mode))
+
+        return store
+
+
+def train_codebooks(vectors, n_subvectors, n_centroids, n_iter=10, max_train=None, rng=None):
+    """
+    Trains one k-means codebook per subvector for product quantization.
+
+    Args:
+        vectors (np.ndarray): Float32 array of shape (n, dim).
+        n_subvectors (int): Number of subvectors, must divide dim.
+        n_centroids (int): Number of centroids per codebook, at most n.
+        n_iter (int): Number of Lloyd iterations. Defaults to 10.
+        max_train (int): Optional maximum number of sampled training vectors.
+        rng (np.random.Generator): Optional random generator.
+
+    Returns:
+        np.ndarray: Float32 array of shape (n_subvectors, n_centroids, dim / n_subvectors).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if max_train and len(vectors) > max_train:
+        vectors = vectors[rng.choice(len(vectors), max_train, replace=False)]
+
+    subvectors = vectors.reshape(len(vectors), n_subvectors, -1).transpose(1, 0, 2)
+    codebooks = subvectors[:, rng.choice(len(vectors), n_centroids, replace=False)].copy()
+
+    for _ in range(n_iter):
+        for m, (points, centroids) in enumerate(zip(subvectors, codebooks)):
+            assignments = nearest_centroids(points, centroids)
+            counts = np.bincount(assignments, minlength=n_centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, points)
+
+            # Empty clusters keep their previous centroid
+            non_empty = counts > 0
+            codebooks[m, non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+
+    return codebooks
+
+
+def pq_encode(vectors, codebooks, chunk_size=65536):
+    """
+    Encodes vectors as the ids of their nearest centroid in every codebook.
+
+    Args:
+        vectors (np.ndarray): Float32 array of shape (n, dim).
+        codebooks (np.ndarray): Array of shape (n_subvectors, n_centroids, subvector_dim).
+        chunk_size (int): Number of vectors encoded at once.
+
+    Returns:
+        np.ndarray: Uint8 array of shape (n, n_subvectors).
+    """
+    n_subvectors = codebooks.shape[0]
+    codes = np.empty((len(vectors), n_subvectors), dtype=np.uint8)
+
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start : start + chunk_size].reshape(-1, n_subvectors, codebooks.shape[2])
+        for m in range(n_subvectors):
+            codes[start : start + chunk_size, m] = nearest_centroids(chunk[:, m], codebooks[m])
+
+    return codes
+
+
+def nearest_centroids(points, centroids):
+    """
+    Returns the id of the closest centroid (Euclidean) of every point.
+    """
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, and |p|^2 does not change the argmin
+    distances = (centroids**2).sum(axis=1) - 2 * points @ centroids.T
+    return np.argmin(distances, axis=1)
+
@@ -13,7 +13,8 @@ from exceptions.exceptions import (QueryTypeWrongValueError,
 from utils.ollama import get_embedding
 
 from utils.query import (build_prompt,
-                         llm)
+                         llm_batch,
+                         search_batch)
 
 from utils.utils import parse_json_response
 
@@ -83,7 +84,7 @@ def calculate_relevance(
         doc_id = q["document"]
         filter_dict = {"course": q["course"]}
 
-        if search_context == "elasticsearch" and query_type == "vector":
+        if query_type == "vector":
             query_vector = get_embedding(
                 client=client, text=q["question"], model_name=model_name
             )
@@ -107,6 +108,49 @@ def calculate_relevance(
     return relevance_total
 
 
+def calculate_relevance_batch(
+    df_ground_truth,
+    index,
+    boost=None,
+    num_results=5,
+):
+    """
+    Calculate the relevance of MinSearch results against ground
+    truth data, scoring all questions in one batch.
+
+    Args:
+        df_ground_truth (pandas.DataFrame): DataFrame containing
+        ground truth data with columns 'question', 'document'
+        and 'course'.
+
+        index (minsearch.Index): Fitted MinSearch index.
+
+        boost (dict, optional): Dictionary of boost values for
+        specific fields.
+
+        num_results (int, optional): Number of search results to
+        return. Default is 5.
+
+    Returns:
+        list: A list of lists where each inner list contains boolean
+        values indicating relevance of search results.
+    """
+    records = df_ground_truth.to_dict(orient="records")
+
+    results_total = search_batch(
+        queries=[q["question"] for q in records],
+        index=index,
+        filter_dicts=[{"course": q["course"]} for q in records],
+        boost=boost,
+        num_results=num_results,
+    )
+
+    return [
+        [d["id"] == q["document"] for d in results]
+        for q, results in zip(records, results_total)
+    ]
+
+
 def hit_rate(relevance_total):
     """
     Calculate the hit rate from relevance results.
@@ -158,18 +202,14 @@ def llm_as_a_judge(
     prompt_template_path,
     df_to_judge,
     model_name="gpt-3.5-turbo",
+    max_workers=1,
 ):
-    results = []
-    
-    for record in tqdm(df_to_judge.to_dict(orient='records')):
-        prompt = build_prompt(
-            prompt_template_path,
-            **record,
-        )
-        
-        response = llm(client, prompt, model_name)
-        response = parse_json_response(response)
-        
-        results.append(response)
-        
-    return results
+    prompts = [
+        build_prompt(prompt_template_path, **record)
+        for record in df_to_judge.to_dict(orient='records')
+    ]
+
+    # Local models judge in padded batches, API models with max_workers threads
+    responses = llm_batch(client, prompts, model_name, max_workers=max_workers)
+
+    return [parse_json_response(response) for response in responses]
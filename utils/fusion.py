@@ -0,0 +1,58 @@
+"""
+This module provides functions to fuse the ranked results of
+several retrievers (e.g. text and vector search) into one
+ranking, using reciprocal rank fusion (RRF).
+
+This module is duplicated in utils/ and app/utils/, as the app image
+only ships app/. Keep both copies identical;
+unit_tests/test_shared_modules.py checks it.
+"""
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(result_lists, weights=None, k=60, num_results=5, id_field="id"):
+    """
+    Fuse ranked result lists with (weighted) reciprocal rank fusion.
+
+    Every document scores sum(weight / (k + rank)) over the lists
+    it appears in, with ranks starting at 1. The scores of all
+    lists are accumulated in one vectorized pass.
+
+    Args:
+        result_lists (list): A list of ranked lists of documents.
+        weights (list, optional): One weight per result list.
+        Default is 1 for every list.
+        k (int, optional): Rank smoothing constant. Default is 60.
+        num_results (int, optional): Number of fused results to
+        return. Default is 5.
+        id_field (str, optional): Document field identifying the
+        same document across lists. Default is 'id'.
+
+    Returns:
+        list: The fused list of documents, best first. Ties keep
+        the order in which documents were first seen.
+    """
+    if weights is None:
+        weights = [1.0] * len(result_lists)
+
+    if len(weights) != len(result_lists):
+        raise ValueError(
+            f"Expected {len(result_lists)} weights, but got {len(weights)}"
+        )
+
+    docs = [doc for results in result_lists for doc in results]
+    if not docs:
+        return []
+
+    lengths = [len(results) for results in result_lists]
+    ranks = np.concatenate([np.arange(1, length + 1) for length in lengths])
+    list_weights = np.repeat(np.asarray(weights, dtype=np.float64), lengths)
+
+    ids = np.array([doc[id_field] for doc in docs], dtype=object)
+    _, first_seen, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=list_weights / (k + ranks))
+
+    order = np.lexsort((first_seen, -scores))[:num_results]
+
+    return [docs[first_seen[i]] for i in order]
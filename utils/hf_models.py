@@ -0,0 +1,255 @@
+"""
+This module provides a registry of local HuggingFace seq2seq models,
+such as google/flan-t5-small, for `utils.query.llm`.
+
+Each model is loaded once per process and kept in memory:
+    1. The device is picked automatically: CUDA if available, else CPU
+    2. bf16 weights and torch.compile are opt-in, through the arguments
+       of `get_local_model` or $LOCAL_MODEL_DTYPE and $LOCAL_MODEL_COMPILE
+    3. Prompts submitted concurrently, e.g. from several threads, are
+       collected for up to `max_wait` seconds into one padded
+       `generate` call
+    4. Lists of prompts are generated in padded batches of similar
+       lengths
+
+torch and transformers are only imported once a local model is used,
+so that `utils.query` works without them on hosts using API models.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+LOCAL_MODELS = ["google/flan-t5-small"]
+
+DEFAULT_GENERATE_PARAMS = {
+    "max_length": 100,
+    "num_beams": 5,
+    "do_sample": False,
+    "temperature": 1.0,
+    "top_k": 50,
+    "top_p": 0.95,
+}
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def pick_device():
+    """
+    Return the device to run local models on: $LOCAL_MODEL_DEVICE if
+    set, else CUDA if available, else CPU.
+
+    Returns:
+        str: The device name.
+    """
+    import torch
+
+    if os.getenv("LOCAL_MODEL_DEVICE"):
+        return os.getenv("LOCAL_MODEL_DEVICE")
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def generation_kwargs(generate_params=None):
+    """
+    Return the `generate` arguments: the defaults updated with
+    `generate_params`. Sampling parameters are only passed when
+    sampling.
+
+    Args:
+        generate_params (dict, optional): Parameters overriding
+        DEFAULT_GENERATE_PARAMS.
+
+    Returns:
+        dict: The keyword arguments of `generate`.
+    """
+    kwargs = {**DEFAULT_GENERATE_PARAMS, **(generate_params or {})}
+    if not kwargs["do_sample"]:
+        for name in ["temperature", "top_k", "top_p"]:
+            kwargs.pop(name)
+    return kwargs
+
+
+class LocalModel:
+    """
+    A local seq2seq model with its tokenizer, loaded once.
+
+    Attributes:
+        model_name (str): The HuggingFace model name.
+        device (str): The device the model runs on.
+        dtype (torch.dtype): The dtype of the weights.
+        max_batch_size (int): Maximum prompts per `generate` call.
+        max_wait (float): Seconds `submit` waits for more prompts to
+            batch with.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        device=None,
+        dtype=None,
+        compile_model=False,
+        max_batch_size=16,
+        max_wait=0.01,
+    ):
+        """
+        Initializes the LocalModel and loads the model.
+
+        Args:
+            model_name (str): The HuggingFace model name.
+            device (str, optional): The device. Defaults to `pick_device()`.
+            dtype (str, optional): 'float32', 'bfloat16' or 'float16'.
+                Defaults to float32.
+            compile_model (bool): Whether to compile the forward pass
+                with torch.compile. Defaults to False.
+            max_batch_size (int): Maximum prompts per `generate` call.
+                Defaults to 16.
+            max_wait (float): Seconds `submit` waits for more prompts.
+                Defaults to 0.01.
+        """
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+        self.model_name = model_name
+        self.device = device or pick_device()
+        self.dtype = getattr(torch, dtype or "float32")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, torch_dtype=self.dtype)
+        self.model.to(self.device).eval()
+
+        if compile_model:
+            # generate() is not compilable as a whole, its forward passes are
+            self.model.forward = torch.compile(self.model.forward, dynamic=True)
+
+        self._generate_lock = threading.Lock()
+        self._requests = Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def generate(self, prompts, generate_params=None):
+        """
+        Generate the responses of many prompts, in padded batches of
+        prompts of similar lengths.
+
+        Args:
+            prompts (list): The prompts.
+            generate_params (dict, optional): See `generation_kwargs`.
+
+        Returns:
+            list: The responses, in the order of `prompts`.
+        """
+        order = sorted(range(len(prompts)), key=lambda position: len(prompts[position]))
+        responses = [None] * len(prompts)
+
+        for start in range(0, len(order), self.max_batch_size):
+            positions = order[start : start + self.max_batch_size]
+            outputs = self._generate_batch(
+                [prompts[position] for position in positions], generate_params
+            )
+            for position, output in zip(positions, outputs):
+                responses[position] = output
+
+        return responses
+
+    def submit(self, prompt, generate_params=None):
+        """
+        Queue one prompt, to be generated together with the prompts
+        submitted concurrently with the same parameters.
+
+        Args:
+            prompt (str): The prompt.
+            generate_params (dict, optional): See `generation_kwargs`.
+
+        Returns:
+            concurrent.futures.Future: The response.
+        """
+        future = Future()
+        params_key = tuple(sorted(generation_kwargs(generate_params).items()))
+        self._requests.put((prompt, params_key, future))
+
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run_batches, name=f"generate-{self.model_name}", daemon=True
+                )
+                self._worker.start()
+
+        return future
+
+    def _generate_batch(self, prompts, generate_params):
+        """
+        Run one padded `generate` call.
+        """
+        import torch
+
+        inputs = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, truncation=True
+        ).to(self.device)
+
+        with self._generate_lock, torch.inference_mode():
+            outputs = self.model.generate(**inputs, **generation_kwargs(generate_params))
+
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def _run_batches(self):
+        """
+        Collect submitted prompts into batches and generate them, forever.
+        """
+        while True:
+            requests = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(self._requests.get(timeout=timeout))
+                except Empty:
+                    break
+
+            # One generate call per distinct set of parameters
+            groups = {}
+            for prompt, params_key, future in requests:
+                groups.setdefault(params_key, []).append((prompt, future))
+
+            for params_key, group in groups.items():
+                try:
+                    outputs = self._generate_batch(
+                        [prompt for prompt, _ in group], dict(params_key)
+                    )
+                except Exception as e:  # pylint: disable=broad-except
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+
+                for (_, future), output in zip(group, outputs):
+                    future.set_result(output)
+
+
+def get_local_model(model_name, **kwargs):
+    """
+    Return the process-wide instance of a local model, loaded on first
+    use. Later calls return it as loaded, ignoring `kwargs`.
+
+    Args:
+        model_name (str): The HuggingFace model name.
+        **kwargs: Arguments of LocalModel. dtype and compile_model
+        default to $LOCAL_MODEL_DTYPE and $LOCAL_MODEL_COMPILE.
+
+    Returns:
+        LocalModel: The loaded model.
+    """
+    with _models_lock:
+        if model_name not in _models:
+            kwargs.setdefault("dtype", os.getenv("LOCAL_MODEL_DTYPE") or None)
+            kwargs.setdefault(
+                "compile_model", os.getenv("LOCAL_MODEL_COMPILE", "").lower() in ["1", "true"]
+            )
+            _models[model_name] = LocalModel(model_name, **kwargs)
+        return _models[model_name]
@@ -3,12 +3,18 @@ This module provides utility functions for Huggingface.
 The utility functions are used to:
     1. Setup cache directories
     2. Vectorize Sentences
-    3. ...
+    3. Encode sentences into one float32 matrix
+    4. ...
+
+Embeddings are looked up in, and added to, the default embedding
+cache (see utils.embedding_cache) when the model name is known.
 """
 
 import os
 
-from tqdm.auto import tqdm
+import numpy as np
+
+from utils.embedding_cache import cached_embeddings, get_embedding_cache
 
 
 def setup_hf_cache_dir(path):
@@ -59,7 +65,57 @@ def setup_sentence_transformers_cache_dir(path):
     )
 
 
-def vectorize_sentences(model, documents, field="text"):
+def sentence_model_name(model, model_name=None):
+    """
+    Return the name of a sentence transformers model, used as the
+    embedding cache key.
+
+    Args:
+        model: The sentence transformers model.
+        model_name (str, optional): Explicit name, returned as is.
+
+    Returns:
+        str: The model name, or None if it cannot be determined.
+    """
+    if model_name:
+        return model_name
+
+    model_card_data = getattr(model, "model_card_data", None)
+    return getattr(model_card_data, "base_model", None)
+
+
+def encode_cached(model, texts, model_name=None, batch_size=32, use_cache=True):
+    """
+    Encode texts, computing only the embeddings missing from the cache.
+
+    Args:
+        model: The model to use for encoding sentences.
+        texts (list): The texts to encode.
+        model_name (str, optional): The model name used as cache key.
+        Read from the model if not given; without a name the cache
+        is not used.
+        batch_size (int, optional): Number of sentences encoded per
+        model call. Default is 32.
+        use_cache (bool, optional): Use the embedding cache.
+        Default is True.
+
+    Returns:
+        list: The embeddings as lists of floats, in the order of `texts`.
+    """
+    model_name = sentence_model_name(model, model_name)
+    cache = get_embedding_cache() if use_cache and model_name else None
+
+    return cached_embeddings(
+        cache=cache,
+        model_name=model_name,
+        texts=texts,
+        embed_fn=lambda texts: model.encode(
+            texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True
+        ).tolist(),
+    )
+
+
+def vectorize_sentences(model, documents, field="text", model_name=None, use_cache=True):
     """
     Vectorize sentences in documents using a specified model.
 
@@ -70,15 +126,64 @@ def vectorize_sentences(model, documents, field="text"):
         be vectorized.
         field (str, optional): The field in the document
         to be vectorized. Default is 'text'.
+        model_name (str, optional): The model name used as
+        embedding cache key. Read from the model if not given.
+        use_cache (bool, optional): Use the embedding cache.
+        Default is True.
 
     Returns:
         list: A list of documents with the vectorized field
         added.
     """
+    embeddings = encode_cached(
+        model,
+        [doc[field] for doc in documents],
+        model_name=model_name,
+        use_cache=use_cache,
+    )
+
     vectorized_documents = []
-    for doc in tqdm(documents):
-        # Transforming the title into an embedding using the model
-        doc[f"{field}_vector"] = model.encode(doc[field]).tolist()
+    for doc, embedding in zip(documents, embeddings):
+        doc[f"{field}_vector"] = embedding
         vectorized_documents.append(doc)
 
     return vectorized_documents
+
+
+def encode_sentences(
+    model, documents, field="text", batch_size=32, model_name=None, use_cache=True
+):
+    """
+    Encode a field of every document into one float32 matrix.
+
+    Unlike `vectorize_sentences`, the embeddings are not attached to
+    the documents as lists of Python floats; row i of the matrix
+    belongs to documents[i]. The matrix can be passed directly to
+    `EmbeddingStore.fit` or `VectorIndex.fit(docs, vectors)`.
+
+    Args:
+        model: The model to use for encoding sentences.
+        documents (list): A list of documents where each
+        document is a dictionary containing the field to
+        be encoded.
+        field (str, optional): The field in the document
+        to be encoded. Default is 'text'.
+        batch_size (int, optional): Number of sentences
+        encoded per model call. Default is 32.
+        model_name (str, optional): The model name used as
+        embedding cache key. Read from the model if not given.
+        use_cache (bool, optional): Use the embedding cache.
+        Default is True.
+
+    Returns:
+        numpy.ndarray: Array of shape (len(documents), dim).
+    """
+    embeddings = encode_cached(
+        model,
+        [doc[field] for doc in documents],
+        model_name=model_name,
+        batch_size=batch_size,
+        use_cache=use_cache,
+    )
+
+    return np.asarray(embeddings, dtype=np.float32)
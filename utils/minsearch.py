@@ -2,47 +2,164 @@
 curl https://raw.githubusercontent.com/DataTalksClub/llm-zoomcamp/main/01-intro/minsearch.py
 """
 
+import json
+import os
+import threading
+from collections import namedtuple
+
 import numpy as np
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+
+RANKINGS = ["tfidf", "bm25"]
+BM25_DEFAULT_PARAMS = {"k1": 1.2, "b": 0.75}
+
+IndexSnapshot = namedtuple(
+    "IndexSnapshot",
+    [
+        "docs",
+        "vectorizers",
+        "text_matrix",
+        "term_counts",
+        "field_slices",
+        "keyword_postings",
+        "id_rows",
+        "deleted",
+    ],
+)
+IndexSnapshot.__doc__ = """
+Immutable view of the data a search runs against.
+
+Writers build a new snapshot and swap it in with a single assignment, so a
+search that grabbed a snapshot keeps a consistent view while the index is
+being updated.
+"""
 
 
 class Index:
     """
-    A simple search index using TF-IDF and cosine similarity for text fields and 
-    exact matching for keyword fields.
+    A simple search index using TF-IDF and cosine similarity (or BM25) for text
+    fields and exact matching for keyword fields.
+
+    The L2-normalized TF-IDF matrices of all text fields are stacked
+    horizontally into one CSR matrix. Boosts are applied to the query side,
+    so a query is scored with a single sparse dot product and changing
+    boosts does not require a refit.
+
+    With `ranking="bm25"` the stacked matrix holds BM25 term weights computed
+    from the stacked term-frequency matrix instead, and a query is scored by
+    the same sparse dot product with its boosted term counts. As with TF-IDF,
+    field scores are summed (Elasticsearch `best_fields` takes their maximum).
+
+    Documents can be added, updated and deleted after `fit`. New rows are
+    vectorized under the fitted vocabulary and IDF, deleted rows are
+    tombstoned. `compact` drops tombstoned rows and `refit` rebuilds the
+    vocabulary and IDF from the live documents.
 
     Attributes:
         text_fields (list): List of text field names to index.
         keyword_fields (list): List of keyword field names to index.
-        vectorizers (dict): Dictionary of TfidfVectorizer instances for each text field.
-        keyword_df (pd.DataFrame): DataFrame containing keyword field data.
-        text_matrices (dict): Dictionary of TF-IDF matrices for each text field.
-        docs (list): List of documents indexed.
+        id_field (str): Document field used by `update` and `delete`.
+        ranking (str): Either "tfidf" or "bm25".
+        bm25_params (dict): Dictionary of {"k1": ..., "b": ...} for each text field.
+        vectorizers (dict): Dictionary of TfidfVectorizer (CountVectorizer for
+            BM25) instances for each text field.
+        keyword_postings (dict): Inverted index of keyword fields. Maps each field
+            to a dictionary of value -> sorted array of matching row ids.
+        text_matrix (scipy.sparse.csr_matrix): Stacked, L2-normalized TF-IDF
+            matrix (or BM25 weights) of all text fields.
+        term_counts (scipy.sparse.csr_matrix): Stacked term-frequency matrix
+            of all text fields. Only kept for BM25.
+        field_slices (dict): Dictionary of column slices of `text_matrix` for
+            each text field.
+        docs (list): List of documents indexed, including deleted ones
+            until the next `compact`.
     """
 
-    def __init__(self, text_fields, keyword_fields, vectorizer_params=None):
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        text_fields,
+        keyword_fields,
+        vectorizer_params=None,
+        id_field="id",
+        refit_every=None,
+        ranking="tfidf",
+        bm25_params=None,
+    ):
         """
         Initializes the Index with specified text and keyword fields.
 
         Args:
             text_fields (list): List of text field names to index.
             keyword_fields (list): List of keyword field names to index.
-            vectorizer_params (dict): Optional parameters to pass to TfidfVectorizer.
+            vectorizer_params (dict): Optional parameters to pass to TfidfVectorizer
+                (CountVectorizer for BM25).
+            id_field (str): Document field holding the document id. Defaults to "id".
+            refit_every (int): Optional number of added, updated or deleted
+                documents after which the index is refitted automatically.
+            ranking (str): Scoring function, "tfidf" (cosine similarity) or
+                "bm25". Defaults to "tfidf".
+            bm25_params (dict): Optional dictionary of {"k1": ..., "b": ...}
+                per text field. Missing values default to k1=1.2 and b=0.75.
         """
         if not vectorizer_params:
             vectorizer_params = {}
+        if ranking not in RANKINGS:
+            raise ValueError(f"`ranking` must be in {RANKINGS}, but got '{ranking}'")
 
         self.text_fields = text_fields
         self.keyword_fields = keyword_fields
+        self.vectorizer_params = vectorizer_params
+        self.id_field = id_field
+        self.refit_every = refit_every
+        self.ranking = ranking
+        self.bm25_params = resolve_bm25_params(text_fields, bm25_params)
 
-        self.vectorizers = {
-            field: TfidfVectorizer(**vectorizer_params) for field in text_fields
-        }
-        self.keyword_df = None
-        self.text_matrices = {}
-        self.docs = []
+        self._lock = threading.RLock()
+        self._n_changes = 0
+        self._snapshot = IndexSnapshot(
+            docs=[],
+            vectorizers=self._new_vectorizers(),
+            text_matrix=None,
+            term_counts=None,
+            field_slices={},
+            keyword_postings={},
+            id_rows={},
+            deleted=None,
+        )
+
+    @property
+    def docs(self):
+        """Documents of the current snapshot."""
+        return self._snapshot.docs
+
+    @property
+    def vectorizers(self):
+        """Fitted vectorizers of the current snapshot."""
+        return self._snapshot.vectorizers
+
+    @property
+    def text_matrix(self):
+        """Stacked TF-IDF matrix of the current snapshot."""
+        return self._snapshot.text_matrix
+
+    @property
+    def term_counts(self):
+        """Term-frequency matrix of the current snapshot (BM25 only)."""
+        return self._snapshot.term_counts
+
+    @property
+    def field_slices(self):
+        """Column slices of the current snapshot."""
+        return self._snapshot.field_slices
+
+    @property
+    def keyword_postings(self):
+        """Keyword postings of the current snapshot."""
+        return self._snapshot.keyword_postings
 
     def fit(self, docs):
         """
@@ -51,30 +168,139 @@ class Index:
         Args:
             docs (list of dict): List of documents to index. Each document is a dictionary.
         """
-        self.docs = docs
-        keyword_data = {field: [] for field in self.keyword_fields}
+        vectorizers = self._new_vectorizers()
+        text_matrices = []
+        field_slices = {}
+        offset = 0
 
         for field in self.text_fields:
             texts = [doc.get(field, "") for doc in docs]
-            self.text_matrices[field] = self.vectorizers[field].fit_transform(texts)
+            text_matrix = vectorizers[field].fit_transform(texts)
+            if self.ranking == "tfidf":
+                text_matrix = l2_normalize(text_matrix)
+            text_matrices.append(text_matrix)
+
+            field_slices[field] = slice(offset, offset + text_matrix.shape[1])
+            offset += text_matrix.shape[1]
+
+        text_matrix = sp.hstack(text_matrices, format="csr")
+        snapshot = IndexSnapshot(
+            docs=docs,
+            vectorizers=vectorizers,
+            text_matrix=text_matrix,
+            term_counts=text_matrix if self.ranking == "bm25" else None,
+            field_slices=field_slices,
+            keyword_postings=build_keyword_postings(docs, self.keyword_fields),
+            id_rows=build_id_rows(docs, self.id_field),
+            deleted=None,
+        )
+
+        with self._lock:
+            self._n_changes = 0
+            self._snapshot = self._reweighted(snapshot)
+
+        return self
+
+    def set_bm25_params(self, bm25_params):
+        """
+        Changes the BM25 k1/b parameters without refitting.
+
+        The BM25 weights are recomputed from the stored term frequencies.
+
+        Args:
+            bm25_params (dict): Dictionary of {"k1": ..., "b": ...} per text field.
+        """
+        with self._lock:
+            self.bm25_params = resolve_bm25_params(self.text_fields, bm25_params)
+            self._snapshot = self._reweighted(self._snapshot)
+
+        return self
+
+    def add(self, docs):
+        """
+        Appends documents to the index under the fitted vocabulary and IDF.
+
+        Terms that are not in the fitted vocabulary are ignored until the
+        next `refit`.
 
-        for doc in docs:
-            for field in self.keyword_fields:
-                keyword_data[field].append(doc.get(field, ""))
+        Args:
+            docs (list of dict): List of documents to add.
+        """
+        with self._lock:
+            self._snapshot = self._appended(self._snapshot, docs)
+            self._record_changes(len(docs))
 
-        self.keyword_df = pd.DataFrame(keyword_data)
+        return self
+
+    def update(self, doc_id, doc):
+        """
+        Replaces the document(s) with the given id by a new document.
+
+        Args:
+            doc_id: Value of `id_field` of the document to replace.
+            doc (dict): The new document.
+
+        Raises:
+            KeyError: If no live document has the given id.
+        """
+        with self._lock:
+            snapshot = self._deleted(self._snapshot, doc_id)
+            self._snapshot = self._appended(snapshot, [doc])
+            self._record_changes(1)
 
         return self
 
+    def delete(self, doc_id):
+        """
+        Tombstones the document(s) with the given id.
+
+        Args:
+            doc_id: Value of `id_field` of the document to delete.
+
+        Raises:
+            KeyError: If no live document has the given id.
+        """
+        with self._lock:
+            self._snapshot = self._deleted(self._snapshot, doc_id)
+            self._record_changes(1)
+
+        return self
+
+    def compact(self):
+        """
+        Physically removes tombstoned rows, keeping the fitted vocabulary and IDF.
+        """
+        with self._lock:
+            self._snapshot = compacted(self._snapshot, self.keyword_fields, self.id_field)
+
+        return self
+
+    def refit(self):
+        """
+        Refits the index on the live documents, folding in new terms and IDF drift.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot.deleted is None:
+                docs = snapshot.docs
+            else:
+                docs = [
+                    doc
+                    for doc, deleted in zip(snapshot.docs, snapshot.deleted)
+                    if not deleted
+                ]
+
+            return self.fit(docs)
+
     def search(self, query, filter_dict=None, boost_dict=None, num_results=10):
         """
         Searches the index with the given query, filters, and boost parameters.
 
         Args:
             query (str): The search query string.
-            filter_dict (dict): Dictionary of keyword fields to filter by. 
+            filter_dict (dict): Dictionary of keyword fields to filter by.
                 Keys are field names and values are the values to filter by.
-            boost_dict (dict): Dictionary of boost scores for text fields. 
+            boost_dict (dict): Dictionary of boost scores for text fields.
                 Keys are field names and values are the boost scores.
             num_results (int): The number of top results to return. Defaults to 10.
 
@@ -83,32 +309,1334 @@ class Index:
         """
         if not filter_dict:
             filter_dict = {}
-        if not boost:
-            boost = {}
+        if not boost_dict:
+            boost_dict = {}
+
+        snapshot = self._snapshot
+        rows = live_rows(snapshot, filter_dict)
+        scores = self._score(snapshot, [query], rows, boost_dict)[0]
+
+        top_indices = top_k_indices(scores[np.newaxis, :], num_results)[0]
+
+        return collect_docs(snapshot, top_indices, scores, rows)
+
+    def search_batch(self, queries, filter_dicts=None, boost_dict=None, num_results=10):
+        """
+        Searches the index with many queries at once.
+
+        All queries are vectorized together and scored with one sparse
+        matrix product per text field, followed by a row-wise top-k.
+        The ranking of each query is the same as calling `search` on it.
+
+        Args:
+            queries (list of str): The search query strings.
+            filter_dicts (dict or list of dict): Keyword filters. Either one
+                dictionary applied to every query, or one dictionary per query.
+            boost_dict (dict): Dictionary of boost scores for text fields.
+                Keys are field names and values are the boost scores.
+            num_results (int): The number of top results to return per query.
+                Defaults to 10.
+
+        Returns:
+            list of list of dict: For each query, the list of documents
+            matching the search criteria, ranked by relevance.
+        """
+        if not boost_dict:
+            boost_dict = {}
+        if not filter_dicts:
+            filter_dicts = {}
+        if isinstance(filter_dicts, dict):
+            filter_dicts = [filter_dicts] * len(queries)
+
+        if len(filter_dicts) != len(queries):
+            raise ValueError(
+                f"Expected {len(queries)} filter dicts, but got {len(filter_dicts)}"
+            )
+
+        snapshot = self._snapshot
+
+        # Queries sharing the same filters are scored together on the same rows
+        groups = {}
+        for position, filter_dict in enumerate(filter_dicts):
+            groups.setdefault(filter_key(filter_dict, self.keyword_fields), []).append(
+                position
+            )
+
+        results = [None] * len(queries)
+
+        for key, positions in groups.items():
+            rows = live_rows(snapshot, dict(key))
+            scores = self._score(
+                snapshot, [queries[i] for i in positions], rows, boost_dict
+            )
+            top_indices = top_k_indices(scores, num_results)
+
+            for position, row_indices, row_scores in zip(positions, top_indices, scores):
+                results[position] = collect_docs(snapshot, row_indices, row_scores, rows)
+
+        return results
+
+    def save(self, path):
+        """
+        Saves the fitted index to a directory.
+
+        Arrays (CSR data/indices/indptr, IDF vectors, keyword postings and,
+        for BM25, the term-frequency matrix) are written as `.npy` files so
+        that `load` can memory-map them; the vocabularies, posting keys and
+        documents are written as JSON. Tombstoned rows are not written.
+
+        Args:
+            path (str): Directory to write the index to. Created if missing.
+        """
+        os.makedirs(path, exist_ok=True)
+        snapshot = compacted(self._snapshot, self.keyword_fields, self.id_field)
+
+        vocabularies = {}
+        idfs = []
+        for field in self.text_fields:
+            vocabulary = snapshot.vectorizers[field].vocabulary_
+            terms = [None] * len(vocabulary)
+            for term, column in vocabulary.items():
+                terms[column] = term
+            vocabularies[field] = terms
+
+            if getattr(snapshot.vectorizers[field], "use_idf", False):
+                idfs.append(snapshot.vectorizers[field].idf_)
+        idf = np.concatenate(idfs) if idfs else np.empty(0)
+
+        posting_keys, postings, posting_offsets = flatten_postings(
+            snapshot.keyword_postings
+        )
+
+        meta = {
+            "format_version": self.FORMAT_VERSION,
+            "text_fields": self.text_fields,
+            "keyword_fields": self.keyword_fields,
+            "vectorizer_params": self.vectorizer_params,
+            "id_field": self.id_field,
+            "ranking": self.ranking,
+            "bm25_params": self.bm25_params,
+            "field_slices": {
+                field: [field_slice.start, field_slice.stop]
+                for field, field_slice in snapshot.field_slices.items()
+            },
+            "shape": list(snapshot.text_matrix.shape),
+            "vocabularies": vocabularies,
+            "posting_keys": posting_keys,
+        }
+
+        arrays = {
+            "data": snapshot.text_matrix.data,
+            "indices": snapshot.text_matrix.indices,
+            "indptr": snapshot.text_matrix.indptr,
+            "idf": idf,
+            "postings": postings,
+            "posting_offsets": posting_offsets,
+        }
+        if snapshot.term_counts is not None:
+            arrays["counts_data"] = snapshot.term_counts.data
+            arrays["counts_indices"] = snapshot.term_counts.indices
+            arrays["counts_indptr"] = snapshot.term_counts.indptr
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(path, "meta.json"), "wt", encoding="utf-8") as f_out:
+            json.dump(meta, f_out)
+        with open(os.path.join(path, "docs.json"), "wt", encoding="utf-8") as f_out:
+            json.dump(snapshot.docs, f_out)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads an index previously written with `save`, without refitting.
+
+        Args:
+            path (str): Directory the index was saved to.
+            mmap (bool): Memory-map the arrays read-only instead of reading
+                them into memory, so that several processes share one
+                page-cached copy. Defaults to True.
+
+        Returns:
+            Index: The loaded index.
+        """
+        with open(os.path.join(path, "meta.json"), "rt", encoding="utf-8") as f_in:
+            meta = json.load(f_in)
+
+        if meta["format_version"] != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format version {meta['format_version']}, "
+                f"expected {cls.FORMAT_VERSION}"
+            )
+
+        index = cls(
+            text_fields=meta["text_fields"],
+            keyword_fields=meta["keyword_fields"],
+            vectorizer_params=meta["vectorizer_params"],
+            id_field=meta["id_field"],
+            ranking=meta.get("ranking", "tfidf"),
+            bm25_params=meta.get("bm25_params"),
+        )
+
+        names = ["data", "indices", "indptr", "idf", "postings", "posting_offsets"]
+        if index.ranking == "bm25":
+            names += ["counts_data", "counts_indices", "counts_indptr"]
+
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in names
+        }
+
+        vectorizers = index._new_vectorizers()
+        field_slices = {}
+        idf_offset = 0
+        for field in index.text_fields:
+            terms = meta["vocabularies"][field]
+            vectorizer = vectorizers[field]
+            vectorizer.vocabulary_ = {term: column for column, term in enumerate(terms)}
+            if getattr(vectorizer, "use_idf", False):
+                vectorizer.idf_ = np.asarray(arrays["idf"][idf_offset : idf_offset + len(terms)])
+                idf_offset += len(terms)
+
+            field_slices[field] = slice(*meta["field_slices"][field])
+
+        keyword_postings = unflatten_postings(
+            index.keyword_fields,
+            meta["posting_keys"],
+            arrays["postings"],
+            arrays["posting_offsets"],
+        )
+
+        with open(os.path.join(path, "docs.json"), "rt", encoding="utf-8") as f_in:
+            docs = json.load(f_in)
+
+        term_counts = None
+        if index.ranking == "bm25":
+            term_counts = sp.csr_matrix(
+                (arrays["counts_data"], arrays["counts_indices"], arrays["counts_indptr"]),
+                shape=tuple(meta["shape"]),
+                copy=False,
+            )
+
+        index._snapshot = IndexSnapshot(
+            docs=docs,
+            vectorizers=vectorizers,
+            text_matrix=sp.csr_matrix(
+                (arrays["data"], arrays["indices"], arrays["indptr"]),
+                shape=tuple(meta["shape"]),
+                copy=False,
+            ),
+            term_counts=term_counts,
+            field_slices=field_slices,
+            keyword_postings=keyword_postings,
+            id_rows=build_id_rows(docs, index.id_field),
+            deleted=None,
+        )
+
+        return index
 
-        query_vecs = {
-            field: self.vectorizers[field].transform([query])
-            for field in self.text_fields
+    def _new_vectorizers(self):
+        """
+        Returns fresh, unfitted vectorizers for every text field.
+        """
+        vectorizer_class = CountVectorizer if self.ranking == "bm25" else TfidfVectorizer
+
+        return {
+            field: vectorizer_class(**self.vectorizer_params) for field in self.text_fields
         }
-        scores = np.zeros(len(self.docs))
 
-        # Compute cosine similarity for each text field and apply boost
-        for field, query_vec in query_vecs.items():
-            sim = cosine_similarity(query_vec, self.text_matrices[field]).flatten()
-            boost = boost_dict.get(field, 1)
-            scores += sim * boost
+    def _record_changes(self, n_changes):
+        """
+        Counts changed documents and refits once `refit_every` is reached.
+        """
+        self._n_changes += n_changes
+        if self.refit_every and self._n_changes >= self.refit_every:
+            self.refit()
+
+    def _appended(self, snapshot, docs):
+        """
+        Returns a copy of the snapshot with documents appended.
+        """
+        if not docs:
+            return snapshot
+
+        n_rows = len(snapshot.docs)
+        new_rows = np.arange(n_rows, n_rows + len(docs), dtype=np.int64)
+
+        new_matrix = vectorize_docs(
+            snapshot, self.text_fields, docs, normalize=self.ranking == "tfidf"
+        )
+        text_matrix = snapshot.text_matrix
+        term_counts = snapshot.term_counts
+        if term_counts is None:
+            text_matrix = sp.vstack([text_matrix, new_matrix], format="csr")
+        else:
+            term_counts = sp.vstack([term_counts, new_matrix], format="csr")
+
+        new_postings = build_keyword_postings(docs, self.keyword_fields)
+        keyword_postings = {}
+        for field, field_postings in snapshot.keyword_postings.items():
+            keyword_postings[field] = dict(field_postings)
+            for value, rows in new_postings[field].items():
+                keyword_postings[field][value] = np.concatenate(
+                    [field_postings.get(value, rows[:0]), rows + n_rows]
+                )
+
+        id_rows = dict(snapshot.id_rows)
+        for row, doc in zip(new_rows, docs):
+            if self.id_field in doc:
+                id_rows[doc[self.id_field]] = id_rows.get(doc[self.id_field], []) + [row]
+
+        deleted = snapshot.deleted
+        if deleted is not None:
+            deleted = np.concatenate([deleted, np.zeros(len(docs), dtype=bool)])
+
+        return self._reweighted(
+            snapshot._replace(
+                docs=snapshot.docs + list(docs),
+                text_matrix=text_matrix,
+                term_counts=term_counts,
+                keyword_postings=keyword_postings,
+                id_rows=id_rows,
+                deleted=deleted,
+            )
+        )
+
+    def _deleted(self, snapshot, doc_id):
+        """
+        Returns a copy of the snapshot with the document(s) of `doc_id` tombstoned.
+        """
+        if doc_id not in snapshot.id_rows:
+            raise KeyError(doc_id)
+
+        if snapshot.deleted is None:
+            deleted = np.zeros(len(snapshot.docs), dtype=bool)
+        else:
+            deleted = snapshot.deleted.copy()
+        deleted[snapshot.id_rows[doc_id]] = True
+
+        id_rows = dict(snapshot.id_rows)
+        del id_rows[doc_id]
+
+        return self._reweighted(snapshot._replace(id_rows=id_rows, deleted=deleted))
+
+    def _reweighted(self, snapshot):
+        """
+        Returns the snapshot with BM25 weights recomputed from its term
+        frequencies. TF-IDF snapshots are returned unchanged.
+        """
+        if self.ranking != "bm25":
+            return snapshot
+
+        return snapshot._replace(
+            text_matrix=bm25_weights(
+                snapshot.term_counts,
+                snapshot.field_slices,
+                self.bm25_params,
+                snapshot.deleted,
+            )
+        )
+
+    def _score(self, snapshot, queries, rows, boost_dict):
+        """
+        Scores queries against the candidate rows of the index.
+
+        Args:
+            snapshot (IndexSnapshot): The data to score against.
+            queries (list of str): The search query strings.
+            rows (np.ndarray or None): Candidate row ids, or None for all rows.
+            boost_dict (dict): Dictionary of boost scores for text fields.
+
+        Returns:
+            np.ndarray: Array of shape (len(queries), n_candidates).
+        """
+        text_matrix = snapshot.text_matrix
+        if rows is not None:
+            text_matrix = text_matrix[rows]
+
+        if text_matrix.shape[0] == 0:
+            return np.zeros((len(queries), 0))
+
+        # Rows hold unit-length TF-IDF vectors or BM25 term weights, so the
+        # boosted sum of per-field scores is a single sparse dot product
+        query_matrix = self._query_matrix(snapshot, queries, boost_dict)
+
+        return (query_matrix @ text_matrix.T).toarray()
+
+    def _query_matrix(self, snapshot, queries, boost_dict):
+        """
+        Vectorizes queries into the stacked column space of `text_matrix`.
+
+        Each field block is multiplied by the field boost. For TF-IDF it is
+        L2-normalized first, for BM25 it holds the raw query term counts.
+
+        Args:
+            snapshot (IndexSnapshot): The data holding the fitted vectorizers.
+            queries (list of str): The search query strings.
+            boost_dict (dict): Dictionary of boost scores for text fields.
+
+        Returns:
+            scipy.sparse.csr_matrix: Array of shape (len(queries), n_columns).
+        """
+        query_matrices = []
+
+        for field in self.text_fields:
+            query_matrix = snapshot.vectorizers[field].transform(queries)
+            if self.ranking == "tfidf":
+                query_matrix = l2_normalize(query_matrix)
+            query_matrices.append(query_matrix * boost_dict.get(field, 1))
 
-        # Apply keyword filters
-        for field, value in filter_dict.items():
-            if field in self.keyword_fields:
-                mask = self.keyword_df[field] == value
-                scores = scores * mask.to_numpy()
+        return sp.hstack(query_matrices, format="csr", dtype=np.float64)
+
+
+class VectorIndex:
+    """
+    An exact nearest-neighbour index over dense document embeddings with
+    exact matching for keyword fields.
+
+    Embeddings are held in one contiguous float32 matrix. A query is scored
+    with a single matrix-vector product (matrix-matrix for a batch) over the
+    candidate rows, followed by an `argpartition` top-k. Rows are ordered by
+    the first keyword field, so filtering on it scores a contiguous view of
+    the matrix without copying it.
+
+    Attributes:
+        vector_field (str): Document field holding the embedding.
+        keyword_fields (list): List of keyword field names to index.
+        normalize (bool): Whether embeddings and queries are L2-normalized,
+            making the score a cosine similarity.
+        vectors (np.ndarray): Float32 matrix of shape (n_docs, dim).
+        keyword_postings (dict): Inverted index of keyword fields.
+        docs (list): List of documents indexed, without their `*_vector` fields.
+    """
+
+    def __init__(self, vector_field, keyword_fields, normalize=True):
+        """
+        Initializes the VectorIndex.
+
+        Args:
+            vector_field (str): Document field holding the embedding,
+                e.g. "question_text_vector".
+            keyword_fields (list): List of keyword field names to index.
+            normalize (bool): L2-normalize embeddings and queries so that
+                scores are cosine similarities. Defaults to True.
+        """
+        self.vector_field = vector_field
+        self.keyword_fields = keyword_fields
+        self.normalize = normalize
+
+        self.vectors = None
+        self.keyword_postings = {}
+        self.docs = []
+
+    def fit(self, docs, vectors=None):
+        """
+        Fits the index with the provided documents.
+
+        Args:
+            docs (list of dict): List of documents to index.
+            vectors (array-like): Optional embeddings of shape (n_docs, dim).
+                Read from `vector_field` of every document if not given.
+        """
+        if vectors is None:
+            vectors = [doc[self.vector_field] for doc in docs]
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(docs):
+            raise ValueError(
+                f"Expected vectors of shape ({len(docs)}, dim), but got {vectors.shape}"
+            )
+
+        if self.keyword_fields:
+            field = self.keyword_fields[0]
+            order = sorted(range(len(docs)), key=lambda i: str(docs[i].get(field, "")))
+            vectors = vectors[order]
+            docs = [docs[i] for i in order]
+
+        self.vectors = l2_normalize_dense(vectors) if self.normalize else vectors
+        self.keyword_postings = build_keyword_postings(docs, self.keyword_fields)
+        self.docs = [
+            {key: value for key, value in doc.items() if not key.endswith("_vector")}
+            for doc in docs
+        ]
+
+        return self
+
+    def search(self, query_vector, filter_dict=None, num_results=10):
+        """
+        Searches the index with the given query embedding and filters.
+
+        Args:
+            query_vector (array-like): The query embedding.
+            filter_dict (dict): Dictionary of keyword fields to filter by.
+            num_results (int): The number of top results to return. Defaults to 10.
+
+        Returns:
+            list of dict: List of documents ranked by similarity.
+        """
+        return self.search_batch([query_vector], filter_dict, num_results)[0]
+
+    def search_batch(self, query_vectors, filter_dicts=None, num_results=10):
+        """
+        Searches the index with many query embeddings at once.
+
+        Args:
+            query_vectors (array-like): Query embeddings of shape (n_queries, dim).
+            filter_dicts (dict or list of dict): Keyword filters. Either one
+                dictionary applied to every query, or one dictionary per query.
+            num_results (int): The number of top results to return per query.
+                Defaults to 10.
+
+        Returns:
+            list of list of dict: For each query, the list of documents
+            ranked by similarity.
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if self.normalize:
+            query_vectors = l2_normalize_dense(query_vectors)
+
+        if not filter_dicts:
+            filter_dicts = {}
+        if isinstance(filter_dicts, dict):
+            filter_dicts = [filter_dicts] * len(query_vectors)
+
+        if len(filter_dicts) != len(query_vectors):
+            raise ValueError(
+                f"Expected {len(query_vectors)} filter dicts, but got {len(filter_dicts)}"
+            )
+
+        groups = {}
+        for position, filter_dict in enumerate(filter_dicts):
+            groups.setdefault(filter_key(filter_dict, self.keyword_fields), []).append(
+                position
+            )
+
+        results = [None] * len(query_vectors)
+
+        for key, positions in groups.items():
+            rows = filter_rows(self.keyword_postings, dict(key))
+            scores = query_vectors[positions] @ candidate_rows(self.vectors, rows).T
+            top_indices = top_k_indices(scores, num_results)
+
+            for position, row_indices in zip(positions, top_indices):
+                if rows is not None:
+                    row_indices = rows[row_indices]
+                results[position] = [self.docs[i] for i in row_indices]
+
+        return results
+
+
+class IVFIndex:
+    """
+    An approximate nearest-neighbour index over dense document embeddings,
+    using an inverted file (IVF) with a k-means coarse quantizer.
+
+    The embeddings are clustered into `n_lists` inverted lists. A query is
+    compared to the list centroids first and only the vectors of the
+    `nprobe` closest lists are scored exactly, so `nprobe` trades recall
+    for latency. Vectors are stored sorted by list, so every list is a
+    contiguous block of one float32 matrix.
+
+    With a `partition_field` (e.g. "course") every value of that field gets
+    its own centroids and lists; filtering on it only probes the lists of
+    that partition. Other keyword filters are applied to the probed rows.
+
+    Attributes:
+        vector_field (str): Document field holding the embedding.
+        keyword_fields (list): List of keyword field names to index.
+        partition_field (str): Keyword field the lists are partitioned by, or None.
+        n_lists (int): Number of lists per partition, or None for sqrt(n_docs).
+        nprobe (int): Default number of lists probed per query.
+        normalize (bool): Whether embeddings and queries are L2-normalized,
+            making the score a cosine similarity.
+        vectors (np.ndarray): Float32 matrix of shape (n_docs, dim), sorted by list.
+        centroids (np.ndarray): Float32 matrix of shape (n_lists_total, dim).
+        list_offsets (np.ndarray): Row range of list i is
+            list_offsets[i]:list_offsets[i + 1].
+        partitions (dict): Maps each partition value to its (first, stop) list range.
+        keyword_postings (dict): Inverted index of keyword fields.
+        docs (list): List of documents indexed, without their `*_vector` fields.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        vector_field,
+        keyword_fields,
+        partition_field=None,
+        n_lists=None,
+        nprobe=8,
+        normalize=True,
+        n_iter=10,
+        max_train_per_list=64,
+        seed=0,
+    ):
+        """
+        Initializes the IVFIndex.
+
+        Args:
+            vector_field (str): Document field holding the embedding.
+            keyword_fields (list): List of keyword field names to index.
+            partition_field (str): Optional keyword field to partition by.
+            n_lists (int): Number of lists per partition. Defaults to
+                sqrt(n_docs) of every partition.
+            nprobe (int): Default number of lists probed per query. Defaults to 8.
+            normalize (bool): L2-normalize embeddings and queries so that
+                scores are cosine similarities. Defaults to True.
+            n_iter (int): Number of k-means iterations. Defaults to 10.
+            max_train_per_list (int): k-means is trained on at most this
+                many sampled vectors per list. Defaults to 64.
+            seed (int): Random seed of the k-means initialization.
+        """
+        if partition_field is not None and partition_field not in keyword_fields:
+            raise ValueError(
+                f"`partition_field` '{partition_field}' must be one of {keyword_fields}"
+            )
+
+        self.vector_field = vector_field
+        self.keyword_fields = keyword_fields
+        self.partition_field = partition_field
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.normalize = normalize
+        self.n_iter = n_iter
+        self.max_train_per_list = max_train_per_list
+        self.seed = seed
+
+        self.vectors = None
+        self.centroids = None
+        self.list_offsets = None
+        self.partitions = {}
+        self.keyword_postings = {}
+        self.docs = []
+
+    def fit(self, docs, vectors=None):
+        """
+        Trains the coarse quantizer and fills the inverted lists.
+
+        Args:
+            docs (list of dict): List of documents to index.
+            vectors (array-like): Optional embeddings of shape (n_docs, dim).
+                Read from `vector_field` of every document if not given.
+        """
+        if vectors is None:
+            vectors = [doc[self.vector_field] for doc in docs]
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(docs):
+            raise ValueError(
+                f"Expected vectors of shape ({len(docs)}, dim), but got {vectors.shape}"
+            )
+        if self.normalize:
+            vectors = l2_normalize_dense(vectors)
+
+        if self.partition_field is None:
+            partition_rows = {None: np.arange(len(docs))}
+        else:
+            partition_rows = build_keyword_postings(docs, [self.partition_field])[
+                self.partition_field
+            ]
+
+        rng = np.random.default_rng(self.seed)
+        order = []
+        centroids = []
+        list_sizes = []
+        self.partitions = {}
+
+        for value in sorted(partition_rows, key=str):
+            rows = partition_rows[value]
+            n_lists = self.n_lists or int(np.ceil(np.sqrt(len(rows))))
+            n_lists = max(min(n_lists, len(rows)), 1)
+
+            partition_centroids = train_kmeans(
+                vectors[rows],
+                n_lists,
+                n_iter=self.n_iter,
+                max_train=self.max_train_per_list * n_lists,
+                rng=rng,
+            )
+            assignments = assign_to_centroids(vectors[rows], partition_centroids)
+
+            first_list = sum(len(c) for c in centroids)
+            self.partitions[value] = (first_list, first_list + n_lists)
+            order.append(rows[np.argsort(assignments, kind="stable")])
+            centroids.append(partition_centroids)
+            list_sizes.append(np.bincount(assignments, minlength=n_lists))
+
+        order = np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.centroids = np.concatenate(centroids) if centroids else vectors[:0]
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.concatenate(list_sizes) if list_sizes else [])]
+        ).astype(np.int64)
+        self.docs = [
+            {key: value for key, value in docs[i].items() if not key.endswith("_vector")}
+            for i in order
+        ]
+        self.keyword_postings = build_keyword_postings(self.docs, self.keyword_fields)
+
+        return self
+
+    def search(self, query_vector, filter_dict=None, num_results=10, nprobe=None):
+        """
+        Searches the index with the given query embedding and filters.
+
+        Args:
+            query_vector (array-like): The query embedding.
+            filter_dict (dict): Dictionary of keyword fields to filter by.
+            num_results (int): The number of top results to return. Defaults to 10.
+            nprobe (int): Number of lists to probe. Defaults to `self.nprobe`.
+
+        Returns:
+            list of dict: List of documents ranked by similarity.
+        """
+        return self.search_batch([query_vector], filter_dict, num_results, nprobe)[0]
+
+    def search_batch(self, query_vectors, filter_dicts=None, num_results=10, nprobe=None):
+        """
+        Searches the index with many query embeddings at once.
+
+        Args:
+            query_vectors (array-like): Query embeddings of shape (n_queries, dim).
+            filter_dicts (dict or list of dict): Keyword filters. Either one
+                dictionary applied to every query, or one dictionary per query.
+            num_results (int): The number of top results to return per query.
+                Defaults to 10.
+            nprobe (int): Number of lists to probe. Defaults to `self.nprobe`.
+
+        Returns:
+            list of list of dict: For each query, the list of documents
+            ranked by similarity.
+        """
+        if not nprobe:
+            nprobe = self.nprobe
+
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if self.normalize:
+            query_vectors = l2_normalize_dense(query_vectors)
+
+        if not filter_dicts:
+            filter_dicts = {}
+        if isinstance(filter_dicts, dict):
+            filter_dicts = [filter_dicts] * len(query_vectors)
+
+        if len(filter_dicts) != len(query_vectors):
+            raise ValueError(
+                f"Expected {len(query_vectors)} filter dicts, but got {len(filter_dicts)}"
+            )
+
+        groups = {}
+        for position, filter_dict in enumerate(filter_dicts):
+            groups.setdefault(filter_key(filter_dict, self.keyword_fields), []).append(
+                position
+            )
+
+        results = [None] * len(query_vectors)
+
+        for key, positions in groups.items():
+            filter_dict = dict(key)
+            first_list, stop_list = self._probed_range(filter_dict)
+
+            # Filters other than the partition are checked on the probed rows
+            allowed = None
+            rows = filter_rows(
+                self.keyword_postings,
+                {
+                    field: value
+                    for field, value in filter_dict.items()
+                    if field != self.partition_field
+                },
+            )
+            if rows is not None:
+                allowed = np.zeros(len(self.docs), dtype=bool)
+                allowed[rows] = True
+
+            centroid_scores = (
+                query_vectors[positions] @ self.centroids[first_list:stop_list].T
+            )
+            probed_lists = top_k_indices(centroid_scores, nprobe) + first_list
+
+            for position, lists in zip(positions, probed_lists):
+                candidates = list_rows(self.list_offsets, lists)
+                if allowed is not None:
+                    candidates = candidates[allowed[candidates]]
+
+                scores = self.vectors[candidates] @ query_vectors[position]
+                top_indices = top_k_indices(scores[np.newaxis, :], num_results)[0]
+                results[position] = [self.docs[candidates[i]] for i in top_indices]
+
+        return results
+
+    def save(self, path):
+        """
+        Saves the fitted index to a directory.
+
+        Vectors, centroids, list offsets and keyword postings are written as
+        `.npy` files so that `load` can memory-map them; partitions, posting
+        keys and documents are written as JSON.
+
+        Args:
+            path (str): Directory to write the index to. Created if missing.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        posting_keys, postings, posting_offsets = flatten_postings(self.keyword_postings)
+
+        meta = {
+            "format_version": self.FORMAT_VERSION,
+            "vector_field": self.vector_field,
+            "keyword_fields": self.keyword_fields,
+            "partition_field": self.partition_field,
+            "n_lists": self.n_lists,
+            "nprobe": self.nprobe,
+            "normalize": self.normalize,
+            "partitions": [
+                [value, first_list, stop_list]
+                for value, (first_list, stop_list) in self.partitions.items()
+            ],
+            "posting_keys": posting_keys,
+        }
+
+        arrays = {
+            "vectors": self.vectors,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "postings": postings,
+            "posting_offsets": posting_offsets,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(path, "meta.json"), "wt", encoding="utf-8") as f_out:
+            json.dump(meta, f_out)
+        with open(os.path.join(path, "docs.json"), "wt", encoding="utf-8") as f_out:
+            json.dump(self.docs, f_out)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads an index previously written with `save`, without retraining.
+
+        Args:
+            path (str): Directory the index was saved to.
+            mmap (bool): Memory-map the arrays read-only instead of reading
+                them into memory. Defaults to True.
+
+        Returns:
+            IVFIndex: The loaded index.
+        """
+        with open(os.path.join(path, "meta.json"), "rt", encoding="utf-8") as f_in:
+            meta = json.load(f_in)
+
+        if meta["format_version"] != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format version {meta['format_version']}, "
+                f"expected {cls.FORMAT_VERSION}"
+            )
+
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ["vectors", "centroids", "list_offsets", "postings", "posting_offsets"]
+        }
+
+        index = cls(
+            vector_field=meta["vector_field"],
+            keyword_fields=meta["keyword_fields"],
+            partition_field=meta["partition_field"],
+            n_lists=meta["n_lists"],
+            nprobe=meta["nprobe"],
+            normalize=meta["normalize"],
+        )
+        index.vectors = arrays["vectors"]
+        index.centroids = arrays["centroids"]
+        index.list_offsets = arrays["list_offsets"]
+        index.partitions = {
+            value: (first_list, stop_list)
+            for value, first_list, stop_list in meta["partitions"]
+        }
+        index.keyword_postings = unflatten_postings(
+            index.keyword_fields,
+            meta["posting_keys"],
+            arrays["postings"],
+            arrays["posting_offsets"],
+        )
+
+        with open(os.path.join(path, "docs.json"), "rt", encoding="utf-8") as f_in:
+            index.docs = json.load(f_in)
+
+        return index
+
+    def _probed_range(self, filter_dict):
+        """
+        Returns the (first, stop) range of lists a query with these filters may probe.
+        """
+        if self.partition_field is None or self.partition_field not in filter_dict:
+            return 0, len(self.centroids)
+
+        return self.partitions.get(filter_dict[self.partition_field], (0, 0))
+
+
+def vectorize_docs(snapshot, text_fields, docs, normalize=True):
+    """
+    Vectorizes documents into the stacked column space of a fitted snapshot.
+
+    Args:
+        snapshot (IndexSnapshot): The data holding the fitted vectorizers.
+        text_fields (list): List of text field names.
+        docs (list of dict): List of documents to vectorize.
+        normalize (bool): L2-normalize every field block. Defaults to True.
+
+    Returns:
+        scipy.sparse.csr_matrix: Array of shape (len(docs), n_columns).
+    """
+    matrices = []
+
+    for field in text_fields:
+        matrix = snapshot.vectorizers[field].transform([doc.get(field, "") for doc in docs])
+        matrices.append(l2_normalize(matrix) if normalize else matrix)
+
+    return sp.hstack(matrices, format="csr")
+
+
+def compacted(snapshot, keyword_fields, id_field):
+    """
+    Returns a copy of the snapshot without its tombstoned rows.
+
+    Args:
+        snapshot (IndexSnapshot): The snapshot to compact.
+        keyword_fields (list): List of keyword field names to index.
+        id_field (str): Document field holding the document id.
+
+    Returns:
+        IndexSnapshot: The compacted snapshot.
+    """
+    if snapshot.deleted is None:
+        return snapshot
+
+    keep = np.flatnonzero(~snapshot.deleted)
+    docs = [snapshot.docs[row] for row in keep]
+
+    term_counts = snapshot.term_counts
+    if term_counts is not None:
+        term_counts = term_counts[keep]
+
+    return snapshot._replace(
+        docs=docs,
+        text_matrix=snapshot.text_matrix[keep],
+        term_counts=term_counts,
+        keyword_postings=build_keyword_postings(docs, keyword_fields),
+        id_rows=build_id_rows(docs, id_field),
+        deleted=None,
+    )
+
+
+def live_rows(snapshot, filter_dict):
+    """
+    Returns the candidate rows of a search: rows matching every keyword
+    filter that are not tombstoned.
+
+    Args:
+        snapshot (IndexSnapshot): The data to search.
+        filter_dict (dict): Dictionary of keyword fields to filter by.
+
+    Returns:
+        np.ndarray or None: Sorted array of row ids, or None for all rows.
+    """
+    rows = filter_rows(snapshot.keyword_postings, filter_dict)
+
+    if snapshot.deleted is None:
+        return rows
+    if rows is None:
+        return np.flatnonzero(~snapshot.deleted)
+
+    return rows[~snapshot.deleted[rows]]
+
+
+def collect_docs(snapshot, top_indices, scores, rows):
+    """
+    Maps top candidate positions back to documents, dropping zero scores.
+    """
+    if rows is None:
+        return [snapshot.docs[i] for i in top_indices if scores[i] > 0]
+    return [snapshot.docs[rows[i]] for i in top_indices if scores[i] > 0]
+
+
+def build_id_rows(docs, id_field):
+    """
+    Maps every document id to the list of rows holding it.
+
+    Args:
+        docs (list of dict): List of documents.
+        id_field (str): Document field holding the document id.
+
+    Returns:
+        dict: Dictionary of id -> list of row ids. Documents without an id are skipped.
+    """
+    id_rows = {}
+
+    for row, doc in enumerate(docs):
+        if id_field in doc:
+            id_rows.setdefault(doc[id_field], []).append(row)
+
+    return id_rows
+
+
+def resolve_bm25_params(text_fields, bm25_params):
+    """
+    Fills in the default BM25 parameters for every text field.
+
+    Args:
+        text_fields (list): List of text field names.
+        bm25_params (dict): Optional dictionary of {"k1": ..., "b": ...} per field.
+
+    Returns:
+        dict: Dictionary of {"k1": ..., "b": ...} for every text field.
+    """
+    if not bm25_params:
+        bm25_params = {}
+
+    return {
+        field: {**BM25_DEFAULT_PARAMS, **bm25_params.get(field, {})}
+        for field in text_fields
+    }
+
+
+def bm25_weights(term_counts, field_slices, bm25_params, deleted=None):
+    """
+    Computes the BM25 weight of every (document, term) pair.
+
+    Uses the Lucene formulation, evaluated on the non-zeros of the sparse
+    term-frequency matrix, with document lengths, average lengths and
+    document frequencies computed per field:
+
+        idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        idf(t) = ln(1 + (N - df + 0.5) / (df + 0.5))
+
+    Args:
+        term_counts (scipy.sparse.csr_matrix): Stacked term-frequency matrix.
+        field_slices (dict): Dictionary of column slices for each text field.
+        bm25_params (dict): Dictionary of {"k1": ..., "b": ...} for each text field.
+        deleted (np.ndarray): Optional boolean tombstone mask. Tombstoned rows
+            get no weights and do not count towards N, df and avgdl.
+
+    Returns:
+        scipy.sparse.csr_matrix: Matrix of BM25 weights with the same shape.
+    """
+    term_counts = sp.csr_matrix(term_counts, dtype=np.float64)
+    n_docs = term_counts.shape[0]
+
+    if deleted is not None:
+        term_counts = (sp.diags((~deleted).astype(np.float64)) @ term_counts).tocsr()
+        term_counts.eliminate_zeros()
+        n_docs -= int(deleted.sum())
+
+    blocks = []
+
+    for field, field_slice in field_slices.items():
+        block = term_counts[:, field_slice].tocsr()
+        k1 = bm25_params[field]["k1"]
+        b = bm25_params[field]["b"]
+
+        doc_len = np.asarray(block.sum(axis=1)).ravel()
+        avg_len = doc_len.sum() / max(n_docs, 1) or 1.0
+        doc_freq = np.bincount(block.indices, minlength=block.shape[1])
+        idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        length_norm = k1 * (1 - b + b * doc_len / avg_len)
+        data_rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        tf = block.data
+
+        block.data = idf[block.indices] * tf * (k1 + 1) / (tf + length_norm[data_rows])
+        blocks.append(block)
+
+    return sp.hstack(blocks, format="csr")
+
+
+def l2_normalize(matrix):
+    """
+    Scales every row of a sparse matrix to unit L2 norm. Empty rows stay empty.
+
+    Args:
+        matrix (scipy.sparse.spmatrix): The matrix to normalize.
+
+    Returns:
+        scipy.sparse.csr_matrix: The row-normalized matrix.
+    """
+    matrix = sp.csr_matrix(matrix, dtype=np.float64)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+
+    return (sp.diags(1 / norms) @ matrix).tocsr()
+
+
+def candidate_rows(matrix, rows):
+    """
+    Selects candidate rows of a dense matrix, as a view when they are contiguous.
+
+    Args:
+        matrix (np.ndarray): 2-D array.
+        rows (np.ndarray or None): Sorted row ids, or None for all rows.
+
+    Returns:
+        np.ndarray: The selected rows.
+    """
+    if rows is None:
+        return matrix
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return matrix[rows[0] : rows[-1] + 1]
+
+    return matrix[rows]
+
+
+def train_kmeans(vectors, n_clusters, n_iter=10, max_train=None, rng=None):
+    """
+    Trains k-means centroids with Lloyd iterations on (a sample of) the vectors.
+
+    Vectors are assigned by largest inner product, which on L2-normalized
+    vectors is the same as smallest Euclidean distance (spherical k-means).
+
+    Args:
+        vectors (np.ndarray): Float32 array of shape (n, dim).
+        n_clusters (int): Number of centroids, at most n.
+        n_iter (int): Number of Lloyd iterations. Defaults to 10.
+        max_train (int): Optional maximum number of sampled training vectors.
+        rng (np.random.Generator): Optional random generator.
+
+    Returns:
+        np.ndarray: Float32 array of shape (n_clusters, dim).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if max_train and len(vectors) > max_train:
+        vectors = vectors[rng.choice(len(vectors), max_train, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign_to_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Sum the vectors of every cluster with one sparse product
+        membership = sp.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (assignments, np.arange(len(vectors)))),
+            shape=(n_clusters, len(vectors)),
+        )
+        sums = np.asarray(membership @ vectors)
+
+        # Empty clusters keep their previous centroid
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+        centroids = l2_normalize_dense(centroids).astype(np.float32)
+
+    return centroids
+
+
+def assign_to_centroids(vectors, centroids, chunk_size=65536):
+    """
+    Assigns every vector to the centroid with the largest inner product.
+
+    Args:
+        vectors (np.ndarray): Float32 array of shape (n, dim).
+        centroids (np.ndarray): Float32 array of shape (n_clusters, dim).
+        chunk_size (int): Number of vectors scored at once, bounding memory use.
+
+    Returns:
+        np.ndarray: Array of n centroid ids.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start : start + chunk_size]
+        assignments[start : start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+    return assignments
+
+
+def list_rows(list_offsets, lists):
+    """
+    Returns the rows of the given inverted lists as one array.
+
+    Args:
+        list_offsets (np.ndarray): Row range of list i is
+            list_offsets[i]:list_offsets[i + 1].
+        lists (np.ndarray): Ids of the lists to gather.
+
+    Returns:
+        np.ndarray: The concatenated row ranges of the lists.
+    """
+    starts = np.asarray(list_offsets[lists], dtype=np.int64)
+    lengths = np.asarray(list_offsets[lists + 1], dtype=np.int64) - starts
+    ends = np.cumsum(lengths)
+
+    return np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + lengths, lengths)
+
+
+def l2_normalize_dense(vectors):
+    """
+    Scales every row of a dense matrix to unit L2 norm. Zero rows stay zero.
+
+    Args:
+        vectors (np.ndarray): 2-D array of embeddings.
+
+    Returns:
+        np.ndarray: The row-normalized array, same dtype.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+
+    return vectors / norms
+
+
+def build_keyword_postings(docs, keyword_fields):
+    """
+    Builds an inverted index over keyword fields.
+
+    Args:
+        docs (list of dict): List of documents to index.
+        keyword_fields (list): List of keyword field names to index.
+
+    Returns:
+        dict: Maps each field to a dictionary of value -> sorted array of row ids.
+    """
+    postings = {}
+
+    for field in keyword_fields:
+        field_postings = {}
+        for row, doc in enumerate(docs):
+            field_postings.setdefault(doc.get(field, ""), []).append(row)
+
+        postings[field] = {
+            value: np.array(field_rows, dtype=np.int64)
+            for value, field_rows in field_postings.items()
+        }
+
+    return postings
+
+
+def flatten_postings(keyword_postings):
+    """
+    Flattens keyword postings into one array for storage.
+
+    Args:
+        keyword_postings (dict): Inverted index built by `build_keyword_postings`.
+
+    Returns:
+        tuple: (posting_keys, postings, posting_offsets), where posting_keys is
+        a list of [field, value] pairs, postings the concatenated row ids and
+        posting_offsets the start of every posting list plus the total length.
+    """
+    posting_keys = []
+    postings = []
+
+    for field, field_postings in keyword_postings.items():
+        for value, rows in field_postings.items():
+            posting_keys.append([field, value])
+            postings.append(rows)
+
+    posting_offsets = np.cumsum([0] + [len(rows) for rows in postings])
+    postings = np.concatenate(postings) if postings else np.empty(0, dtype=np.int64)
+
+    return posting_keys, postings, posting_offsets
+
+
+def unflatten_postings(keyword_fields, posting_keys, postings, posting_offsets):
+    """
+    Rebuilds keyword postings from the output of `flatten_postings`.
+
+    The posting lists are views of `postings`, so memory-mapped arrays
+    are not copied.
+
+    Returns:
+        dict: Maps each field to a dictionary of value -> array of row ids.
+    """
+    keyword_postings = {field: {} for field in keyword_fields}
+
+    for position, (field, value) in enumerate(posting_keys):
+        keyword_postings[field][value] = postings[
+            posting_offsets[position] : posting_offsets[position + 1]
+        ]
+
+    return keyword_postings
+
+
+def filter_key(filter_dict, keyword_fields):
+    """
+    Returns a hashable, order-independent key for the applicable filters.
+    """
+    return tuple(
+        sorted(
+            (field, value)
+            for field, value in filter_dict.items()
+            if field in keyword_fields
+        )
+    )
+
+
+def filter_rows(keyword_postings, filter_dict):
+    """
+    Intersects the posting lists of all keyword filters.
+
+    Args:
+        keyword_postings (dict): Inverted index built by `build_keyword_postings`.
+        filter_dict (dict): Dictionary of keyword fields to filter by.
+            Filters on fields that are not indexed are ignored.
+
+    Returns:
+        np.ndarray or None: Sorted array of matching row ids, or None
+        if no filter applies.
+    """
+    rows = None
+
+    for field, value in filter_dict.items():
+        if field not in keyword_postings:
+            continue
+
+        postings = keyword_postings[field].get(value)
+        if postings is None:
+            return np.empty(0, dtype=np.int64)
+
+        if rows is None:
+            rows = postings
+        else:
+            rows = np.intersect1d(rows, postings, assume_unique=True)
+
+    return rows
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the `k` highest scores of every row, best first.
+
+    Ties are broken by the lowest column index, so the result only depends
+    on the scores and never on the partitioning algorithm.
+
+    Args:
+        scores (np.ndarray): 2-D array of scores, one row per query.
+        k (int): The number of indices to return per row.
+
+    Returns:
+        np.ndarray: 2-D array of shape (n_rows, min(k, n_columns)).
+    """
+    n_rows, n_columns = scores.shape
+    k = min(k, n_columns)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
 
-        # Use argpartition to get top num_results indices
-        top_indices = np.argpartition(scores, -num_results)[-num_results:]
-        top_indices = top_indices[np.argsort(-scores[top_indices])]
+    # k-th largest score of every row, then keep everything above it and
+    # fill up with the left-most scores equal to it
+    kth = np.partition(scores, n_columns - k, axis=1)[:, n_columns - k, np.newaxis]
+    above = scores > kth
+    equal = scores == kth
+    n_missing = k - above.sum(axis=1, keepdims=True)
+    selected = above | (equal & (np.cumsum(equal, axis=1) <= n_missing))
 
-        # Filter out zero-score results
-        top_docs = [self.docs[i] for i in top_indices if scores[i] > 0]
+    top_indices = np.nonzero(selected)[1].reshape(n_rows, k)
+    top_scores = np.take_along_axis(scores, top_indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
 
-        return top_docs
+    return np.take_along_axis(top_indices, order, axis=1)
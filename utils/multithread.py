@@ -1,7 +1,8 @@
 """
-This module provides a utility function for mapping a function
+This module provides utility functions for mapping a function
 over a sequence with progress tracking using ThreadPoolExecutor
-and tqdm for progress visualization.
+and tqdm for progress visualization, and for running independent
+calls concurrently.
 """
 
 from tqdm.auto import tqdm
@@ -39,4 +40,22 @@ def map_progress(f, seq, max_workers=1):
             result = future.result()
             results.append(result)
 
-    return results
\ No newline at end of file
+    return results
+
+
+def run_in_parallel(*fs):
+    """
+    Call independent functions concurrently, one thread each.
+
+    The total latency is that of the slowest call rather than
+    the sum of all of them.
+
+    Args:
+        *fs (callable): Functions taking no arguments.
+
+    Returns:
+        list: The results, in the order the functions were passed.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(fs), 1)) as pool:
+        futures = [pool.submit(f) for f in fs]
+        return [future.result() for future in futures]
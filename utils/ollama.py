@@ -3,12 +3,20 @@ This module provides utility functions for ollama.
 The utility functions are used to:
     1. Embed a document using specified model (must be available in ollama)
     2. Embed a batch of documents with 'questions' and 'text' keys.
-    3. ...
+    3. Embed many texts with batched, concurrent requests.
+    4. ...
+
+Embeddings are looked up in, and added to, the default embedding
+cache (see utils.embedding_cache) unless `use_cache=False` is passed.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 from tqdm.auto import tqdm
 from openai import OpenAI
 
+from utils.embedding_cache import cached_embeddings, get_embedding_cache
+
 
 def create_ollama_client(ollama_host, ollama_port):
     """
@@ -19,7 +27,9 @@ def create_ollama_client(ollama_host, ollama_port):
     )
 
 
-def get_embedding(client, text, model_name="locusai/multi-qa-minilm-l6-cos-v1"):
+def get_embedding(
+    client, text, model_name="locusai/multi-qa-minilm-l6-cos-v1", use_cache=True
+):
     """
     Get the embedding for a given text using a specified model.
 
@@ -28,41 +38,172 @@ def get_embedding(client, text, model_name="locusai/multi-qa-minilm-l6-cos-v1"):
         text (str): The text to be embedded.
         model_name (str, optional): The name of the model to use
         for embedding. Default is 'locusai/multi-qa-minilm-l6-cos-v1'.
+        use_cache (bool, optional): Use the embedding cache.
+        Default is True.
 
     Returns:
         list: The embedding of the text as a list of floats.
     """
     text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=model_name).data[0].embedding
+
+    return cached_embeddings(
+        cache=get_embedding_cache() if use_cache else None,
+        model_name=model_name,
+        texts=[text],
+        embed_fn=lambda texts: [
+            client.embeddings.create(input=texts, model=model_name).data[0].embedding
+        ],
+    )[0]
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text, at about four
+    characters per token, without loading a tokenizer.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
 
 
-def embed_documents(client, documents, model_name):
+def embedding_batches(texts, batch_size=64, max_batch_tokens=8192):
+    """
+    Split texts into batches capped by count and estimated tokens.
+
+    Args:
+        texts (list): The texts to embed.
+        batch_size (int, optional): Maximum number of texts per
+        batch. Default is 64.
+        max_batch_tokens (int, optional): Maximum estimated tokens
+        per batch. A single longer text is still sent, alone.
+        Default is 8192.
+
+    Returns:
+        list: Batches, each a list of positions in `texts`.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+
+    for position, text in enumerate(texts):
+        n_tokens = estimate_tokens(text)
+
+        if batch and (
+            len(batch) >= batch_size or batch_tokens + n_tokens > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+
+        batch.append(position)
+        batch_tokens += n_tokens
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def get_embeddings(
+    client,
+    texts,
+    model_name="locusai/multi-qa-minilm-l6-cos-v1",
+    batch_size=64,
+    max_batch_tokens=8192,
+    max_in_flight=4,
+    use_cache=True,
+):
+    """
+    Get the embeddings of many texts, packing several texts into
+    each request. Only texts missing from the embedding cache are
+    sent.
+
+    Args:
+        client: The client instance to use for generating embeddings.
+        texts (list): The texts to be embedded.
+        model_name (str, optional): The name of the model to use
+        for embedding. Default is 'locusai/multi-qa-minilm-l6-cos-v1'.
+        batch_size (int, optional): Maximum number of texts per
+        request. Default is 64.
+        max_batch_tokens (int, optional): Maximum estimated tokens
+        per request. Default is 8192.
+        max_in_flight (int, optional): Maximum number of concurrent
+        requests. Default is 4.
+        use_cache (bool, optional): Use the embedding cache.
+        Default is True.
+
+    Returns:
+        list: The embeddings as lists of floats, in the order of `texts`.
+    """
+
+    def embed_texts(texts):
+        batches = embedding_batches(texts, batch_size, max_batch_tokens)
+
+        def embed_batch(batch):
+            response = client.embeddings.create(
+                input=[texts[position] for position in batch], model=model_name
+            )
+            # The API returns one item per input, tagged with its index
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+        embeddings = [None] * len(texts)
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool, tqdm(
+            total=len(texts)
+        ) as progress:
+            for batch, batch_embeddings in zip(batches, pool.map(embed_batch, batches)):
+                for position, embedding in zip(batch, batch_embeddings):
+                    embeddings[position] = embedding
+                progress.update(len(batch))
+
+        return embeddings
+
+    return cached_embeddings(
+        cache=get_embedding_cache() if use_cache else None,
+        model_name=model_name,
+        texts=[text.replace("\n", " ") for text in texts],
+        embed_fn=embed_texts,
+    )
+
+
+def embed_documents(client, documents, model_name, **batch_params):
     """
     Embed multiple documents using a specified model.
 
+    The texts of all documents are embedded with batched requests
+    (see `get_embeddings`) rather than three requests per document.
+
     Args:
         client: The client instance to use for generating embeddings.
         documents (list): A list of documents where each document is
         a dictionary containing 'question' and 'text' fields.
         model_name (str): The name of the model to use for embedding.
+        **batch_params: batch_size, max_batch_tokens, max_in_flight
+        and use_cache of `get_embeddings`.
 
     Returns:
         list: A list of documents with added embeddings for 'text',
         'question', and combined 'question_text' fields.
     """
-    for doc in tqdm(documents):
+    fields = ["text_vector", "question_vector", "question_text_vector"]
+    texts = []
+
+    for doc in documents:
         question = doc["question"]
         text = doc["text"]
         qt = question + " " + text
+        texts.extend([text, question, qt])
+
+    embeddings = get_embeddings(
+        client=client, texts=texts, model_name=model_name, **batch_params
+    )
 
-        doc["text_vector"] = get_embedding(
-            client=client, text=text, model_name=model_name
-        )
-        doc["question_vector"] = get_embedding(
-            client=client, text=question, model_name=model_name
-        )
-        doc["question_text_vector"] = get_embedding(
-            client=client, text=qt, model_name=model_name
-        )
+    for i, doc in enumerate(documents):
+        for j, field in enumerate(fields):
+            doc[field] = embeddings[len(fields) * i + j]
 
     return documents
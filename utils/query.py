@@ -6,14 +6,17 @@ results, construct prompts from templates, and generate
 responses using language models.
 """
 
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-
 from exceptions.exceptions import (
     SearchContextWrongValueError,
+    QueryTypeWrongValueError,
     WrongPomptParams,
     ModelNotCached,
 )
-from utils.elasticsearch import elastic_search
+from utils.elasticsearch import elastic_search, knn_elastic_search
+from utils.fusion import reciprocal_rank_fusion
+from utils.hf_models import LOCAL_MODELS, get_local_model
+from utils.multithread import map_progress, run_in_parallel
+from utils.ollama import get_embedding
 from utils.utils import find_parameters, is_sublist
 
 
@@ -45,6 +48,62 @@ def search(query, index, filter_dict=None, boost=None, num_results=5):
     return results
 
 
+def search_batch(queries, index, filter_dicts=None, boost=None, num_results=5):
+    """
+    Perform many searches at once using MinSearch.
+
+    Args:
+        queries (list): The search queries.
+        index: The MinSearch index to search.
+        filter_dicts (dict or list, optional): One dictionary of
+        filters for all queries, or one dictionary per query.
+        boost (dict, optional): Dictionary of boost values.
+        num_results (int, optional): Number of results to return
+        per query. Default is 5.
+
+    Returns:
+        list: Search results, one list per query.
+    """
+    if not boost:
+        boost = {}
+
+    if not filter_dicts:
+        filter_dicts = {}
+
+    results = index.search_batch(
+        queries=queries,
+        filter_dicts=filter_dicts,
+        boost_dict=boost,
+        num_results=num_results,
+    )
+
+    return results
+
+
+def vector_search(query_vector, index, filter_dict=None, num_results=5):
+    """
+    Perform an exact kNN search using a MinSearch VectorIndex.
+
+    Args:
+        query_vector (list): The query embedding.
+        index: The MinSearch VectorIndex to search.
+        filter_dict (dict, optional): Dictionary of filters.
+        num_results (int, optional): Number of results to return.
+        Default is 5.
+
+    Returns:
+        list: Search results.
+    """
+    if not filter_dict:
+        filter_dict = {}
+
+    results = index.search(
+        query_vector=query_vector, filter_dict=filter_dict, num_results=num_results
+    )
+
+    return results
+
+
 def build_context(search_results):
     """
     Build context from search results.
@@ -109,6 +168,9 @@ def llm(client, prompt, model_name="gpt-4o", generate_params=None):
         generate_params (dict, optional): Additional parameters
         for generation.
 
+    Local models (see utils.hf_models) are loaded once per process,
+    and concurrent calls are generated together in padded batches.
+
     Returns:
         str: The generated response.
     """
@@ -121,23 +183,8 @@ def llm(client, prompt, model_name="gpt-4o", generate_params=None):
         )
         result = response.choices[0].message.content
 
-    elif model_name == "google/flan-t5-small":
-        tokenizer = T5Tokenizer.from_pretrained(model_name)
-        llm_model = T5ForConditionalGeneration.from_pretrained(
-            model_name, device_map="auto"
-        )
-
-        input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to("cuda")
-        outputs = llm_model.generate(
-            input_ids,
-            max_length=generate_params.get("max_length", 100),
-            num_beams=generate_params.get("num_beams", 5),
-            do_sample=generate_params.get("do_sample", False),
-            temperature=generate_params.get("temperature", 1.0),
-            top_k=generate_params.get("top_k", 50),
-            top_p=generate_params.get("top_p", 0.95),
-        )
-        result = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    elif model_name in LOCAL_MODELS:
+        result = get_local_model(model_name).submit(prompt, generate_params).result()
 
     else:
         raise ModelNotCached(
@@ -147,45 +194,134 @@ def llm(client, prompt, model_name="gpt-4o", generate_params=None):
     return result
 
 
+def llm_batch(client, prompts, model_name="gpt-4o", generate_params=None, max_workers=1):
+    """
+    Generate responses for many prompts.
+
+    Local models generate them in padded batches, the others with
+    `max_workers` concurrent requests.
+
+    Args:
+        client: The client instance to use for generating responses.
+        prompts (list): The prompts to send to the model.
+        model_name (str, optional): The name of the model to use.
+        Default is 'gpt-4o'.
+        generate_params (dict, optional): Additional parameters
+        for generation.
+        max_workers (int, optional): Concurrent requests to API
+        models. Default is 1.
+
+    Returns:
+        list: The generated responses, in the order of `prompts`.
+    """
+    if model_name in LOCAL_MODELS:
+        return get_local_model(model_name).generate(prompts, generate_params)
+
+    return map_progress(
+        lambda prompt: llm(client, prompt, model_name, generate_params),
+        prompts,
+        max_workers=max_workers,
+    )
+
+
 def rag(**kwargs):
     """
     Perform Retrieval-Augmented Generation (RAG).
 
     Args:
         **kwargs: Arbitrary keyword arguments including query,
-        search_context, index, es_client, index_name, filter_dict,
-        boost, num_results, prompt_template_path, client,
-        model_name, and generate_params.
+        search_context, query_type, index, vector_index, es_client,
+        index_name, filter_dict, boost, num_results,
+        prompt_template_path, client, model_name, generate_params,
+        embedding_client, embedding_model_name, vector_field,
+        fusion_weights and rank_window_size.
+
+        query_type is 'text' (default), 'vector' or 'hybrid'. Hybrid
+        runs text and vector retrieval concurrently, each returning
+        rank_window_size results (default 2 * num_results), and fuses
+        them with reciprocal rank fusion.
 
     Returns:
         str: The generated answer.
 
     Raises:
         SearchContextWrongValueError: If search_context is invalid.
+        QueryTypeWrongValueError: If query_type is invalid.
     """
     query = kwargs.get("query")
     search_context = kwargs.get("search_context", "minsearch")
+    query_type = kwargs.get("query_type", "text")
+    filter_dict = kwargs.get("filter_dict")
+    num_results = kwargs.get("num_results")
 
-    if search_context == "minsearch":
-        search_results = search(
-            query=query,
-            index=kwargs.get("index"),
-            filter_dict=kwargs.get("filter_dict"),
-            boost=kwargs.get("boost"),
-            num_results=kwargs.get("num_results"),
+    if search_context not in ["minsearch", "elasticsearch"]:
+        raise SearchContextWrongValueError(
+            "Parameter `search_context` value must be in ['minsearch', 'elasticsearch'] or None"
+        )
+
+    if query_type not in ["text", "vector", "hybrid"]:
+        raise QueryTypeWrongValueError(
+            "Parameter `query_type` value must be in ['text', 'vector', 'hybrid'] or None"
         )
-    elif search_context == "elasticsearch":
-        search_results = elastic_search(
+
+    def retrieve_text(size):
+        if search_context == "minsearch":
+            return search(
+                query=query,
+                index=kwargs.get("index"),
+                filter_dict=filter_dict,
+                boost=kwargs.get("boost"),
+                num_results=size,
+            )
+        return elastic_search(
             query=query,
             es_client=kwargs.get("es_client"),
             index_name=kwargs.get("index_name"),
-            filter_dict=kwargs.get("filter_dict"),
+            filter_dict=filter_dict,
             boost=kwargs.get("boost"),
-            num_results=kwargs.get("num_results"),
+            num_results=size,
+        )
+
+    def retrieve_vector(size):
+        query_vector = get_embedding(
+            client=kwargs.get("embedding_client", kwargs.get("client")),
+            text=query,
+            model_name=kwargs.get(
+                "embedding_model_name", "locusai/multi-qa-minilm-l6-cos-v1"
+            ),
         )
+        if search_context == "minsearch":
+            return vector_search(
+                query_vector=query_vector,
+                index=kwargs.get("vector_index"),
+                filter_dict=filter_dict,
+                num_results=size,
+            )
+        hits = knn_elastic_search(
+            es_client=kwargs.get("es_client"),
+            index_name=kwargs.get("index_name"),
+            query_vector=query_vector,
+            filter_dict=filter_dict or {},
+            field=kwargs.get("vector_field", "question_text_vector"),
+            k=size,
+            num_results=size,
+        )
+        return [hit["_source"] for hit in hits]
+
+    if query_type == "text":
+        search_results = retrieve_text(num_results)
+    elif query_type == "vector":
+        search_results = retrieve_vector(num_results)
     else:
-        raise SearchContextWrongValueError(
-            "Parameter `search_context` value must be in ['minsearch', 'elasticsearch'] or None"
+        num_results = num_results or 5
+        rank_window_size = kwargs.get("rank_window_size", 2 * num_results)
+        search_results = reciprocal_rank_fusion(
+            run_in_parallel(
+                lambda: retrieve_text(rank_window_size),
+                lambda: retrieve_vector(rank_window_size),
+            ),
+            weights=kwargs.get("fusion_weights"),
+            num_results=num_results,
         )
 
     context = build_context(search_results)